@@ -0,0 +1,230 @@
+"""
+The purpose of conftest.py is to give every test a Flask application on a temporary database and temporary csv files.
+
+The csv files are synthetic and written from a seeded random generator, so every run has the same theaters, movies, users,
+screenings (the coming seven days) and bookings. The real database and the csv files of the static folder are never touched.
+"""
+# Import the application factory and the database object of the website package
+from website import create_app, db
+# Imports the models used to describe the dataset to the tests
+from website.models import Screening, User, Theater, Booking, screening_booking
+# Import the fieldnames of booking.csv, the password policy and the csv persistence layer to write the synthetic files
+from website.reservations import BOOKING_FIELDNAMES
+from website.passwords import PasswordPolicy
+from website.csvstore import csv_file
+# Import pytest to define the fixtures
+import pytest
+# Import the modules used to build the dataset
+from datetime import date, datetime, timedelta
+import csv
+import os
+import random
+
+# The seed of the synthetic dataset, the same seed writes the same files
+SEED = 1
+
+# The password of every synthetic user
+PASSWORD = 'test-password'
+
+# A cheap hash method for the synthetic users, so the login latency measures the page and not the hash
+# ('flask password-benchmark' measures the hash methods)
+HASH_METHOD = 'pbkdf2:sha256:1000'
+
+# The size of the synthetic dataset the PERFORMANCE_BUDGETS setting is made for
+THEATERS = 10
+MOVIES = 8
+MOVIES_PER_THEATER = 5
+USERS = 50
+BOOKINGS = 1000
+DAYS = 7
+
+# The show times a synthetic movie can have
+SHOW_TIMES = ['10:00', '12:30', '15:00', '17:30', '20:00', '22:30']
+
+
+def write_synthetic_csvs(folder, seed=SEED):
+    """
+    Write the csv files of a synthetic cinema into a folder: the screenings of the coming days, with bookings spread over them.
+
+    Args:
+        folder (str): The folder of the csv files.
+        seed (int): The seed of the random generator.
+
+    Returns:
+        dict: The number of rows of every csv file by name.
+    """
+    rng = random.Random(seed)
+    # Every synthetic user has the same password, so its hash is computed once
+    password = PasswordPolicy(HASH_METHOD).hash(PASSWORD)
+    users = [{'email': f"user{number}@test.invalid", 'password': password, 'first_name': 'Test', 'last_name': f"User{number}"}
+             for number in range(1, USERS + 1)]
+    movies = [{'title': f"Movie {number}", 'price': round(rng.uniform(8, 15), 2), 'release_date': '2020-01-01',
+               'show_times': ", ".join(sorted(rng.sample(SHOW_TIMES, 3)))}
+              for number in range(1, MOVIES + 1)]
+    theaters = [{'theater_name': f"Theater {number}", 'number_of_seats': rng.choice([100, 150, 200]),
+                 'available_movies': ", ".join(movie['title'] for movie in rng.sample(movies, MOVIES_PER_THEATER))}
+                for number in range(1, THEATERS + 1)]
+    # The ids of the rows are their positions, as the loader numbers movies and theaters in file order
+    movie_ids = {movie['title']: number for number, movie in enumerate(movies, start=1)}
+
+    screenings = []
+    for day in range(DAYS):
+        screening_date = date.today() + timedelta(days=day)
+        for theater_id, theater in enumerate(theaters, start=1):
+            for title in theater['available_movies'].split(", "):
+                movie = movies[movie_ids[title] - 1]
+                for show_time in movie['show_times'].split(", "):
+                    screenings.append({'id': len(screenings) + 1, 'date': screening_date, 'time': f"{show_time}:00",
+                                       'available_seats': theater['number_of_seats'], 'theater_id': theater_id, 'movie_id': movie_ids[title]})
+
+    bookings = []
+    for number in range(1, BOOKINGS + 1):
+        screening = rng.choice(screenings)
+        tickets = min(rng.randint(1, 4), screening['available_seats'])
+        if not tickets:
+            continue
+        screening['available_seats'] -= tickets
+        user_id = rng.randint(1, USERS)
+        user = users[user_id - 1]
+        bookings.append({'transaction_id': len(bookings) + 1, 'user_id': user_id,
+                         'customer_name': f"{user['first_name']} {user['last_name']}", 'number_of_tickets': tickets,
+                         'date': screening['date'], 'time': screening['time'], 'movie_id': screening['movie_id'],
+                         'screening_id': screening['id'], 'timestamp': datetime(2020, 1, 1) + timedelta(seconds=number)})
+
+    files = {
+        'user': (['email', 'password', 'first_name', 'last_name'], users),
+        'movie': (['title', 'price', 'release_date', 'show_times'], movies),
+        'theater': (['theater_name', 'number_of_seats', 'available_movies'], theaters),
+        'screening': (['id', 'date', 'time', 'available_seats', 'theater_id', 'movie_id'], screenings),
+        'booking': (BOOKING_FIELDNAMES, bookings),
+    }
+    # Plain csv files without checksums, like the files of the static folder
+    for name, (fieldnames, rows) in files.items():
+        with open(os.path.join(folder, f"{name}.csv"), 'w', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=fieldnames)
+            writer.writeheader()
+            writer.writerows(rows)
+    return {name: len(rows) for name, (_, rows) in files.items()}
+
+
+def logged_in_client(app, user_id):
+    """
+    Return a test client that is logged in as a user.
+
+    Args:
+        app (Flask): Flask application object
+        user_id (int): The ID of the user.
+
+    Returns:
+        FlaskClient: The test client.
+    """
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+    return client
+
+
+def seat_problems(paths):
+    """
+    Compare the seats of every screening in the database, in screening.csv and from the booked tickets.
+
+    Args:
+        paths (dict): A dictionary containing the absolute paths of the csv files.
+
+    Returns:
+        list: The IDs of the screenings whose seats do not agree, empty if they all agree.
+    """
+    database_seats = dict(db.session.query(Screening.id, Screening.available_seats))
+    _, rows = csv_file(paths['screening']).read()
+    csv_seats = {int(row['id']): int(row['available_seats']) for row in rows}
+    capacities = dict(db.session.query(Screening.id, Theater.number_of_seats).join(Theater, Theater.id == Screening.theater_id))
+    booked = dict(db.session.query(screening_booking.c.screening_id, db.func.sum(Booking.number_of_tickets))
+                  .join(Booking, Booking.id == screening_booking.c.booking_id)
+                  .group_by(screening_booking.c.screening_id))
+    problems = [screening_id for screening_id, seats in database_seats.items()
+                if csv_seats.get(screening_id) != seats or seats != capacities[screening_id] - booked.get(screening_id, 0) or seats < 0]
+    return sorted(problems + [screening_id for screening_id in csv_seats if screening_id not in database_seats])
+
+
+def seats_of(app, *screening_ids):
+    """
+    Read the available seats of screenings from the database.
+
+    Args:
+        app (Flask): Flask application object
+        screening_ids (int): The IDs of the screenings.
+
+    Returns:
+        list: The available seats of every screening, in the same order.
+    """
+    with app.app_context():
+        return [db.session.get(Screening, screening_id).available_seats for screening_id in screening_ids]
+
+
+@pytest.fixture
+def csv_sizes(tmp_path):
+    """
+    Write the synthetic csv files into the 'csv' folder of the test's temporary directory.
+
+    Returns:
+        dict: The number of rows of every csv file by name.
+    """
+    folder = tmp_path / 'csv'
+    folder.mkdir()
+    return write_synthetic_csvs(str(folder))
+
+
+@pytest.fixture
+def make_app(tmp_path, csv_sizes):
+    """
+    Return a function that creates the application on the temporary database and csv files, loading them on creation.
+    Its keyword arguments (for example shard_count) are passed on to create_app().
+
+    Every application it created has its database connections closed when the test ends.
+    """
+    apps = []
+
+    def make(**options):
+        app = create_app(database_uri=f"sqlite:///{tmp_path / 'test.db'}", csv_folder=str(tmp_path / 'csv'), **options)
+        # The tests check the pages, not the rate limits or the cost of the password hash
+        app.config['RATE_LIMITS'] = {}
+        app.config['PASSWORD_HASH_METHOD'] = HASH_METHOD
+        apps.append(app)
+        return app
+
+    yield make
+    for app in apps:
+        with app.app_context():
+            db.engine.dispose()
+
+
+@pytest.fixture
+def app(make_app):
+    """
+    The application, with the synthetic csv files loaded into its temporary database.
+    """
+    return make_app()
+
+
+@pytest.fixture
+def client(app):
+    """
+    A test client logged in as the first synthetic user.
+    """
+    return logged_in_client(app, 1)
+
+
+@pytest.fixture
+def dataset(app):
+    """
+    The facts the requests of BUDGET_REQUESTS (see querybudget.py) need, taken from the synthetic dataset.
+    """
+    with app.app_context():
+        screenings = Screening.query.order_by(Screening.id).limit(3).all()
+        user = db.session.get(User, 1)
+        today = date.today()
+        return {'email': user.email, 'password': PASSWORD, 'user_id': user.id,
+                'start': today, 'end': today + timedelta(days=DAYS - 1),
+                'screening_id': screenings[0].id, 'theater_id': screenings[0].theater_id,
+                'group_selection': [f"{screening.theater_id}:{screening.id}" for screening in screenings]}
@@ -0,0 +1,74 @@
+"""
+The purpose of test_admission.py is to test that the waiting room of the booking routes only keeps gates for screenings
+that exist and are in use.
+"""
+from website.admission import AdmissionController, admission_controller
+from website.models import Screening
+from website import db
+import threading
+
+
+def test_gate_is_dropped_when_idle():
+    controller = AdmissionController(max_active=1, max_queue=10, wait_seconds=0, retry_after=1)
+    first = controller.admit(1)
+    assert first.admitted
+    # The second request waits in the queue, which keeps the gate while the first one runs
+    second = controller.admit(1)
+    assert not second.admitted and second.position == 1
+    controller.release(1)
+    assert 1 in controller._gates
+    assert controller.admit(1, second.ticket).admitted
+    controller.release(1)
+    assert controller._gates == {}
+
+
+def test_gate_of_abandoned_queue_is_dropped():
+    controller = AdmissionController(max_active=1, max_queue=10, wait_seconds=0, retry_after=0)
+    assert controller.admit(1).admitted
+    assert not controller.admit(1).admitted
+    controller.release(1)
+    # Nobody came back for the waiting request, so the next new gate sweeps the old one away
+    assert controller.admit(2).admitted
+    assert list(controller._gates) == [2]
+    controller.release(2)
+    assert controller._gates == {}
+
+
+def test_no_gate_for_missing_screening():
+    controller = AdmissionController(max_active=1, max_queue=10, wait_seconds=0, retry_after=1)
+    assert controller.admit(1, exists=lambda screening_id: False) is None
+    assert controller._gates == {}
+
+
+def test_concurrent_requests_leave_no_gates():
+    controller = AdmissionController(max_active=2, max_queue=100, wait_seconds=5, retry_after=1)
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def book():
+        assert controller.admit(7).admitted
+        with lock:
+            running.append(1)
+            peak.append(len(running))
+        with lock:
+            running.pop()
+        controller.release(7)
+
+    threads = [threading.Thread(target=book) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert max(peak) <= 2
+    assert controller._gates == {}
+
+
+def test_booking_route_makes_no_gate_for_missing_screening(app, client):
+    app.config['ADMISSION_CONTROL'] = True
+    with app.app_context():
+        missing = db.session.query(db.func.max(Screening.id)).scalar() + 1000
+    response = client.post('/getTicket', data={'number_of_ticket': 1, 'booked_screening': missing,
+                                               'booked_theater': 1, 'idempotency_key': 'missing-screening'})
+    assert response.status_code < 500
+    assert admission_controller(app)._gates == {}
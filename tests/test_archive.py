@@ -0,0 +1,66 @@
+"""
+The purpose of test_archive.py is to test that archiving moves screenings and their bookings out of the hot tables and csv files.
+"""
+from website import db, get_csv_paths
+from website.models import Screening, Booking, ArchivedBooking, screening_booking
+from website.csvstore import csv_file
+from website.listings import listing_differences
+from website import archive
+from conftest import seat_problems
+from datetime import date, timedelta
+import pytest
+
+
+def test_archive_moves_bookings_from_the_database(app):
+    cutoff = date.today() + timedelta(days=2)
+    with app.app_context():
+        paths = get_csv_paths()
+        expected = dict(db.session.query(Booking.id, Booking.number_of_tickets)
+                        .join(screening_booking, screening_booking.c.booking_id == Booking.id)
+                        .join(Screening, Screening.id == screening_booking.c.screening_id)
+                        .filter(Screening.date < cutoff))
+        screenings = Screening.query.filter(Screening.date < cutoff).count()
+
+        assert archive.archive_screenings(cutoff, paths) == (screenings, len(expected))
+
+        assert Screening.query.filter(Screening.date < cutoff).count() == 0
+        assert dict(db.session.query(ArchivedBooking.id, ArchivedBooking.number_of_tickets)) == expected
+        _, archived_rows = csv_file(paths['booking_archive']).read()
+        assert {int(row['transaction_id']): int(row['number_of_tickets']) for row in archived_rows} == expected
+        _, booking_rows = csv_file(paths['booking']).read()
+        assert len(booking_rows) == Booking.query.count()
+        assert seat_problems(paths) == []
+        assert listing_differences(db.session) == []
+
+
+def test_interrupted_archive_is_finished_by_the_next_run(app, monkeypatch):
+    cutoff = date.today() + timedelta(days=2)
+
+    def fail(row):
+        raise ValueError("broken row")
+
+    with app.app_context():
+        paths = get_csv_paths()
+        expected = {booking_id for (booking_id,) in db.session.query(Booking.id)
+                    .join(screening_booking, screening_booking.c.booking_id == Booking.id)
+                    .join(Screening, Screening.id == screening_booking.c.screening_id)
+                    .filter(Screening.date < cutoff)}
+        # The run stops after the csv files were written, before the database committed
+        monkeypatch.setattr(archive, 'archived_booking', fail)
+        with pytest.raises(ValueError):
+            archive.archive_screenings(cutoff, paths)
+        db.session.rollback()
+        assert Screening.query.filter(Screening.date < cutoff).count() > 0
+        assert ArchivedBooking.query.count() == 0
+
+        # The next run archives the same screenings without writing their bookings to the archive twice
+        monkeypatch.undo()
+        archive.archive_screenings(cutoff, paths)
+        _, archived_rows = csv_file(paths['booking_archive']).read()
+        assert sorted(int(row['transaction_id']) for row in archived_rows) == sorted(expected)
+        assert {booking_id for (booking_id,) in db.session.query(ArchivedBooking.id)} == expected
+        assert Screening.query.filter(Screening.date < cutoff).count() == 0
+        _, booking_rows = csv_file(paths['booking']).read()
+        assert len(booking_rows) == Booking.query.count()
+        assert seat_problems(paths) == []
+        assert listing_differences(db.session) == []
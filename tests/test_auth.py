@@ -0,0 +1,31 @@
+"""
+The purpose of test_auth.py is to test registering and logging in.
+"""
+from website import get_csv_paths
+from website.models import User
+from website.csvstore import csv_file
+from conftest import PASSWORD
+
+
+def test_register_writes_the_database_and_user_csv(app):
+    email = 'new@test.invalid'
+    response = app.test_client().post('/register', data={'email': email, 'firstName': 'New', 'lastName': 'User',
+                                                         'password1': PASSWORD, 'password2': PASSWORD})
+    assert response.status_code == 302
+    with app.app_context():
+        assert User.query.filter_by(email=email).count() == 1
+        _, rows = csv_file(get_csv_paths()['user']).read()
+        assert [row['email'] for row in rows].count(email) == 1
+
+
+def test_wrong_password_does_not_log_in(app):
+    client = app.test_client()
+    client.post('/login', data={'email': 'user1@test.invalid', 'password': 'not-the-password'})
+    assert client.get('/myBooking').status_code == 302
+
+
+def test_right_password_logs_in(app):
+    client = app.test_client()
+    response = client.post('/login', data={'email': 'user1@test.invalid', 'password': PASSWORD})
+    assert response.location.endswith('/')
+    assert client.get('/myBooking').status_code == 200
@@ -0,0 +1,145 @@
+"""
+The purpose of test_booking.py is to test the ticket and group booking pages, and that the seats in the database,
+screening.csv and booking.csv always agree with the bookings.
+"""
+from website import db, get_csv_paths
+from website.models import Screening, Booking
+from website.listings import listing_differences
+from website.csvstore import csv_file
+from website.idempotency import claim_idempotency_key, find_idempotency_key
+from website import views
+from conftest import logged_in_client, seat_problems, seats_of
+import re
+import threading
+
+
+def emptiest_screenings(app, number):
+    """
+    Return the screenings with the most seats left, so every booking in a test has seats to take.
+
+    Args:
+        app (Flask): Flask application object
+        number (int): The number of screenings.
+
+    Returns:
+        list: (screening ID, theater ID) pairs.
+    """
+    with app.app_context():
+        return [(screening.id, screening.theater_id) for screening in
+                Screening.query.order_by(Screening.available_seats.desc(), Screening.id).limit(number)]
+
+
+def assert_consistent(app):
+    """
+    Assert that the seats, booking.csv and the screening listing agree with the bookings in the database.
+    """
+    with app.app_context():
+        paths = get_csv_paths()
+        assert seat_problems(paths) == []
+        _, rows = csv_file(paths['booking']).read()
+        assert len(rows) == Booking.query.count()
+        assert listing_differences(db.session) == []
+
+
+def test_booking_sent_twice_takes_its_seats_once(app, client):
+    [(screening_id, theater_id)] = emptiest_screenings(app, 1)
+    response = client.post('/getTicket', data={'screening_id': screening_id, 'theater_id': theater_id})
+    key = re.search(rb'name="idempotency_key" value="([^"]+)"', response.data).group(1).decode()
+    [before] = seats_of(app, screening_id)
+    for _ in range(2):
+        response = client.post('/getTicket', data={'number_of_ticket': 3, 'booked_screening': screening_id,
+                                                   'booked_theater': theater_id, 'idempotency_key': key})
+        assert response.location.endswith('/myBooking')
+    assert seats_of(app, screening_id) == [before - 3]
+    assert_consistent(app)
+
+
+def test_booking_for_too_many_seats_is_refused(app, client):
+    [(screening_id, theater_id)] = emptiest_screenings(app, 1)
+    [before] = seats_of(app, screening_id)
+    response = client.post('/getTicket', data={'number_of_ticket': before + 1, 'booked_screening': screening_id,
+                                               'booked_theater': theater_id})
+    assert response.location.endswith('/currentMovies')
+    assert seats_of(app, screening_id) == [before]
+    assert_consistent(app)
+
+
+def test_group_booking_is_all_or_nothing(app, client):
+    (first, first_theater), (second, second_theater) = emptiest_screenings(app, 2)
+    before = seats_of(app, first, second)
+    form = {'booked_screenings': [f"{first_theater}:{first}", f"{second_theater}:{second}"],
+            f"tickets_{first}": 2, f"tickets_{second}": before[1] + 1}
+    client.post('/groupTicket', data=form)
+    assert seats_of(app, first, second) == before
+    form[f"tickets_{second}"] = 2
+    client.post('/groupTicket', data=form)
+    assert seats_of(app, first, second) == [before[0] - 2, before[1] - 2]
+    assert_consistent(app)
+
+
+def test_concurrent_bookings_never_oversell(app):
+    [(screening_id, theater_id)] = emptiest_screenings(app, 1)
+    [left] = seats_of(app, screening_id)
+    threads_count = 8
+    # Only five of the eight bookings fit
+    tickets = left // 5
+
+    def book(user_id):
+        logged_in_client(app, user_id).post('/getTicket', data={'number_of_ticket': tickets, 'booked_screening': screening_id,
+                                                                  'booked_theater': theater_id})
+
+    threads = [threading.Thread(target=book, args=(user_id,)) for user_id in range(2, 2 + threads_count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert seats_of(app, screening_id) == [left - (left // tickets) * tickets]
+    assert_consistent(app)
+
+
+def test_repeated_key_of_a_booking_still_processing_does_not_book(app, client):
+    [(screening_id, theater_id)] = emptiest_screenings(app, 1)
+    [before] = seats_of(app, screening_id)
+    # The first submission claimed the key and has not stored its booking yet
+    with app.app_context():
+        claim_idempotency_key('still-processing', 1)
+    response = client.post('/getTicket', data={'number_of_ticket': 1, 'booked_screening': screening_id,
+                                               'booked_theater': theater_id, 'idempotency_key': 'still-processing'},
+                           follow_redirects=True)
+    assert b'still being processed' in response.data
+    assert seats_of(app, screening_id) == [before]
+
+
+def test_key_of_another_user_shows_nothing_of_the_booking(app, client):
+    [(screening_id, theater_id)] = emptiest_screenings(app, 1)
+    form = {'number_of_ticket': 1, 'booked_screening': screening_id, 'booked_theater': theater_id, 'idempotency_key': 'first-user'}
+    assert client.post('/getTicket', data=form).location.endswith('/myBooking')
+    [before] = seats_of(app, screening_id)
+    # A second user sending the same key neither books nor sees the first user's booking
+    response = logged_in_client(app, 2).post('/getTicket', data=form, follow_redirects=True)
+    assert b'The booking was not completed' in response.data
+    assert seats_of(app, screening_id) == [before]
+    with app.app_context():
+        assert find_idempotency_key('first-user', 2) is None
+        assert find_idempotency_key('first-user', 1).booking_id is not None
+
+
+def test_failed_booking_releases_its_key(app, client, monkeypatch):
+    [(screening_id, theater_id)] = emptiest_screenings(app, 1)
+    [before] = seats_of(app, screening_id)
+    form = {'number_of_ticket': 2, 'booked_screening': screening_id, 'booked_theater': theater_id, 'idempotency_key': 'failing'}
+
+    def fail(reservations, paths):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(views, 'reserve_batch', fail)
+    assert client.post('/getTicket', data=form).status_code == 500
+    with app.app_context():
+        assert find_idempotency_key('failing', 1) is None
+    # The retry with the same key books the tickets
+    monkeypatch.undo()
+    assert client.post('/getTicket', data=form).location.endswith('/myBooking')
+    assert seats_of(app, screening_id) == [before - 2]
+    with app.app_context():
+        assert find_idempotency_key('failing', 1).booking_id is not None
+    assert_consistent(app)
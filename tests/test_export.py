@@ -0,0 +1,37 @@
+"""
+The purpose of test_export.py is to test the export of the booking history into Parquet files.
+"""
+from website import db, get_csv_paths
+from website.models import Booking, User, ArchivedBooking
+from website.export import export_bookings
+from website.archive import archive_screenings
+from datetime import date, timedelta
+import pytest
+
+pq = pytest.importorskip('pyarrow.parquet')
+
+
+def test_export_has_every_booking_with_its_customer(app, tmp_path):
+    with app.app_context():
+        counts = export_bookings(str(tmp_path / 'export'), chunk_size=100)
+        expected = dict(db.session.query(Booking.id, User.first_name + " " + User.last_name).join(User, User.id == Booking.user_id))
+    table = pq.read_table(str(tmp_path / 'export')).to_pydict()
+    assert sum(counts.values()) == len(expected)
+    assert dict(zip(table['booking_id'], table['customer_name'])) == expected
+
+
+def test_export_includes_the_archived_bookings(app, tmp_path):
+    with app.app_context():
+        booking_ids = {booking_id for (booking_id,) in db.session.query(Booking.id)}
+        # Archive the screenings of the first days, so part of the history is only in the archive
+        archived, bookings = archive_screenings(date.today() + timedelta(days=2), get_csv_paths())
+        assert archived and bookings
+        archived_ids = {booking_id for (booking_id,) in db.session.query(ArchivedBooking.id)}
+        counts = export_bookings(str(tmp_path / 'export'), chunk_size=100)
+    table = pq.read_table(str(tmp_path / 'export')).to_pydict()
+    assert sum(counts.values()) == len(booking_ids)
+    assert set(table['booking_id']) == booking_ids
+    assert archived_ids <= booking_ids
+    # The rows are written in sale order, archived or not
+    sales = [(timestamp, booking_id) for booking_id, timestamp in zip(table['booking_id'], table['timestamp'])]
+    assert sales == sorted(sales)
@@ -0,0 +1,53 @@
+"""
+The purpose of test_listing.py is to test that the currentMovies page lists the screenings that were searched for,
+and that the screening_listing read model stays the same as the live join of the screenings, theaters and movies.
+"""
+from website import db, get_csv_paths
+from website.models import Screening, ScreeningListing
+from website.listings import listing_differences
+from website.pricing import reprice_screenings
+from website.archive import archive_screenings
+from conftest import DAYS
+from datetime import date, timedelta
+import pytest
+
+
+@pytest.mark.parametrize('days, theater_id', [(1, None), (DAYS, None), (DAYS, 1)])
+def test_listing_shows_every_screening_searched_for(app, client, days, theater_id):
+    start, end = date.today(), date.today() + timedelta(days=days - 1)
+    form = {'start_date': str(start), 'end_date': str(end), 'theater_id': str(theater_id or '')}
+    response = client.post('/currentMovies', data=form)
+    with app.app_context():
+        query = Screening.query.filter(Screening.date.between(start, end))
+        if theater_id:
+            query = query.filter(Screening.theater_id == theater_id)
+        expected = query.count()
+    assert response.status_code == 200
+    assert response.data.count(b'name="screening_id"') == expected
+
+
+def test_listing_shows_seats_and_prices(app, client):
+    response = client.post('/currentMovies', data={'start_date': str(date.today())})
+    with app.app_context():
+        screening = Screening.query.filter(Screening.date == date.today()).first()
+    assert f"${screening.price:.2f}".encode() in response.data
+
+
+def test_listing_follows_bookings_prices_and_archiving(app, client):
+    with app.app_context():
+        screenings = [(screening.id, screening.theater_id) for screening in
+                      Screening.query.order_by(Screening.available_seats.desc()).limit(3)]
+    # Book, which changes the seats and the dynamic prices of the booked screenings
+    for screening_id, theater_id in screenings:
+        client.post('/getTicket', data={'number_of_ticket': 20, 'booked_screening': screening_id, 'booked_theater': theater_id})
+    with app.app_context():
+        assert listing_differences(db.session) == []
+        # Reprice every screening with other rules
+        app.config['PRICING_RULES'] = {**app.config['PRICING_RULES'], 'minimum_price': 30.0}
+        assert reprice_screenings(db.session) > 0
+        db.session.commit()
+        assert listing_differences(db.session) == []
+        # Archive the screenings of the first days
+        archive_screenings(date.today() + timedelta(days=2), get_csv_paths())
+        assert listing_differences(db.session) == []
+        assert ScreeningListing.query.count() == Screening.query.count()
@@ -0,0 +1,86 @@
+"""
+The purpose of test_loader.py is to test the startup load of the csv files.
+"""
+from website import create_app, init_database, db, get_csv_paths
+from website.models import Screening, ScreeningListing
+from website.csvstore import csv_file
+from website.listings import listing_differences
+from conftest import seat_problems, THEATERS, MOVIES_PER_THEATER
+from datetime import date, timedelta
+import csv
+import threading
+
+
+def rewrite_screenings(path, change):
+    with open(path, newline='') as file:
+        rows = list(csv.DictReader(file))
+    rows = change(rows)
+    with open(path, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def test_csv_file_streams_the_same_rows_it_reads(tmp_path, csv_sizes):
+    path = str(tmp_path / 'csv' / 'booking.csv')
+    with open(path, 'a') as file:
+        file.write("9999,1,Torn Row,2,2020-01")
+    streamed = list(csv_file(path).stream())
+    assert streamed == csv_file(path).read()[1]
+    assert len(streamed) == csv_sizes['booking']
+
+
+def test_timings_count_the_rows_of_every_step(make_app, tmp_path):
+    # Keep the screenings of the first three days, the load schedules the other days
+    cutoff = str(date.today() + timedelta(days=3))
+    rewrite_screenings(tmp_path / 'csv' / 'screening.csv', lambda rows: [row for row in rows if row['date'] < cutoff])
+    app = make_app()
+    timings = app.config['STARTUP_TIMINGS']
+    with app.app_context():
+        screenings = Screening.query.count()
+    assert timings['lineup']['rows'] == THEATERS * MOVIES_PER_THEATER
+    assert timings['new_screenings']['rows'] == screenings - timings['screenings']['rows'] > 0
+    assert timings['screening_dates']['rows'] == 7
+    assert timings['total']['rows'] == sum(timing['rows'] for name, timing in timings.items() if name != 'total')
+
+
+def test_duplicate_screening_ids_are_numbered_by_position(make_app, tmp_path):
+    # An older version wrote a repeated id into the middle of the file; the bookings point at the positions
+    def repeat_an_id(rows):
+        rows[len(rows) // 2]['id'] = rows[0]['id']
+        return rows
+
+    rewrite_screenings(tmp_path / 'csv' / 'screening.csv', repeat_an_id)
+    app = make_app()
+    with app.app_context():
+        paths = get_csv_paths()
+        ids = [int(row['id']) for row in csv_file(paths['screening']).read()[1]]
+        assert ids == list(range(1, len(ids) + 1))
+        assert [screening_id for (screening_id,) in db.session.query(Screening.id).order_by(Screening.id)] == ids
+        assert app.config['STARTUP_TIMINGS']['screenings']['rows'] == len(ids)
+        assert seat_problems(paths) == []
+        assert listing_differences(db.session) == []
+
+
+def test_malformed_row_stops_the_load(tmp_path, csv_sizes):
+    # One bad booking, with batches of one row and a queue of two, so the other parsers are blocked on a full queue
+    with open(tmp_path / 'csv' / 'booking.csv', 'a') as file:
+        file.write("99999,1,Test User1,many,2020-01-01,10:00:00,1,1,2020-01-01 00:00:00\n")
+    app = create_app(lazy_init=True, database_uri=f"sqlite:///{tmp_path / 'test.db'}", csv_folder=str(tmp_path / 'csv'))
+    app.config['STARTUP_BATCH_SIZE'] = 1
+    app.config['STARTUP_QUEUE_SIZE'] = 2
+    errors = []
+
+    def load():
+        try:
+            init_database(app)
+        except Exception as error:
+            errors.append(error)
+
+    thread = threading.Thread(target=load, daemon=True)
+    thread.start()
+    thread.join(30)
+    assert not thread.is_alive()
+    assert len(errors) == 1 and isinstance(errors[0], ValueError)
+    with app.app_context():
+        db.engine.dispose()
@@ -0,0 +1,35 @@
+"""
+The purpose of test_migrations.py is to test that an old database is upgraded in place by the schema migrations.
+"""
+from website import db
+from website.models import LISTING_TRIGGERS
+from website.migrations import upgrade_database, current_version, latest_version
+from website.listings import listing_differences
+from website.pricing import reprice_screenings
+
+
+def downgrade_to_version_2():
+    """
+    Turn the database of the current models back into a database of schema version 2, with its data.
+    """
+    for name in LISTING_TRIGGERS:
+        db.session.execute(db.text(f"DROP TRIGGER IF EXISTS {name}"))
+    db.session.execute(db.text("DROP TABLE screening_listing"))
+    db.session.execute(db.text("DROP TABLE theater_movie"))
+    db.session.execute(db.text("ALTER TABLE screening DROP COLUMN price"))
+    db.session.execute(db.text("ALTER TABLE booking DROP COLUMN price"))
+    db.session.execute(db.text("DELETE FROM schema_version WHERE version > 2"))
+    db.session.commit()
+
+
+def test_upgrade_from_version_2_builds_a_consistent_listing(app):
+    with app.app_context():
+        downgrade_to_version_2()
+        assert current_version() == 2
+        applied = [migration.version for migration in upgrade_database()]
+        assert applied == list(range(3, latest_version() + 1))
+        # Until the screenings are priced the listing shows the movie prices
+        assert listing_differences(db.session) == []
+        assert reprice_screenings(db.session) > 0
+        db.session.commit()
+        assert listing_differences(db.session) == []
@@ -0,0 +1,65 @@
+"""
+The purpose of test_performance.py is to keep every page within the latency budgets of the PERFORMANCE_BUDGETS setting
+and the SQL statement budgets of the QUERY_BUDGETS setting on the synthetic dataset.
+
+The latency budgets are several times what the pages need on a laptop, so a busy machine does not fail the tests
+but a page that becomes several times slower does. The statement budgets do not depend on the size of the data.
+"""
+from website import db
+from website.models import Screening
+from website.querybudget import BUDGET_REQUESTS, count_queries
+from website.benchmark import percentile
+from conftest import logged_in_client
+import pytest
+import time
+
+# The number of timed requests per page, after one that is not timed
+ROUNDS = 30
+
+# The requests of BUDGET_REQUESTS, named after their method and path in the test report
+REQUESTS = [pytest.param(*request, id=f"{request[1]} {request[2]}") for request in BUDGET_REQUESTS]
+
+
+def client_for(app, dataset, logged_in):
+    return logged_in_client(app, dataset['user_id']) if logged_in else app.test_client()
+
+
+@pytest.mark.parametrize('name, method, path, logged_in, form', REQUESTS)
+def test_page_latency_is_within_budget(app, dataset, name, method, path, logged_in, form):
+    client = client_for(app, dataset, logged_in)
+    # The first request compiles the templates and fills the caches, so it is not timed
+    assert client.open(path, method=method, data=form(dataset) if form else None).status_code < 500
+    latencies = []
+    for _ in range(ROUNDS):
+        data = form(dataset) if form else None
+        started = time.perf_counter()
+        client.open(path, method=method, data=data)
+        latencies.append((time.perf_counter() - started) * 1000)
+    assert percentile(latencies, 0.95) <= app.config['PERFORMANCE_BUDGETS']['route_p95_ms'][name]
+
+
+@pytest.mark.parametrize('name, method, path, logged_in, form', REQUESTS)
+def test_page_statements_are_within_budget(app, dataset, name, method, path, logged_in, form):
+    client = client_for(app, dataset, logged_in)
+    with app.app_context():
+        with count_queries() as log:
+            response = client.open(path, method=method, data=form(dataset) if form else None)
+    assert response.status_code < 500
+    assert log.count <= app.config['QUERY_BUDGETS'][name], "\n".join(log.summary())
+
+
+def test_query_budget_check_passes(app):
+    result = app.test_cli_runner().invoke(args=['check-query-budgets', '--theaters', '5', '--days', '3', '--bookings', '100'])
+    assert result.exit_code == 0, result.output
+    assert "Every page is within its query budget." in result.output
+
+
+def test_booking_latency_is_within_budget(app, client):
+    with app.app_context():
+        screening = Screening.query.order_by(Screening.available_seats.desc(), Screening.id).first()
+    latencies = []
+    for _ in range(ROUNDS):
+        started = time.perf_counter()
+        client.post('/getTicket', data={'number_of_ticket': 1, 'booked_screening': screening.id, 'booked_theater': screening.theater_id})
+        latencies.append((time.perf_counter() - started) * 1000)
+    assert percentile(latencies, 0.95) <= app.config['PERFORMANCE_BUDGETS']['booking_p95_ms']
@@ -0,0 +1,60 @@
+"""
+The purpose of test_profiler.py is to test that only the requests allowed by the REQUEST_PROFILING settings are profiled.
+"""
+from website.requestprofiler import install_request_profiler
+import threading
+import pytest
+
+
+@pytest.fixture
+def profiled_app(make_app, tmp_path):
+    """
+    Return a function that creates the application with the request profiler installed on the given settings.
+    """
+    def make(**settings):
+        app = make_app()
+        app.config['REQUEST_PROFILING_FOLDER'] = str(tmp_path / 'profiles')
+        app.config.update(settings)
+        install_request_profiler(app)
+        return app
+    return make
+
+
+def test_header_needs_the_secret(profiled_app, tmp_path):
+    app = profiled_app(REQUEST_PROFILING_SECRET='letmein')
+    client = app.test_client()
+    assert 'X-Profile' not in client.get('/login', headers={'X-Profile': '1'}).headers
+    name = client.get('/login', headers={'X-Profile': 'letmein'}).headers['X-Profile']
+    assert (tmp_path / 'profiles' / name).exists()
+
+
+def test_header_without_secret_only_in_debug_mode(profiled_app):
+    app = profiled_app()
+    client = app.test_client()
+    assert 'X-Profile' not in client.get('/login', headers={'X-Profile': '1'}).headers
+    app.debug = True
+    assert 'X-Profile' in client.get('/login', headers={'X-Profile': '1'}).headers
+
+
+def test_profiles_running_at_once_are_capped(profiled_app):
+    app = profiled_app(REQUEST_PROFILING_SECRET='letmein', REQUEST_PROFILING_MAX_ACTIVE=1)
+    entered, leave = threading.Event(), threading.Event()
+
+    @app.route('/slow')
+    def slow():
+        entered.set()
+        leave.wait(10)
+        return 'done'
+
+    responses = []
+    thread = threading.Thread(target=lambda: responses.append(
+        app.test_client().get('/slow', headers={'X-Profile': 'letmein'})))
+    thread.start()
+    assert entered.wait(10)
+    # The only slot is taken by the slow request, so this one runs without a profile
+    assert 'X-Profile' not in app.test_client().get('/login', headers={'X-Profile': 'letmein'}).headers
+    leave.set()
+    thread.join()
+    assert 'X-Profile' in responses[0].headers
+    # The slot is free again once the slow profile is saved
+    assert 'X-Profile' in app.test_client().get('/login', headers={'X-Profile': 'letmein'}).headers
@@ -0,0 +1,104 @@
+"""
+The purpose of test_sharding.py is to test the website with screenings and bookings split across shard files.
+"""
+from website import db, get_csv_paths
+from website.sharding import data_sessions
+from website.models import Screening, Booking, BookingRequest, ArchivedBooking
+from website.archive import archive_screenings
+from sqlalchemy import event
+from datetime import date, timedelta
+from conftest import BOOKINGS, logged_in_client
+import pytest
+
+SHARDS = 3
+
+
+@pytest.fixture
+def sharded_app(make_app):
+    """
+    The application with the synthetic dataset split across three shard files.
+    """
+    return make_app(shard_count=SHARDS)
+
+
+def test_shard_files_are_next_to_the_database(sharded_app, tmp_path):
+    assert sharded_app.config['SHARD_COUNT'] == SHARDS
+    assert sorted(path.name for path in tmp_path.glob('test_shard*.db')) == [f"test_shard{index}.db" for index in range(SHARDS)]
+    with sharded_app.app_context():
+        sessions = data_sessions()
+        assert len(sessions) == SHARDS
+        # Every shard holds only the screenings of its own theaters
+        for index, session in enumerate(sessions):
+            assert {theater_id % SHARDS for (theater_id,) in session.query(Screening.theater_id).distinct()} == {index}
+        assert sum(session.query(Booking).count() for session in sessions) <= BOOKINGS
+
+
+def test_shard_count_from_the_environment(make_app, monkeypatch):
+    monkeypatch.setenv('CINEMA3000_SHARD_COUNT', str(SHARDS))
+    assert make_app().config['SHARD_COUNT'] == SHARDS
+
+
+def screening_in_shard(app, index):
+    """
+    Return a screening of a shard with the most seats left, as a (screening ID, theater ID, seats left) triple.
+    """
+    with app.app_context():
+        screening = data_sessions()[index].query(Screening).order_by(Screening.available_seats.desc(), Screening.id).first()
+        return screening.id, screening.theater_id, screening.available_seats
+
+
+def seats_in_shard(app, index, screening_id):
+    """
+    Return the seats left of a screening in a shard.
+    """
+    with app.app_context():
+        return data_sessions()[index].get(Screening, screening_id).available_seats
+
+
+@pytest.mark.parametrize('theater', ['not-a-number', 'other-shard'])
+def test_booking_with_a_wrong_theater_goes_to_the_screenings_shard(sharded_app, theater):
+    screening_id, theater_id, before = screening_in_shard(sharded_app, 1)
+    # A theater of another shard, or a value that is not a theater at all
+    theater_id = theater_id + 1 if theater == 'other-shard' else theater
+    response = logged_in_client(sharded_app, 1).post('/getTicket', data={
+        'number_of_ticket': 2, 'booked_screening': screening_id, 'booked_theater': theater_id, 'idempotency_key': theater})
+    assert response.location.endswith('/myBooking')
+    assert seats_in_shard(sharded_app, 1, screening_id) == before - 2
+
+
+def test_booking_writes_only_to_the_screenings_shard(sharded_app):
+    screening_id, theater_id, before = screening_in_shard(sharded_app, 2)
+    client = logged_in_client(sharded_app, 1)
+    form = {'number_of_ticket': 1, 'booked_screening': screening_id, 'booked_theater': theater_id, 'idempotency_key': 'sharded'}
+    writes = []
+
+    def record_write(connection, cursor, statement, parameters, context, executemany):
+        if not statement.lstrip().upper().startswith(('SELECT', 'PRAGMA')):
+            writes.append(statement)
+
+    with sharded_app.app_context():
+        main_engine = db.engines[None]
+    event.listen(main_engine, 'before_cursor_execute', record_write)
+    try:
+        # The repeated submission is answered from the key stored in the shard
+        for _ in range(2):
+            assert client.post('/getTicket', data=form).location.endswith('/myBooking')
+    finally:
+        event.remove(main_engine, 'before_cursor_execute', record_write)
+    assert writes == []
+    assert seats_in_shard(sharded_app, 2, screening_id) == before - 1
+    with sharded_app.app_context():
+        assert data_sessions()[2].get(BookingRequest, 'sharded').booking_id is not None
+        assert db.session.get(BookingRequest, 'sharded') is None
+
+
+def test_archive_moves_the_bookings_of_every_shard(sharded_app):
+    cutoff = date.today() + timedelta(days=2)
+    with sharded_app.app_context():
+        sessions = data_sessions()
+        before = sum(session.query(Booking).count() for session in sessions)
+        screenings, bookings = archive_screenings(cutoff, get_csv_paths())
+        assert screenings and bookings
+        assert sum(session.query(Screening).filter(Screening.date < cutoff).count() for session in sessions) == 0
+        assert sum(session.query(Booking).count() for session in sessions) == before - bookings
+        assert db.session.query(ArchivedBooking).count() == bookings
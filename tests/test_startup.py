@@ -0,0 +1,97 @@
+"""
+The purpose of test_startup.py is to test the startup that loads the csv files into the database.
+"""
+import website
+from website import db, init_database, get_csv_paths
+from website.csvstore import recover_csv_files
+from website.models import User, Movie, Theater, Screening, Booking
+from website.listings import listing_differences
+from website.startup import measure_startup
+from conftest import seat_problems
+import time
+import glob
+import os
+import shutil
+import stat
+
+
+def test_startup_loads_every_csv_row(app, csv_sizes):
+    with app.app_context():
+        loaded = {'user': User.query.count(), 'movie': Movie.query.count(), 'theater': Theater.query.count(),
+                  'screening': Screening.query.count(), 'booking': Booking.query.count()}
+    assert loaded == csv_sizes
+
+
+def test_startup_seats_and_listing_are_consistent(app):
+    with app.app_context():
+        assert seat_problems(get_csv_paths()) == []
+        assert listing_differences(db.session) == []
+
+
+def test_startup_time_is_within_budget(make_app):
+    # The first startup loads the csv files
+    started = time.perf_counter()
+    app = make_app()
+    first = time.perf_counter() - started
+    # The second one keeps the database and only applies the pending migrations and new dates
+    started = time.perf_counter()
+    init_database(app)
+    second = time.perf_counter() - started
+    budget = app.config['PERFORMANCE_BUDGETS']['startup_seconds']
+    assert first <= budget
+    assert second <= budget
+    with app.app_context():
+        assert seat_problems(get_csv_paths()) == []
+
+
+def test_startup_only_rewrites_the_csv_files_it_writes(make_app, tmp_path, capsys):
+    folder = tmp_path / 'csv'
+    read_only = {name: (folder / f"{name}.csv").read_bytes() for name in ('movie', 'theater')}
+    app = make_app()
+    output = capsys.readouterr().out
+    # The files the website writes get their checksums once, which is not reported as a repair
+    for name in ('booking', 'screening', 'user'):
+        assert f"Added checksums to {name}.csv" in output
+    assert "Repaired" not in output
+    assert {name: (folder / f"{name}.csv").read_bytes() for name in read_only} == read_only
+    # A restart finds nothing to upgrade
+    init_database(app)
+    assert "checksums" not in capsys.readouterr().out
+
+
+def test_static_csv_files_need_no_upgrade(tmp_path):
+    # The csv files under version control already have their checksums, so running the website does not rewrite them
+    for path in glob.glob(os.path.join(os.path.dirname(website.__file__), 'static', '*.csv')):
+        shutil.copy(path, tmp_path)
+    paths = {name: str(tmp_path / f"{name}.csv") for name in ('booking', 'screening', 'user', 'booking_archive')}
+    assert recover_csv_files(paths) == ({}, [])
+
+
+def test_rewritten_csv_file_keeps_its_permissions(make_app, tmp_path):
+    booking_csv = tmp_path / 'csv' / 'booking.csv'
+    booking_csv.chmod(0o640)
+    make_app()
+    assert stat.S_IMODE(booking_csv.stat().st_mode) == 0o640
+
+
+def test_startup_repairs_a_torn_booking_row(make_app, tmp_path, capsys):
+    app = make_app()
+    booking_csv = tmp_path / 'csv' / 'booking.csv'
+    with open(booking_csv, 'a') as file:
+        file.write("9999,1,Torn Row,2,2020-01")
+    capsys.readouterr()
+    init_database(app)
+    assert "Repaired booking.csv, 1 broken rows moved to booking.csv.rejected" in capsys.readouterr().out
+    assert (tmp_path / 'csv' / 'booking.csv.rejected').exists()
+    with app.app_context():
+        assert seat_problems(get_csv_paths()) == []
+
+
+def test_startup_profile_loads_copies_of_the_csv_files(tmp_path, csv_sizes):
+    folder = tmp_path / 'csv'
+    before = {path.name: path.read_bytes() for path in folder.iterdir()}
+    runs = [measure_startup(str(folder)) for _ in range(2)]
+    # Every run measured a cold load and left the csv files (and the folder) as they were
+    assert all(run['total_ms'] > 0 for run in runs)
+    assert {path.name: path.read_bytes() for path in folder.iterdir()} == before
+    assert not list(tmp_path.glob('*.db'))
@@ -2,17 +2,14 @@
 This is the special file to define this directory as a package and a Python program that defines a Flask web application.
 """
 # Import Flask library used to create web application
-from flask import Flask
+from flask import Flask, current_app, has_app_context
 # Import SQLAlchemy library for database operations
 from flask_sqlalchemy import SQLAlchemy
-# Import LoginManager library for managing user authentication
-from flask_login import LoginManager
-# Import necessary modules for file I/O
-import csv
+# Import necessary modules to build file paths
 from pathlib import Path
 import os
-# Import necessary modules to work with dates and times.
-from datetime import datetime, timedelta
+# Import threading to make the lazy initialization run only once
+import threading
  
 # Initialize a SQLAlchemy object named "db", which will be the database object to use when we want to manipulate the database
 db = SQLAlchemy()
@@ -21,10 +18,16 @@ DB_NAME = "database.db"
 
 
 
-def create_app():
+def create_app(lazy_init=False, database_uri=None, csv_folder=None, shard_count=None):
     """
     Create the Flask application.
 
+    Args:
+        lazy_init (bool): If True, load the database on the first request instead of now.
+        database_uri (str or None): The URI of another database to use instead of database.db, for example a temporary one.
+        csv_folder (str or None): Another folder with the csv files to use instead of the static folder, for example a temporary one.
+        shard_count (int or None): The number of shard files, or None to read it from the CINEMA3000_SHARD_COUNT environment variable (0 by default).
+
     Returns:
         app (Flask): Flask application object
     """
@@ -40,18 +43,204 @@ def create_app():
 
     # Set up the SQLALCHEMY_DATABASE_URI configuration parameter for the Flask application.
     # It specifies the location of the SQLite database file that the applicaiton will use. (URI = Unified Resource Identifier)
-    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{DB_NAME}'
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_uri or f'sqlite:///{DB_NAME}'
 
     # Set up the SQLALCHEMY_TRACK_MODIFICATIONS configuration parameter for the Flask application.
     # It disables the modification tracking feature of SQLAlchemy to improve performance.
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+    # Set up the CSV_FOLDER configuration parameter for the Flask application.
+    # It is the folder of the csv files the database is loaded from and written back to.
+    app.config['CSV_FOLDER'] = csv_folder or os.path.join(Path(__file__).absolute().parent, "static")
+
+    # Set up the IDEMPOTENCY_KEY_TTL configuration parameter for the Flask application.
+    # It is the number of seconds a ticket form's idempotency key is remembered, so retries within that time do not book twice.
+    app.config['IDEMPOTENCY_KEY_TTL'] = 3600
+
+    # Set up the MAX_LISTING_DAYS configuration parameter for the Flask application.
+    # It is the longest date range the currentMovies page lists in one request.
+    app.config['MAX_LISTING_DAYS'] = 14
+
+    # Set up the ARCHIVE_AFTER_DAYS configuration parameter for the Flask application.
+    # If it is set to a number of days, screenings older than that (and their bookings) are archived on startup.
+    # None keeps every screening in the hot tables; 'flask archive-screenings' archives on demand.
+    app.config['ARCHIVE_AFTER_DAYS'] = None
+
+    # Set up the REBUILD_DATABASE configuration parameter for the Flask application.
+    # If it is True, every start drops the tables and loads the csv files again.
+    # False keeps the database between starts and only applies the new schema migrations ('flask db-upgrade' does the same on demand).
+    app.config['REBUILD_DATABASE'] = False
+
+    # Set up the SHARD_COUNT configuration parameter for the Flask application.
+    # If it is larger than 1, screenings and bookings are split by theater across that many SQLite files next to the database
+    # (database_shard0.db, database_shard1.db, ...), so bookings at different theaters do not wait for the same database writer.
+    # 0 keeps everything in database.db. It is taken from the shard_count argument or the CINEMA3000_SHARD_COUNT environment variable.
+    app.config['SHARD_COUNT'] = shard_count if shard_count is not None else int(os.environ.get('CINEMA3000_SHARD_COUNT', 0))
+    if app.config['SHARD_COUNT'] > 1:
+        from .sharding import shard_binds
+        app.config['SQLALCHEMY_BINDS'] = shard_binds(app.config['SQLALCHEMY_DATABASE_URI'], app.config['SHARD_COUNT'])
+
+    # Set up the GROUP_COMMIT, GROUP_COMMIT_WINDOW_MS and GROUP_COMMIT_MAX_BATCH configuration parameters for the Flask application.
+    # If GROUP_COMMIT is True, bookings arriving within GROUP_COMMIT_WINDOW_MS milliseconds of each other
+    # (at most GROUP_COMMIT_MAX_BATCH of them) are committed together in one transaction, which helps during on-sale bursts.
+    app.config['GROUP_COMMIT'] = False
+    app.config['GROUP_COMMIT_WINDOW_MS'] = 5
+    app.config['GROUP_COMMIT_MAX_BATCH'] = 100
+
+    # Set up the ADMISSION_CONTROL configuration parameters for the Flask application.
+    # If ADMISSION_CONTROL is True, at most ADMISSION_MAX_ACTIVE ticket requests per screening run at the same time.
+    # Up to ADMISSION_MAX_QUEUE more wait in line (in the server for ADMISSION_WAIT_SECONDS, then on a waiting page showing their place),
+    # and requests beyond that are turned away with 429 and a Retry-After of ADMISSION_RETRY_AFTER seconds.
+    app.config['ADMISSION_CONTROL'] = False
+    app.config['ADMISSION_MAX_ACTIVE'] = 2
+    app.config['ADMISSION_MAX_QUEUE'] = 100
+    app.config['ADMISSION_WAIT_SECONDS'] = 2
+    app.config['ADMISSION_RETRY_AFTER'] = 3
+
+    # Set up the GROUP_BOOKING_MAX_SCREENINGS configuration parameter for the Flask application.
+    # A group booking books at most this many screenings at once, all or nothing, in one transaction.
+    app.config['GROUP_BOOKING_MAX_SCREENINGS'] = 10
+
+    # Set up the DYNAMIC_PRICING and PRICING_RULES configuration parameters for the Flask application.
+    # If DYNAMIC_PRICING is True, the ticket price of a screening is the movie's price times a multiplier for how full the screening is,
+    # one for the hour it starts and one for the day of the week, rounded to cents and never below 'minimum_price'.
+    # The prices are computed in batches whenever seats change and stored with the screenings; False sells every ticket at the movie's price.
+    # Run 'flask reprice-screenings' after changing the rules of a running database.
+    app.config['DYNAMIC_PRICING'] = True
+    app.config['PRICING_RULES'] = {
+        # (lowest occupancy, multiplier) tiers: the fuller the screening, the more its last seats cost
+        'occupancy': [(0.0, 0.9), (0.5, 1.0), (0.75, 1.15), (0.9, 1.3)],
+        # (first hour, multiplier) tiers: matinees cost less than evening screenings
+        'hours': [(0, 0.85), (17, 1.0), (22, 0.9)],
+        # The multiplier of every day of the week, Monday first
+        'weekdays': [0.9, 0.9, 0.9, 1.0, 1.1, 1.15, 1.1],
+        'minimum_price': 5.0,
+    }
+
+    # Set up the SEAT_STREAM configuration parameters for the Flask application.
+    # The currentMovies page keeps one live connection open for seat updates. At most SEAT_STREAM_MAX_SUBSCRIBERS connections are open,
+    # a connection with more than SEAT_STREAM_QUEUE_SIZE unsent updates is restarted, and an idle connection gets a keep-alive every SEAT_STREAM_HEARTBEAT seconds.
+    app.config['SEAT_STREAM_MAX_SUBSCRIBERS'] = 500
+    app.config['SEAT_STREAM_QUEUE_SIZE'] = 100
+    app.config['SEAT_STREAM_HEARTBEAT'] = 15
+
+    # Set up the PASSWORD_HASH_METHOD and PASSWORD_SALT_LENGTH configuration parameters for the Flask application.
+    # The method names the hash algorithm and its cost in werkzeug's notation ('scrypt:N:r:p' or 'pbkdf2:sha256:iterations').
+    # A higher cost is safer but every login uses more CPU; 'flask password-benchmark' shows the cost of each setting.
+    # Accounts with an older hash are hashed again with this method the next time they log in.
+    app.config['PASSWORD_HASH_METHOD'] = 'scrypt:32768:8:1'
+    app.config['PASSWORD_SALT_LENGTH'] = 16
+
+    # Set up the RATE_LIMITS and RATE_LIMIT_MAX_KEYS configuration parameters for the Flask application.
+    # RATE_LIMITS maps a route to its token buckets: per client IP ('ip') and per submitted email ('email'),
+    # each as (burst, tokens per minute). Submissions over the limit get 429 before any password hashing.
+    # At most RATE_LIMIT_MAX_KEYS buckets per route and key type are kept in memory, the least recently used are dropped.
+    app.config['RATE_LIMITS'] = {
+        'auth.login': {'ip': (30, 30), 'email': (10, 5)},
+        'auth.register': {'ip': (5, 2)},
+    }
+    app.config['RATE_LIMIT_MAX_KEYS'] = 10000
+
+    # Set up the QUERY_BUDGETS configuration parameter for the Flask application.
+    # It is the largest number of SQL statements one request to each route may send, whatever the size of the data.
+    # The names with a suffix are a second kind of request to the same route: submitting a booking, a successful login
+    # and submitting a registration (see BUDGET_REQUESTS in querybudget.py).
+    # 'flask check-query-budgets' and tests/test_performance.py request every route on a synthetic dataset and fail if a route goes over its budget.
+    app.config['QUERY_BUDGETS'] = {
+        'views.home': 1,
+        'views.theater': 3,
+        'views.movies': 5,
+        'views.ticket': 2,
+        'views.ticket.book': 12,
+        'views.group_ticket': 2,
+        'views.booking': 3,
+        'auth.login': 1,
+        'auth.login.success': 3,
+        'auth.register': 0,
+        'auth.register.submit': 5,
+    }
+
+    # Set up the PERFORMANCE_BUDGETS configuration parameter for the Flask application.
+    # The tests of tests/test_startup.py and tests/test_performance.py fail if the startup on their synthetic dataset takes longer than 'startup_seconds',
+    # or if the 95th percentile latency of a page (or of a booking) is above its budget in milliseconds.
+    app.config['PERFORMANCE_BUDGETS'] = {
+        'startup_seconds': 10,
+        'booking_p95_ms': 250,
+        'route_p95_ms': {
+            'views.home': 50,
+            'views.theater': 50,
+            'views.movies': 500,
+            'views.ticket': 50,
+            'views.ticket.book': 250,
+            'views.group_ticket': 50,
+            'views.booking': 100,
+            'auth.login': 50,
+            'auth.login.success': 50,
+            'auth.register': 50,
+            'auth.register.submit': 100,
+        },
+    }
+
+    # Set up the SLOW_QUERY_LOG configuration parameters for the Flask application.
+    # If SLOW_QUERY_LOG is True, every SQL statement that takes longer than SLOW_QUERY_THRESHOLD_MS milliseconds is logged
+    # with its parameters, route and query plan into SLOW_QUERY_LOG_FILE in the instance folder.
+    # The file is rotated at SLOW_QUERY_LOG_MAX_BYTES, keeping SLOW_QUERY_LOG_BACKUPS old files; 'flask slow-queries' summarizes it.
+    app.config['SLOW_QUERY_LOG'] = False
+    app.config['SLOW_QUERY_THRESHOLD_MS'] = 50
+    app.config['SLOW_QUERY_LOG_FILE'] = 'slow_queries.log'
+    app.config['SLOW_QUERY_LOG_MAX_BYTES'] = 1000000
+    app.config['SLOW_QUERY_LOG_BACKUPS'] = 3
+
+    # Set up the REQUEST_PROFILING configuration parameters for the Flask application.
+    # If REQUEST_PROFILING is True, a request whose REQUEST_PROFILING_HEADER header holds REQUEST_PROFILING_SECRET (any value
+    # in debug mode while the secret is None), and, at random, REQUEST_PROFILING_SAMPLE_RATE of all other requests, gets its
+    # call stack sampled every REQUEST_PROFILING_INTERVAL_MS milliseconds, at most REQUEST_PROFILING_MAX_ACTIVE requests at a time.
+    # The profile is saved as a flamegraph .folded file in REQUEST_PROFILING_FOLDER of the instance folder.
+    app.config['REQUEST_PROFILING'] = False
+    app.config['REQUEST_PROFILING_HEADER'] = 'X-Profile'
+    app.config['REQUEST_PROFILING_SECRET'] = None
+    app.config['REQUEST_PROFILING_MAX_ACTIVE'] = 2
+    app.config['REQUEST_PROFILING_SAMPLE_RATE'] = 0.0
+    app.config['REQUEST_PROFILING_INTERVAL_MS'] = 5
+    app.config['REQUEST_PROFILING_FOLDER'] = 'profiles'
+
+    # Set up the READ_REPLICA configuration parameters for the Flask application.
+    # If READ_REPLICA is True (and SHARD_COUNT is not larger than 1), the theater, currentMovies and myBooking pages read from
+    # a read-only copy of the database (READ_REPLICA_FILE in the instance folder), refreshed every READ_REPLICA_REFRESH_SECONDS.
+    # A copy older than READ_REPLICA_MAX_STALENESS_SECONDS is not read; bookings and their seat checks always use the database itself.
+    app.config['READ_REPLICA'] = False
+    app.config['READ_REPLICA_FILE'] = 'replica.db'
+    app.config['READ_REPLICA_REFRESH_SECONDS'] = 2
+    app.config['READ_REPLICA_MAX_STALENESS_SECONDS'] = 10
+
+    # Set up the SCHEDULE_STORE configuration parameters for the Flask application.
+    # If SCHEDULE_STORE is True, every worker keeps all screenings in a compact in-memory schedule for the currentMovies page,
+    # built again from the screening_listing table when it is older than SCHEDULE_STORE_MAX_AGE_SECONDS.
+    app.config['SCHEDULE_STORE'] = False
+    app.config['SCHEDULE_STORE_MAX_AGE_SECONDS'] = 30
+
+    # Set up the STARTUP_WORKERS, STARTUP_BATCH_SIZE and STARTUP_QUEUE_SIZE configuration parameters for the Flask application.
+    # The csv files are parsed by this many worker threads at the same time and handed to the database in batches of this many rows,
+    # with at most STARTUP_QUEUE_SIZE parsed batches waiting for the database.
+    app.config['STARTUP_WORKERS'] = 4
+    app.config['STARTUP_BATCH_SIZE'] = 5000
+    app.config['STARTUP_QUEUE_SIZE'] = 16
+
+    # Set up the LAZY_INIT configuration parameter for the Flask application.
+    # If it is True, the database is not loaded while the application is created but on the first request
+    # (or with 'flask init-db'), so tooling, tests and shells do not pay for a full data load.
+    app.config['LAZY_INIT'] = lazy_init
+
 
     # Initialise database
     # Initializes the SQLAlchemy object "db" to be used by the Flask application. 
     # It tells the application to use the database we define earlier
     with app.app_context():
         db.init_app(app)
+        # Time the statements of every database file and log the slow ones
+        if app.config['SLOW_QUERY_LOG']:
+            from .queryprofiler import install_query_profiler
+            install_query_profiler(app, db.engines.values())
 
 
     # Blueprints are a way to organize a Flask application into reusable modules. 
@@ -64,18 +253,53 @@ def create_app():
     app.register_blueprint(views, url_prefix='/')
     app.register_blueprint(auth, url_prefix='/')
 
-    # Create database
-    # 'app.app_context()' ensures that the Flask application context is set up properly before executing the code inside it.
-    with app.app_context():
-        # Drop any existing tables in the database
-        db.drop_all()
-        # Create the database tables
-        db.create_all()
-        print("Database Created!")
-        # Initialize the database tables with initial data from csv files.
-        insert_data()
+    # Sample the call stacks of the chosen requests; when the profiling is off no hook is registered at all
+    if app.config['REQUEST_PROFILING']:
+        from .requestprofiler import install_request_profiler
+        install_request_profiler(app)
+
+    # Register the command line commands, so they can be run with 'flask <command>' in the terminal.
+    from .export import export_bookings_command
+    from .archive import archive_screenings_command
+    from .startup import init_db_command, startup_profile_command
+    from .benchmark import login_flood_benchmark_command, password_benchmark_command, schedule_memory_benchmark_command
+    from .migrations import db_upgrade_command
+    from .listings import check_listings_command
+    from .querybudget import check_query_budgets_command
+    from .queryprofiler import slow_queries_command
+    from .loadtest import load_test_command
+    from .pricing import reprice_screenings_command
+    app.cli.add_command(export_bookings_command)
+    app.cli.add_command(archive_screenings_command)
+    app.cli.add_command(init_db_command)
+    app.cli.add_command(startup_profile_command)
+    app.cli.add_command(login_flood_benchmark_command)
+    app.cli.add_command(password_benchmark_command)
+    app.cli.add_command(schedule_memory_benchmark_command)
+    app.cli.add_command(db_upgrade_command)
+    app.cli.add_command(check_listings_command)
+    app.cli.add_command(check_query_budgets_command)
+    app.cli.add_command(slow_queries_command)
+    app.cli.add_command(load_test_command)
+    app.cli.add_command(reprice_screenings_command)
+
+    # Create database now, or on the first request if the initialization is lazy
+    if lazy_init:
+        # 'before_request' runs the function before every request; after the first one it only checks a flag.
+        app.before_request(lambda: ensure_database(app))
+    else:
+        init_database(app)
+
+    # Close the shard sessions opened during a request when the request ends
+    from .sharding import close_shard_sessions
+    app.teardown_appcontext(close_shard_sessions)
+    # Close the read replica session opened during a request when the request ends
+    from .replica import close_replica_session
+    app.teardown_appcontext(close_replica_session)
 
     from .models import User
+    # Import LoginManager library for managing user authentication
+    from flask_login import LoginManager
 
     # Creates a LoginManager object and assigns it to the login_manager variable. 
     # This object is responsible for managing user authentication and session management.
@@ -103,388 +327,131 @@ def create_app():
         Returns:
             User: The User object representing the loaded user.
         """
-        # The User.query.get() method is used to look up the user in the database by their primary key (ID). 
+        # The db.session.get() method is used to look up the user in the database by their primary key (ID).
         # This method returns the User object with the given primary key (ID), or None if the user is not found.
         # It defines a user_loader function that loads a user from the database given their ID.
-        # User.query.get() the parameter will just look for primary key in the User model
-        return User.query.get(int(id))
+        return db.session.get(User, int(id))
 
     # Return the Flask application object
     return app
 
 
-# Import classes that are used in the function.
-from .models import Movie, Theater, Screening, User, Booking
-
-def insert_data():
+def init_database(app, rebuild=None):
     """
-    Inserts data from csv files into the respective tables in the database.
-
-    Returns:
-        None
-    """
-    # Return a dictionary containing file paths for each csv files and assign it to paths
-    paths = get_csv_paths()
-
-    # Read the data from the user.csv file and insert it into the User table in the database.
-    read_user_data(paths)
-
-    # Read the data from the movie.csv file and insert it into the Movie table in the database. 
-    # Return a dictionary containing the show times for each movie and assign it to show_times.
-    show_times = read_movie_data(paths)
-
-    # Read the data from the theater.csv file and insert it into the Theater table in the database. 
-    # Return two dictionaries: available_movies and theater_seats and assign them to available_movies and theater_seats.
-    available_movies, theater_seats = read_theater_data(paths)
-
-    # Read the data from the screening.csv file.
-    # Returns a set of dates on which screenings have already been scheduled.
-    existing_dates = read_screening_data(paths)
-
-    # Generate new screening data based on the movies available, the number of available seats, the show times, and the existing screening dates. 
-    # The new screening data then is inserted into the Screening table in the database.
-    create_new_screening_data(existing_dates, available_movies, theater_seats, show_times, paths)
-    
-    # Read the data from the booking.csv file and insert it into the Booking table in the database. 
-    # Also create a relationship between the Screening and Booking tables by adding booking to screening's booking list.
-    read_booking_data(paths)
-
-
-def get_csv_paths():
-    """
-    Creates a dictionary that maps file names to their corresponding absolute paths on the local file system.
-
-    Returns:
-        dict: A dictionary with file names as keys and their corresponding absolute paths as values.
-    """
-
-    # Get absolute path of directory containing the current script file
-    working_directory = Path(__file__).absolute().parent
-    # Create a dictionary named paths that maps file names to their corresponding absolute paths on the local file system. 
-    paths = {
-        "movie": os.path.join(working_directory, "static", "movie.csv"),
-        "theater": os.path.join(working_directory, "static", "theater.csv"),
-        "user": os.path.join(working_directory, "static", "user.csv"),
-        "booking": os.path.join(working_directory, "static", "booking.csv"),
-        "screening": os.path.join(working_directory, "static", "screening.csv")
-    }
-    # Return a dictionary of paths
-    return paths
+    Create or upgrade the database.
 
-
-def read_user_data(paths):
-    """
-    Reads data from user.csv into the user table in the database.
+    A new database, a database made before schema migrations existed, any database when REBUILD_DATABASE is True,
+    or a sharded database whose shard files are not current is created from the models and loaded from the csv files.
+    Otherwise the existing database is kept: the pending schema migrations are applied and the screenings of the coming days are added.
 
     Args:
-        paths (dict): A dictionary containing the absolute paths of the csv files.
+        app (Flask): Flask application object
+        rebuild (bool or None): True or False to override the REBUILD_DATABASE setting.
 
     Returns:
         None
     """
-    # Open user.csv file for reading data
-    with open(paths["user"], "r") as file:
-        # Read its data into reader object
-        reader = csv.DictReader(file)
-        # Create a list of User objects using list comprehension to iterate over each row in the csv file.
-        users = [User(email=row['email'], password=row['password'], first_name=row['first_name'], last_name=row['last_name']) for row in reader]
-        # Add all users to the database
-        db.session.add_all(users)
-        # Commit changes to the database
-        db.session.commit()
-
-
-def read_movie_data(paths):
-    """
-    Reads data from movie.csv into the movie table in the database.
-
-    Parameters:
-        paths (dict): A dictionary containing the absolute paths of the csv files.
-
-    Returns:
-        show_times (dict): A dictionary that has movie title as key and a list of show times as value.
-
-    """
-    # Open movie.csv file for reading data
-    with open(paths["movie"], "r") as file:
-        # Read its data into reader object
-        reader = csv.DictReader(file)
-        # Initialize an empty list for movie objects
-        movies = []
-        # Initialize an empty dictionary for show times
-        show_times = {}
-        # Iterate over each row in the csv file
-        for row in reader:
-            # Convert release date string to datetime object.
-            release_date = datetime.strptime(row['release_date'], '%Y-%m-%d').date()
-            # Create Movie object with data from the row
-            movie = Movie(title=row['title'], price=row['price'], release_date=release_date)
-            # Append the Movie object to the list of movies
-            movies.append(movie)
-            # Store the show times for this movie in the show_times dictionary
-            show_times[movie.title] = row['show_times'].split(", ")
-        # Add all movies to the database
-        db.session.add_all(movies)
-        # Commit changes to the database
-        db.session.commit()
-        # Return the dictionary of show times
-        return show_times
-
-
-def read_theater_data(paths):
+    from .migrations import current_version, upgrade_database, stamp_latest_version
+    if rebuild is None:
+        rebuild = app.config['REBUILD_DATABASE']
+    # 'app.app_context()' ensures that the Flask application context is set up properly before executing the code inside it.
+    with app.app_context():
+        # Repair the csv files a crash may have left behind, before anything reads them
+        from .csvstore import recover_csv_files
+        repaired, upgraded = recover_csv_files(get_csv_paths())
+        for name in upgraded:
+            print(f"Added checksums to {name}.csv (one-time format upgrade)")
+        for name, rejected in repaired.items():
+            print(f"Repaired {name}.csv" + (f", {rejected} broken rows moved to {name}.csv.rejected" if rejected else ""))
+        # The screenings and bookings of a sharded database are in the shard files, so shard files made
+        # for another shard count or schema are filled again from the csv files
+        from .sharding import shards_are_current, distribute_to_shards, data_sessions
+        sharded = app.config['SHARD_COUNT'] > 1
+        rebuild = rebuild or not current_version() or (sharded and not shards_are_current())
+        if rebuild:
+            # Drop any existing tables in the database.
+            # Only the main database: the shard files are recreated by distribute_to_shards(), and 'db' may know the shard binds
+            # of another application in the same process.
+            db.drop_all(bind_key=None)
+            # Create the database tables
+            db.create_all(bind_key=None)
+            stamp_latest_version()
+            print("Database Created!")
+            # Initialize the database tables with initial data from csv files.
+            # The loader is imported here, so importing the package does not import it.
+            from .loader import insert_data
+            insert_data()
+        else:
+            # Keep the data and only bring the schema up to date
+            for migration in upgrade_database():
+                print(f"Applied migration {migration.version}: {migration.description}")
+            from .loader import schedule_new_screenings
+            schedule_new_screenings()
+            print("Database Upgraded!")
+        # Move the loaded (or newly scheduled) screenings and bookings into the shard files of their theaters
+        if sharded:
+            distribute_to_shards(recreate=rebuild)
+        # Price every screening for its seats, time and day, so the pages and bookings only read the stored prices.
+        # Bookings loaded from booking.csv (or made before bookings kept their price) get the price of their movie.
+        from .pricing import reprice_screenings, fill_booking_prices
+        for session in data_sessions():
+            fill_booking_prices(session)
+            reprice_screenings(session)
+            session.commit()
+        # Move old screenings and their bookings into the archive, so later startups and listings touch less data.
+        if app.config['ARCHIVE_AFTER_DAYS'] is not None:
+            from .archive import archive_screenings, archive_cutoff
+            archive_screenings(archive_cutoff(app.config['ARCHIVE_AFTER_DAYS']), get_csv_paths())
+    # Remember that the database is ready
+    app.extensions['cinema3000_initialized'] = True
+
+
+# A lock so only one request thread runs the lazy initialization
+_init_lock = threading.Lock()
+
+
+def ensure_database(app):
     """
-    Read data from theater.csv into the theater table in the database.
+    Initialize the database if it was not initialized yet. Used before every request when LAZY_INIT is True.
 
     Args:
-        paths (dict): A dictionary containing the absolute paths of the csv files.
-        
-    Returns:
-        Tuple: A tuple containing two dictionaries. 
-            The first dictionary has theater name as key and a list of available movies as value. 
-            The second dictionary has theater name as key and the number of seats in the theater as value.
-    """
-    # Open theater.csv file for reading data
-    with open(paths['theater'], "r") as file:
-        # Read its data into reader object
-        reader = csv.DictReader(file)
-        # Initialize an empty list for theater objects
-        theaters = []
-        # Initialize an empty dictionary for storing available movies
-        available_movies = {}
-        # Initialize an empty dictionary for storing theater seats
-        theater_seats = {}
-        # Iterate over each row in the csv file
-        for row in reader:
-            # Create Theater object with data from the row
-            theater = Theater(name=row['theater_name'], number_of_seats=row['number_of_seats'], available_movies=row['available_movies'])
-            # Append the Theater object to the list of theaters
-            theaters.append(theater)
-            # Split the available_movies string into a list and add it to the available_movies dictionary
-            available_movies[theater.name] = row['available_movies'].split(", ")
-            # Add the number of seats for this theater to the theater_seats dictionary
-            theater_seats[theater.name] = row['number_of_seats']
-        # Add all movies to the database
-        db.session.add_all(theaters)
-        # Commit changes to the database
-        db.session.commit()
-        # Return the tuple of containing available_movies and theater_seats
-        return available_movies, theater_seats
-
-
-def read_screening_data(paths):
-    """
-    Read data from screening.csv into the Screening table in the database.
+        app (Flask): Flask application object
 
-    Args:
-        paths (dict): A dictionary containing the absolute paths of the csv files.
-    
     Returns:
-        existing_dates (set): A set containing all the existing dates in the screening.csv file. 
-        If the file is empty, an empty set is returned.
+        None
     """
-    # Open screening.csv file for reading data
-    with open(paths['screening'], "r") as file:
-        # Read its data into reader object
-        reader = csv.DictReader(file)
-        # If reader has any data, read it, otherwise return an empty set.
-        if any(reader):
-            screenings = []
-            existing_dates = set()
-            for row in reader:
-                # Convert date and time strings to datetime objects for storing in the Screening table
-                date = datetime.strptime(row['date'], '%Y-%m-%d').date()
-                time = datetime.strptime(row['time'], '%H:%M:%S').time()
-                # Create a Screening object using data from the current row
-                screening = Screening(date=date, time=time, available_seats=row['available_seats'], theater_id=row['theater_id'], movie_id=row['movie_id'])
-                # Append the Screening object to the list of screenings
-                screenings.append(screening)
-                # Add the date to the set of existing dates
-                existing_dates.add(date)
-            # Add all screenings to the database
-            db.session.add_all(screenings)
-            # Commit changes to the database
-            db.session.commit()
-            # Return the set of existing dates in the screening.csv file
-            return existing_dates
-        else:
-            # If there are no rows in the csv file
-            existing_dates = set()
-            # Return an empty set
-            return existing_dates
+    # Fast path for every request after the first one
+    if app.extensions.get('cinema3000_initialized'):
+        return
+    with _init_lock:
+        # Another request may have finished the initialization while this one waited for the lock
+        if not app.extensions.get('cinema3000_initialized'):
+            init_database(app)
 
 
-def create_new_screening_data(existing_dates, available_movies, theater_seats, show_times, paths):
+def get_csv_paths():
     """
-    Create new screening data for a movie theater based on available movies and show times.
-    Then store those data into the screening.csv file.
+    Creates a dictionary that maps file names to their corresponding absolute paths on the local file system.
 
-    Args:
-        existing_dates (set): A set containing existing screening dates.
-        available_movies (dict): A dictionary containing theater names as keys and available movies as values.
-        theater_seats (dict): A dictionary containing theater names as keys and number of seats as values.
-        show_times (dict): A dictionary containing movie titles as keys and a list of show times as values.
-        paths (dict): A dictionary containing file paths.
+    The files are in the CSV_FOLDER of the current application, or in the static folder outside an application context.
 
     Returns:
-        None
-
-    """
-    # Fieldnames for the screening.csv file for writing data
-    fieldnames = [
-        'id',
-        'date',
-        'time',
-        'available_seats',
-        'theater_id',
-        'movie_id'
-    ]
-
-    # If no existing dates are provided, create new screenings for the next 7 days starting from today
-    if not existing_dates:
-        # Initialize an empty list for movie objects for screenings objects
-        screenings = []
-        # Create a dictionary using list comprehension with movie tile as key and movie id as value for indexing. 
-        movie_ids = {movie.title: movie.id for movie in Movie.query.all()}
-        # Create a dictionary using list comprehension with theater name as key and theater id as value for indexing.
-        theater_ids = {theater.name: theater.id for theater in Theater.query.all()}
-        today = datetime.now().date()
-        duration = 7
-        # Iterate through the next 7 days starting from today
-        for i in range(duration):
-            screening_date = today + timedelta(days = i)
-            # Iterate over every theater
-            for theater in available_movies:
-                # Create data for number_of_seats using theater_seats dictionary for creating Screening object later
-                number_of_seats = theater_seats[theater]
-                # Iterate over each available movie for the current theater
-                for movie in available_movies[theater]:
-                    # If the movie matches the show times, create a screening for each time
-                    if movie in show_times:
-                        # Create data for movie_id and theater_id using movie_ids and theater_ids dictionary for creating Screening object later
-                        movie_id = movie_ids[movie]
-                        theater_id = theater_ids[theater]
-                        # Iterate over every show times for the current movie
-                        for time in show_times[movie]:
-                            # Convert show time string to datetime object for storing in the screening table
-                            time = datetime.strptime(time, '%H:%M').time()
-                            # Create a Screening object using data for current screening
-                            screening = Screening(date=screening_date, time=time, available_seats=number_of_seats, theater_id=theater_id, movie_id=movie_id)
-                            # Append the Screening object to the list of Screenings
-                            screenings.append(screening)
-        # Add all screenings to the database
-        db.session.add_all(screenings)
-        # Commit changes to the database
-        db.session.commit()
-
-        # Query the database for all Screening objects and returns a list.
-        screening_list = Screening.query.all()
-        # Open screening.csv file for writing data
-        with open(paths['screening'], 'w') as file:
-            # Create a DictWriter object with fieldnames specified
-            writer = csv.DictWriter(file, fieldnames=fieldnames)
-            # Write the header row to the CSV file
-            writer.writeheader()
-            # Iterate over each screening in the screening_list
-            for screening in screening_list:
-                # Create a dictionary with the screening data for each row in the CSV file
-                row = {
-                    'id': screening.id,
-                    'date': screening.date,
-                    'time': screening.time,
-                    'available_seats': screening.available_seats,
-                    'theater_id': screening.theater_id,
-                    'movie_id': screening.movie_id
-                }
-                # Write the row to the CSV file
-                writer.writerow(row)
-    # If existing dates are provided, only create new screenings for dates that don't already exist
-    else:
-        # Initialize an empty list for movie objects for screenings objects
-        screenings = []
-        # Create a dictionary using list comprehension with movie tile as key and movie id as value for indexing. 
-        movie_ids = {movie.title: movie.id for movie in Movie.query.all()}
-        # Create a dictionary using list comprehension with theater name as key and theater id as value for indexing.
-        theater_ids = {theater.name: theater.id for theater in Theater.query.all()}
-        today = datetime.now().date()
-        duration = 7
-        # Iterate through the next 7 days starting from today
-        for i in range(duration):
-            screening_date = today + timedelta(days = i)
-            # Only create screenings for new dates
-            if screening_date not in existing_dates:
-                # Iterate over every theater
-                for theater in available_movies:
-                    # Create data for number_of_seats using theater_seats dictionary for creating Screening object later
-                    number_of_seats = theater_seats[theater]
-                    # Iterate over each available movie for the current theater
-                    for movie in available_movies[theater]:
-                        # If the movie matches the show times, create a screening for each time
-                        if movie in show_times:
-                            # Create data for movie_id and theater_id using movie_ids and theater_ids dictionary for creating Screening object later
-                            movie_id = movie_ids[movie]
-                            theater_id = theater_ids[theater]
-                            # Iterate over every show times for the current movie
-                            for time in show_times[movie]:
-                                # Convert show time string to datetime object for storing in the screening table
-                                time = datetime.strptime(time, '%H:%M').time()
-                                # Create a Screening object using data for current screening
-                                screening = Screening(date=screening_date, time=time, available_seats=number_of_seats, theater_id=theater_id, movie_id=movie_id)
-                                # Append the Screening object to the list of Screenings
-                                screenings.append(screening)
-        # Add all screenings to the database
-        db.session.add_all(screenings)
-        # Commit changes to the database
-        db.session.commit()
-
-        # Open screening.csv file for appending new line
-        with open(paths['screening'], 'a') as file:
-            # Create a DictWriter object with fieldnames specified
-            writer = csv.DictWriter(file, fieldnames=fieldnames)
-            # Iterate over each screening (new data compared with the file) in the screenings
-            for screening in screenings:
-                # Create a dictionary with the screening data for each row in the CSV file
-                row = {
-                    'id': screening.id,
-                    'date': screening.date,
-                    'time': screening.time,
-                    'available_seats': screening.available_seats,
-                    'theater_id': screening.theater_id,
-                    'movie_id': screening.movie_id
-                }
-                # Write the row to the CSV file
-                writer.writerow(row)
-
-
-def read_booking_data(paths):
+        dict: A dictionary with file names as keys and their corresponding absolute paths as values.
     """
-    Reads data from booking.csv into the booking table in the database and adds bookings to their respective screenings.
-
-    Args:
-        paths (dict): A dictionary containing file paths to the data files.
 
-    Returns:
-        None
-    """
-    # Open booking.csv file for reading data
-    with open(paths['booking'], "r") as file:
-        # Read its data into reader object
-        reader = csv.DictReader(file)
-        # Iterate over each row in the csv file
-        for row in reader:
-            # Get the screening id from the row
-            screening_id = int(row['screening_id'])
-            # Find the screening with the given id in the database
-            screening = Screening.query.filter_by(id=screening_id).first()
-
-            # If the screening is not found, skip to the next row
-            if screening is None:
-                continue
-            
-            # Convert the timestamp string from the CSV file to a datetime object
-            timestamp = datetime.strptime(row['timestamp'], '%Y-%m-%d %H:%M:%S')
-            # Create a new Booking object with the data from the row
-            booking = Booking(number_of_tickets=row['number_of_tickets'], timestamp=timestamp, user_id=row['user_id'])
-            # Add the booking to the screening's list of bookings (Booking and Screening has many-to-many relationship)
-            screening.bookings.append(booking)
-            # Commit the changes to the database
-            db.session.commit()
+    # Get the folder of the csv files, by default the static folder next to the current script file
+    if has_app_context():
+        folder = current_app.config['CSV_FOLDER']
+    else:
+        folder = os.path.join(Path(__file__).absolute().parent, "static")
+    # Create a dictionary named paths that maps file names to their corresponding absolute paths on the local file system. 
+    paths = {
+        "movie": os.path.join(folder, "movie.csv"),
+        "theater": os.path.join(folder, "theater.csv"),
+        "user": os.path.join(folder, "user.csv"),
+        "booking": os.path.join(folder, "booking.csv"),
+        "screening": os.path.join(folder, "screening.csv"),
+        "booking_archive": os.path.join(folder, "booking_archive.csv")
+    }
+    # Return a dictionary of paths
+    return paths
@@ -0,0 +1,280 @@
+"""
+The purpose of admission.py is to put a waiting room in front of the booking routes.
+
+When a popular screening opens, every user submits the ticket forms of the same screening at once
+and all of them would compete for the single SQLite writer. With the ADMISSION_CONTROL setting on,
+every screening gets its own gate:
+    - at most ADMISSION_MAX_ACTIVE requests of the screening run the booking route at the same time,
+    - the others wait in a first in, first out (FIFO) queue of at most ADMISSION_MAX_QUEUE places,
+    - a request that is not admitted within ADMISSION_WAIT_SECONDS gets a waiting page with its position in the queue,
+      which resubmits the form (keeping the place in the queue) after ADMISSION_RETRY_AFTER seconds,
+    - when the queue is full the request is rejected right away with 429 Too Many Requests and a Retry-After header.
+The gates are per screening, so a sold-out hit does not slow down the booking of any other show.
+A gate is only made for a screening that exists, and it is dropped again once nobody uses it and its queue is empty.
+Everything lives in the memory of the application process, no external service is needed.
+"""
+# Import functions from the Flask framework to read the request and build the waiting page
+from flask import current_app, request, render_template, make_response
+from flask_login import current_user
+# Import the Screening model and the router, to check that a screening exists before it gets a gate
+from .models import Screening
+from .sharding import screening_session
+# Import wraps to keep the name of the decorated view function
+from functools import wraps
+# Import OrderedDict, which keeps the queue in arrival order and finds a place in it quickly
+from collections import OrderedDict
+# Import the modules used to let request threads wait for their turn
+import threading
+import time
+import uuid
+
+# A queued request that has not come back for this many Retry-After intervals gave up, and loses its place
+ABANDONED_AFTER_RETRIES = 4
+
+
+class Admission:
+    """
+    A class that represents the decision of the admission controller for one request.
+
+        Attributes:
+            admitted (bool): True if the request may run the booking route now.
+            ticket (str or None): The queue ticket of a waiting request, sent back when the form is resubmitted.
+            position (int or None): The place of a waiting request in the queue, starting at 1.
+            rejected (bool): True if the queue was full and the request was turned away.
+    """
+
+    def __init__(self, admitted, ticket=None, position=None, rejected=False):
+        self.admitted = admitted
+        self.ticket = ticket
+        self.position = position
+        self.rejected = rejected
+
+
+class ScreeningGate:
+    """
+    A class that represents the waiting room of one screening.
+
+        Attributes:
+            active (int): The number of requests currently running the booking route.
+            users (int): The number of requests holding the gate, admitted or waiting inside the server.
+            queue (OrderedDict): The queue tickets in arrival order, with the time each waiting request was last seen.
+            condition (threading.Condition): Wakes up waiting requests when a request leaves the booking route.
+    """
+
+    def __init__(self):
+        self.active = 0
+        self.users = 0
+        self.queue = OrderedDict()
+        self.condition = threading.Condition()
+
+
+class AdmissionController:
+    """
+    A class that admits, queues or rejects booking requests per screening.
+
+        Attributes:
+            max_active (int): The largest number of requests of one screening running at the same time.
+            max_queue (int): The largest number of requests waiting for one screening.
+            wait_seconds (float): How long a request waits inside the server before it gets the waiting page.
+            retry_after (int): The number of seconds after which a waiting or rejected client should try again.
+    """
+
+    def __init__(self, max_active, max_queue, wait_seconds, retry_after):
+        self.max_active = max_active
+        self.max_queue = max_queue
+        self.wait_seconds = wait_seconds
+        self.retry_after = retry_after
+        self._gates = {}
+        self._lock = threading.Lock()
+
+    def gate(self, screening_id, exists):
+        """
+        Return the gate of a screening and count the request as one of its users, creating the gate on first use.
+
+        Args:
+            screening_id (int): The ID of the screening.
+            exists (function): Called with the screening ID before a new gate is made, returns True if the screening exists.
+
+        Returns:
+            ScreeningGate or None: The gate of the screening, or None if the screening does not exist.
+        """
+        with self._lock:
+            gate = self._gates.get(screening_id)
+            if gate is not None:
+                gate.users += 1
+                return gate
+        # Only a screening that exists gets a gate, so made-up IDs cannot fill the memory with gates
+        # (asked outside the lock, so the database query does not hold up the other screenings)
+        if not exists(screening_id):
+            return None
+        with self._lock:
+            self._drop_idle_gates()
+            gate = self._gates.setdefault(screening_id, ScreeningGate())
+            gate.users += 1
+            return gate
+
+    def admit(self, screening_id, ticket=None, exists=lambda screening_id: True):
+        """
+        Decide if a request for a screening may run now, has to wait, or is rejected.
+
+        Args:
+            screening_id (int): The ID of the screening.
+            ticket (str or None): The queue ticket of a resubmitted waiting page.
+            exists (function): Called with the screening ID before a new gate is made, returns True if the screening exists.
+
+        Returns:
+            Admission or None: The decision, or None if the screening does not exist and there is nothing to wait for.
+        """
+        gate = self.gate(screening_id, exists)
+        if gate is None:
+            return None
+        admission = self._admit(gate, ticket)
+        # An admitted request keeps using the gate until release(), the others are done with it
+        if not admission.admitted:
+            self._leave(screening_id, gate)
+        return admission
+
+    def _admit(self, gate, ticket):
+        # Queue the request at the gate and wait up to ADMISSION_WAIT_SECONDS for a free slot
+        with gate.condition:
+            now = time.monotonic()
+            self._drop_abandoned(gate, now)
+            if ticket not in gate.queue:
+                # A new request goes straight in if there is a free slot and nobody is waiting before it
+                if gate.active < self.max_active and not gate.queue:
+                    gate.active += 1
+                    return Admission(True)
+                if len(gate.queue) >= self.max_queue:
+                    return Admission(False, rejected=True)
+                ticket = uuid.uuid4().hex
+            deadline = now + self.wait_seconds
+            while True:
+                # Remember that the request is still waiting (updating a ticket keeps its place in the queue)
+                gate.queue[ticket] = time.monotonic()
+                # Only the first request in the queue may take a free slot, which keeps the order fair
+                if gate.active < self.max_active and next(iter(gate.queue)) == ticket:
+                    del gate.queue[ticket]
+                    gate.active += 1
+                    return Admission(True)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return Admission(False, ticket=ticket, position=list(gate.queue).index(ticket) + 1)
+                gate.condition.wait(remaining)
+
+    def release(self, screening_id):
+        """
+        Free the slot of an admitted request and wake up the waiting ones.
+
+        Args:
+            screening_id (int): The ID of the screening.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            gate = self._gates[screening_id]
+        with gate.condition:
+            gate.active -= 1
+            gate.condition.notify_all()
+        self._leave(screening_id, gate)
+
+    def _leave(self, screening_id, gate):
+        # A request is done with a gate, drop the gate if nobody uses it and nobody waits in its queue
+        with self._lock:
+            gate.users -= 1
+            with gate.condition:
+                idle = gate.users == 0 and gate.active == 0 and not gate.queue
+            if idle and self._gates.get(screening_id) is gate:
+                del self._gates[screening_id]
+
+    def _drop_idle_gates(self):
+        # Drop the gates whose waiting requests were all abandoned (called with the controller lock held)
+        now = time.monotonic()
+        for screening_id, gate in list(self._gates.items()):
+            if gate.users:
+                continue
+            with gate.condition:
+                self._drop_abandoned(gate, now)
+                idle = gate.active == 0 and not gate.queue
+            if idle:
+                del self._gates[screening_id]
+
+    def _drop_abandoned(self, gate, now):
+        # Remove the waiting requests whose users closed the waiting page
+        limit = now - self.retry_after * ABANDONED_AFTER_RETRIES
+        abandoned = [ticket for ticket, last_seen in gate.queue.items() if last_seen < limit]
+        for ticket in abandoned:
+            del gate.queue[ticket]
+        if abandoned:
+            gate.condition.notify_all()
+
+
+def admission_controller(app):
+    """
+    Return the admission controller of the application, creating it on first use.
+
+    Args:
+        app (Flask): Flask application object
+
+    Returns:
+        AdmissionController: The admission controller of the application.
+    """
+    if 'admission_controller' not in app.extensions:
+        app.extensions.setdefault('admission_controller', AdmissionController(
+            app.config['ADMISSION_MAX_ACTIVE'], app.config['ADMISSION_MAX_QUEUE'],
+            app.config['ADMISSION_WAIT_SECONDS'], app.config['ADMISSION_RETRY_AFTER']))
+    return app.extensions['admission_controller']
+
+
+def screening_exists(screening_id, theater_id=None):
+    """
+    Check if a screening exists, before the admission controller makes a gate for it.
+
+    Args:
+        screening_id (int): The ID of the screening.
+        theater_id (str or None): The ID of the screening's theater if the form sent it.
+
+    Returns:
+        bool: True if the screening exists.
+    """
+    return screening_session(screening_id, theater_id).get(Screening, screening_id) is not None
+
+
+def admission_control(view):
+    """
+    Decorator that runs a booking route through the waiting room of the screening in the submitted form.
+
+    Args:
+        view (function): The view function of the booking route.
+
+    Returns:
+        function: The decorated view function.
+    """
+    @wraps(view)
+    def decorated_view(*args, **kwargs):
+        # Only booking forms of a screening go through the waiting room
+        screening_id = request.form.get('booked_screening', type=int) or request.form.get('screening_id', type=int)
+        if not current_app.config['ADMISSION_CONTROL'] or request.method != 'POST' or screening_id is None:
+            return view(*args, **kwargs)
+
+        controller = admission_controller(current_app._get_current_object())
+        theater_id = request.form.get('booked_theater') or request.form.get('theater_id')
+        admission = controller.admit(screening_id, request.form.get('queue_ticket'),
+                                     lambda screening_id: screening_exists(screening_id, theater_id))
+        if admission is None:
+            # No such screening, the booking route shows its own error without a gate being made
+            return view(*args, **kwargs)
+        if admission.admitted:
+            try:
+                return view(*args, **kwargs)
+            finally:
+                controller.release(screening_id)
+
+        # Show the waiting page, which sends the same form again (with the queue ticket) after Retry-After seconds
+        form = [(name, value) for name, value in request.form.items() if name != 'queue_ticket']
+        response = make_response(render_template("waiting.html", user=current_user, admission=admission,
+                                                 form=form, retry_after=controller.retry_after),
+                                 429 if admission.rejected else 202)
+        response.headers['Retry-After'] = str(controller.retry_after)
+        return response
+    return decorated_view
@@ -0,0 +1,210 @@
+"""
+The purpose of archive.py is to move past screenings and their bookings out of the hot tables.
+
+Screenings older than a cutoff date are removed from the Screening table and from screening.csv,
+and their bookings are removed from the Booking table and from booking.csv.
+The bookings are kept as flat rows in booking_archive.csv and in the ArchivedBooking table,
+so the booking history stays visible on the myBooking page while insert_data() and the listing queries touch less data.
+"""
+# Import the 'db' object located in __init__.py from the current package (website) for database operations
+from . import db
+# Imports the models from the current package, which define the database tables and their relationships
+from .models import User, Screening, Theater, Movie, Booking, BookingRequest, ScreeningDate, ArchivedBooking, screening_booking
+# Import the router, so archiving also works when screenings are split across shard files
+from .sharding import data_sessions, raise_booking_id_floor
+# Import click and with_appcontext to define the command line interface of the archive
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+# Import necessary modules to work with dates and times.
+from datetime import datetime, timedelta
+# Import the csv persistence layer that locks, checksums and atomically replaces the csv files
+from .csvstore import csv_file
+
+# Fieldnames of the booking_archive.csv file
+ARCHIVE_FIELDNAMES = [
+    'transaction_id',
+    'user_id',
+    'customer_name',
+    'number_of_tickets',
+    'date',
+    'time',
+    'theater_name',
+    'movie_title',
+    'ticket_price',
+    'screening_id',
+    'timestamp'
+]
+
+
+def archive_screenings(cutoff, paths):
+    """
+    Move screenings before the cutoff date, and their bookings, out of the hot tables and csv files.
+
+    The archived rows are read from the database, which is the source of truth, and the database is changed last:
+    first the rows are appended to booking_archive.csv, then they are removed from booking.csv and screening.csv,
+    and only then the database transactions commit. Every step can be run again, so a run that stopped part way
+    (a crash, a full disk) left the screenings in the database and the next run finishes it.
+
+    Args:
+        cutoff (date): Screenings on an earlier date are archived.
+        paths (dict): A dictionary containing the absolute paths of the csv files.
+
+    Returns:
+        Tuple: The number of archived screenings and the number of archived bookings.
+    """
+    # Every database file (every shard when sharding is enabled) has its own screenings and bookings
+    sessions = data_sessions()
+    screening_ids = []
+    archived_rows = []
+    for session in sessions:
+        screening_ids.extend(screening_id for (screening_id,) in session.query(Screening.id).filter(Screening.date < cutoff))
+        # The bookings of those screenings with the screening, theater, movie and customer details copied in
+        # (every shard has a copy of the user table)
+        archived_rows.extend(archive_row(*row) for row in
+                             session.query(Booking, Screening, Theater.name, Movie.title,
+                                           db.func.coalesce(Booking.price, Movie.price),
+                                           User.first_name + " " + User.last_name)
+                             .join(screening_booking, screening_booking.c.booking_id == Booking.id)
+                             .join(Screening, Screening.id == screening_booking.c.screening_id)
+                             .join(Theater, Theater.id == Screening.theater_id)
+                             .join(Movie, Movie.id == Screening.movie_id)
+                             .join(User, User.id == Booking.user_id)
+                             .filter(Screening.date < cutoff)
+                             .order_by(Booking.id))
+    if not screening_ids:
+        return 0, 0
+
+    # Write the archive to the csv files first: append the archived bookings to booking_archive.csv
+    # (writing the header if the file is new, and leaving out the rows an interrupted run already appended)
+    # and remove them and their screenings from booking.csv and screening.csv
+    archived_screenings = set(screening_ids)
+    archived_ids = {row['transaction_id'] for row in archived_rows}
+    in_csv = {int(row['transaction_id']) for row in csv_file(paths['booking_archive']).stream()
+              if int(row['transaction_id']) in archived_ids}
+    csv_file(paths['booking_archive']).append(ARCHIVE_FIELDNAMES, [row for row in archived_rows if row['transaction_id'] not in in_csv])
+    csv_file(paths['booking']).update(lambda rows: [row for row in rows if int(row['screening_id']) not in archived_screenings])
+    csv_file(paths['screening']).update(lambda rows: [row for row in rows if int(row['id']) not in archived_screenings])
+
+    # Then move the data in the database, one transaction per database file
+    for session in sessions:
+        booking_ids = [booking_id for (booking_id,) in session.query(screening_booking.c.booking_id)
+                       .filter(screening_booking.c.screening_id.in_(screening_ids))]
+        session.execute(screening_booking.delete().where(screening_booking.c.screening_id.in_(screening_ids)))
+        session.query(Booking).filter(Booking.id.in_(booking_ids)).delete(synchronize_session=False)
+        session.query(Screening).filter(Screening.id.in_(screening_ids)).delete(synchronize_session=False)
+        session.query(BookingRequest).filter(BookingRequest.booking_id.in_(booking_ids)).delete(synchronize_session=False)
+        # The shard numbers its new bookings above the archived ones
+        if session is not db.session and booking_ids:
+            raise_booking_id_floor(session, max(booking_ids))
+    # The archived bookings an interrupted run already stored are not added again
+    stored = {booking_id for (booking_id,) in db.session.query(ArchivedBooking.id).filter(ArchivedBooking.id.in_(archived_ids))}
+    db.session.add_all([archived_booking(row) for row in archived_rows if row['transaction_id'] not in stored])
+    ScreeningDate.query.filter(ScreeningDate.date < cutoff).delete(synchronize_session=False)
+    # The main database (with the archived bookings) commits before the shards delete theirs, so no booking is ever lost
+    db.session.commit()
+    for session in sessions:
+        if session is not db.session:
+            session.commit()
+    return len(screening_ids), len(archived_rows)
+
+
+def archive_row(booking, screening, theater_name, movie_title, price, customer_name):
+    """
+    Create a row of booking_archive.csv from a booking and the details of its screening.
+
+    Args:
+        booking (Booking): The archived booking.
+        screening (Screening): The screening of the booking.
+        theater_name (str): The name of the screening's theater.
+        movie_title (str): The title of the screening's movie.
+        price (float): The price the tickets were sold at.
+        customer_name (str): The full name of the user who booked.
+
+    Returns:
+        dict: The row of booking_archive.csv.
+    """
+    return {
+        'transaction_id': booking.id,
+        'user_id': booking.user_id,
+        'customer_name': customer_name,
+        'number_of_tickets': booking.number_of_tickets,
+        'date': screening.date,
+        'time': screening.time,
+        'theater_name': theater_name,
+        'movie_title': movie_title,
+        'ticket_price': price,
+        'screening_id': screening.id,
+        'timestamp': booking.timestamp.strftime('%Y-%m-%d %H:%M:%S')
+    }
+
+
+def archived_booking(row):
+    """
+    Create an ArchivedBooking object from a row of booking_archive.csv.
+
+    Args:
+        row (dict): A row of booking_archive.csv.
+
+    Returns:
+        ArchivedBooking: The archived booking.
+    """
+    return ArchivedBooking(
+        id=int(row['transaction_id']),
+        user_id=int(row['user_id']),
+        number_of_tickets=int(row['number_of_tickets']),
+        timestamp=datetime.strptime(str(row['timestamp']), '%Y-%m-%d %H:%M:%S'),
+        screening_id=int(row['screening_id']),
+        date=datetime.strptime(str(row['date']), '%Y-%m-%d').date(),
+        time=datetime.strptime(str(row['time']), '%H:%M:%S').time(),
+        theater_name=row['theater_name'],
+        movie_title=row['movie_title'],
+        price=float(row['ticket_price'])
+    )
+
+
+def reserve_booking_ids():
+    """
+    Make sure new bookings never get a transaction ID that an archived booking already has, inside the caller's transaction.
+
+    The booking table uses AUTOINCREMENT, so raising its sequence to the largest archived ID is enough.
+    sqlite_sequence is an ordinary table, so the change is committed (or rolled back) with the rest of the caller's work.
+
+    Returns:
+        None
+    """
+    largest = db.session.query(db.func.max(ArchivedBooking.id)).scalar()
+    if largest is None:
+        return
+    db.session.execute(db.text("INSERT INTO sqlite_sequence (name, seq) SELECT 'booking', 0 "
+                               "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'booking')"))
+    db.session.execute(db.text("UPDATE sqlite_sequence SET seq = MAX(seq, :largest) WHERE name = 'booking'"),
+                       {'largest': largest})
+
+
+def archive_cutoff(days):
+    """
+    Compute the archive cutoff date from a number of days to keep.
+
+    Args:
+        days (int): How many past days of screenings stay in the hot tables.
+
+    Returns:
+        date: Screenings before this date are archived.
+    """
+    return datetime.now().date() - timedelta(days=days)
+
+
+@click.command('archive-screenings')
+@click.option('--days', type=int, default=None,
+              help='Keep this many past days of screenings (defaults to the ARCHIVE_AFTER_DAYS setting, or 30).')
+@with_appcontext
+def archive_screenings_command(days):
+    """
+    Move past screenings and their bookings into the archive.
+    """
+    from . import get_csv_paths
+    if days is None:
+        days = current_app.config.get('ARCHIVE_AFTER_DAYS') or 30
+    screenings, bookings = archive_screenings(archive_cutoff(days), get_csv_paths())
+    click.echo(f"Archived {screenings} screenings and {bookings} bookings.")
@@ -8,16 +8,19 @@ This way the app.py can be nicely organized and separate the views from applicat
 from flask import Blueprint, render_template, request, flash, redirect, url_for
 # Imports the user model from the current package, which define the database tables and their relationships
 from .models import User
-# Import the necessary function to hash passwords which is used to securely store and verify passwords.
-from werkzeug.security import generate_password_hash, check_password_hash
-# Import the 'db' object located in __init__.py from the current package (website) for database operations
-from . import db
+# Import the password policy which is used to securely store and verify passwords.
+from .passwords import password_policy
+# Import the csv persistence layer that locks, checksums and atomically replaces the csv files
+from .csvstore import csv_file
+# Import the 'db' object located in __init__.py from the current package (website) for database operations,
+# and the paths of the csv files
+from . import db, get_csv_paths
 # Import necessary functions for user authentication.
 from flask_login import login_user, login_required, logout_user, current_user
-# Import necessary modules for file I/O
-import csv
-from pathlib import Path
-import os
+# Import the rate limiter that turns away floods of form submissions before any password hashing
+from .ratelimit import rate_limited
+# Import the router, so a new user is also copied into the shard files
+from .sharding import copy_user_to_shards
 
 # Define a blueprint named 'auth' for this module.
 # Blueprints are used to organize routes and views in Flask applications.
@@ -26,6 +29,8 @@ auth = Blueprint('auth', __name__)
 
 # Define a route for the login page
 @auth.route('/login', methods=['GET', 'POST'])
+# '@rate_limited' rejects submissions over the RATE_LIMITS of the route with 429 before the password is checked.
+@rate_limited
 def login():
     """
     Route for the login page.
@@ -35,6 +40,7 @@ def login():
         - Looks for a user with the given email in the database.
         - If a user is found:
             - Checks if the given password matches the hashed password stored in the database.
+            - If the password matches and its hash was made with an older policy, hashes it again with the current policy.
             - If the password matches, logs the user in and redirects to the home page.
             - If the password does not match, displays an error message.
         - If no user is found with the given email, displays an error message.
@@ -54,7 +60,13 @@ def login():
         user = User.query.filter_by(email=email).first()
         if user:
             # Check if the given password matches the hashed password stored in the database
-            if check_password_hash(user.password, password):
+            policy = password_policy()
+            if policy.verify(user.password, password or ''):
+                # Upgrade a hash made with an older method or cost to the current policy while the plain password is known
+                if policy.needs_rehash(user.password):
+                    user.password = policy.hash(password)
+                    db.session.commit()
+                    save_password_to_csv(user.email, user.password)
                 # If the password matches, log the user in
                 flash("Logged in successfully!", category='success')
                 # Keep user logged in after browsing session ends,until clearing its browsing history or session
@@ -70,6 +82,29 @@ def login():
     return render_template("login.html", user=current_user)
 
 
+def save_password_to_csv(email, password_hash):
+    """
+    Replace the password hash of a user in the user.csv file.
+
+    Args:
+        email (str): The email of the user.
+        password_hash (str): The new password hash.
+
+    Returns:
+        None
+    """
+    path_user = get_csv_paths()['user']
+
+    def replace_password(rows):
+        for row in rows:
+            if row['email'] == email:
+                row['password'] = password_hash
+        return rows
+
+    # Read and replace the file under its lock, so a user registering at the same time is not lost
+    csv_file(path_user).update(replace_password)
+
+
 # Define a route for the logout functionality
 @auth.route('/logout')
 @login_required
@@ -91,6 +126,7 @@ def logout():
 
 # Define a route for the registration page
 @auth.route('/register', methods=['GET', 'POST'])
+@rate_limited
 def register():
     """
     Route for the registration page.
@@ -136,20 +172,20 @@ def register():
             flash('Password must be at least 7 characters.', category='error')
         else:
             # If form input data is valid, create a new User object with the data and add it to the database
-            new_user = User(email=email, first_name=first_name, last_name=last_name, password=generate_password_hash(password1, method='sha256'))
+            new_user = User(email=email, first_name=first_name, last_name=last_name, password=password_policy().hash(password1))
             # add new_user to the database
             db.session.add(new_user)
             db.session.commit()
+            # Every shard keeps a copy of the user table (nothing to do when sharding is disabled)
+            copy_user_to_shards(new_user)
             # Log the new user in and remember the user
             login_user(new_user, remember=True)
             # Flash a message to the user with success category
             flash('Account created.', category='success')
 
             # Write new user database to user.csv
-            # Get the absolute path of the directory where this script file resides
-            working_directory = Path(__file__).absolute().parent
             # Get the path of the user.csv file
-            path_user = os.path.join(working_directory, "static", "user.csv")
+            path_user = get_csv_paths()['user']
             
             # Get data from user
             # Get all the user objects from the database
@@ -163,31 +199,23 @@ def register():
             
             # if creating user for the first time
             if user_list_count == 1:
-                # If the user.csv file is being created for the first time, open it in write mode
-                with open(path_user, 'w') as file_user:
-                    writer = csv.DictWriter(file_user, fieldnames=fieldnames)
-                    # Write the header row to the csv file
-                    writer.writeheader()
-                    # Write each user's data as a row in the csv file
-                    for user in user_list:
-                        row = {
-                            'email': user.email,
-                            'password': user.password, 
-                            'first_name': user.first_name, 
-                            'last_name': user.last_name
-                        }
-                        writer.writerow(row)
+                # If the user.csv file is being created for the first time, write the header and each user's data as a row
+                rows = [{
+                    'email': user.email,
+                    'password': user.password,
+                    'first_name': user.first_name,
+                    'last_name': user.last_name
+                } for user in user_list]
+                csv_file(path_user).rewrite(fieldnames, rows)
             # add new user to the csv file
             else:
-                with open(path_user, 'a', newline='') as file_user:
-                    writer = csv.DictWriter(file_user, fieldnames=fieldnames)
-                    row = {
-                        'email': new_user.email, 
-                        'password': new_user.password, 
-                        'first_name': new_user.first_name, 
-                        'last_name': new_user.last_name
-                    }
-                    writer.writerow(row)
+                row = {
+                    'email': new_user.email,
+                    'password': new_user.password,
+                    'first_name': new_user.first_name,
+                    'last_name': new_user.last_name
+                }
+                csv_file(path_user).append(fieldnames, [row])
                     
             # location for the home function in views. blueprint name.function name
             return redirect(url_for('views.home'))
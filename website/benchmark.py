@@ -0,0 +1,252 @@
+"""
+The purpose of benchmark.py is to measure how the website behaves under load.
+
+'flask login-flood-benchmark' floods the login form with wrong passwords at a fixed rate from several threads
+while one logged in user keeps opening the ticket form of a screening, and reports the latency of the ticket form:
+    - with no flood, as the baseline,
+    - during the flood without rate limiting, where every attempt checks a password hash,
+    - during the flood with the RATE_LIMITS setting, where most attempts are turned away before hashing.
+The ticket form is the read part of the booking flow, so the benchmark does not write bookings into the csv files.
+
+'flask password-benchmark' measures how much CPU time one login spends checking the password with each hash method,
+to choose the PASSWORD_HASH_METHOD setting.
+
+'flask schedule-memory-benchmark' fills a temporary database with a million synthetic screenings and measures the memory
+of holding them as Screening objects, as ScreeningListing objects and in the compact ScheduleStore (see schedule.py).
+"""
+# Import the 'db' object located in __init__.py from the current package (website) for database operations
+from . import db
+# Imports the models from the current package, which define the database tables and their relationships
+from .models import User, Screening, ScreeningListing
+# Import the password policy, used to create the flood account and to time the hash methods
+from .passwords import PasswordPolicy, password_policy
+# Import the synthetic dataset of the query budget check and the compact schedule store, used by the memory benchmark
+from .querybudget import build_budget_dataset
+from .schedule import ScheduleStore, read_schedule_rows
+# Import click and with_appcontext to define the command line interface
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+# Import the modules used to run the threads and summarize the timings
+from collections import Counter
+from datetime import date, timedelta
+import gc
+import os
+import statistics
+import tempfile
+import threading
+import time
+import tracemalloc
+
+# The account the flood tries to log in to
+FLOOD_EMAIL = 'flood@benchmark.invalid'
+
+# The hash methods compared by the password benchmark when none are given
+BENCHMARK_HASH_METHODS = [
+    'pbkdf2:sha256:100000',
+    'pbkdf2:sha256:600000',
+    'scrypt:16384:8:1',
+    'scrypt:32768:8:1',
+    'scrypt:65536:8:1',
+]
+
+
+def percentile(values, fraction):
+    """
+    Return a percentile of a list of numbers.
+
+    Args:
+        values (list): The numbers.
+        fraction (float): The percentile as a fraction, for example 0.95.
+
+    Returns:
+        float: The value below which that fraction of the numbers lie.
+    """
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def run_login_flood(app, seconds, flood_threads, flood_rate, user_id, screening):
+    """
+    Measure the latency of the ticket form while other threads flood the login form.
+
+    Args:
+        app (Flask): Flask application object
+        seconds (float): How long to measure.
+        flood_threads (int): The number of threads submitting the login form (0 for no flood).
+        flood_rate (float): The number of login attempts per second, shared by the flood threads.
+        user_id (int): The ID of the user who opens the ticket form.
+        screening (Screening): The screening whose ticket form is opened.
+
+    Returns:
+        Tuple: The list of ticket form latencies in milliseconds, and a Counter of the login responses by status code.
+    """
+    stop = threading.Event()
+    responses = Counter()
+    lock = threading.Lock()
+
+    def flood():
+        client = app.test_client()
+        # Every thread sends its share of the attempts on a fixed schedule, like clients on the network would
+        interval = flood_threads / flood_rate
+        next_attempt = time.perf_counter()
+        while not stop.is_set():
+            next_attempt += interval
+            response = client.post('/login', data={'email': FLOOD_EMAIL, 'password': 'not-the-password'})
+            with lock:
+                responses[response.status_code] += 1
+            stop.wait(max(0, next_attempt - time.perf_counter()))
+
+    threads = [threading.Thread(target=flood) for _ in range(flood_threads)]
+    for thread in threads:
+        thread.start()
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+    latencies = []
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        client.post('/getTicket', data={'screening_id': screening.id, 'theater_id': screening.theater_id})
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return latencies, responses
+
+
+@click.command('login-flood-benchmark')
+@click.option('--seconds', default=10.0, show_default=True, help='How long each phase runs.')
+@click.option('--flood-threads', default=8, show_default=True, help='Number of threads flooding the login form.')
+@click.option('--flood-rate', default=100.0, show_default=True, help='Login attempts per second during the flood.')
+@with_appcontext
+def login_flood_benchmark_command(seconds, flood_threads, flood_rate):
+    """
+    Compare the latency of the ticket form during a login flood with and without rate limiting.
+    """
+    app = current_app._get_current_object()
+    user = User.query.filter(User.email != FLOOD_EMAIL).first()
+    screening = Screening.query.first()
+    if user is None or screening is None:
+        raise click.ClickException("The benchmark needs at least one user and one screening in the database.")
+    # Add the flood account to the database only; it is not written to user.csv
+    flood_user = User(email=FLOOD_EMAIL, first_name='Flood', last_name='Benchmark', password=password_policy().hash('the-password'))
+    db.session.add(flood_user)
+    db.session.commit()
+
+    limits = app.config['RATE_LIMITS']
+    phases = [('no flood', limits, 0), ('flood, no rate limiting', {}, flood_threads), ('flood, rate limiting', limits, flood_threads)]
+    try:
+        for name, phase_limits, threads in phases:
+            app.config['RATE_LIMITS'] = phase_limits
+            # Every phase starts with empty buckets
+            app.extensions.pop('rate_limiters', None)
+            latencies, responses = run_login_flood(app, seconds, threads, flood_rate, user.id, screening)
+            logins = ", ".join(f"{count} x {status}" for status, count in sorted(responses.items())) or "none"
+            click.echo(f"{name:<25} ticket form p50 {statistics.median(latencies):7.1f} ms  p95 {percentile(latencies, 0.95):7.1f} ms  "
+                       f"({len(latencies)} requests)  login responses: {logins}")
+    finally:
+        app.config['RATE_LIMITS'] = limits
+        app.extensions.pop('rate_limiters', None)
+        db.session.delete(flood_user)
+        db.session.commit()
+
+
+def time_password_check(method, rounds):
+    """
+    Measure how long checking a password takes with a hash method.
+
+    Args:
+        method (str): The werkzeug hash method with its cost.
+        rounds (int): The number of checks to time; the median is returned.
+
+    Returns:
+        float: The median time of one check in milliseconds.
+    """
+    policy = PasswordPolicy(method)
+    stored = policy.hash('benchmark-password')
+    timings = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        policy.verify(stored, 'benchmark-password')
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+@click.command('password-benchmark')
+@click.option('--method', 'methods', multiple=True, help='Hash method to time, can be given several times (defaults to a list of common settings).')
+@click.option('--rounds', default=5, show_default=True, help='Number of password checks timed per method.')
+@with_appcontext
+def password_benchmark_command(methods, rounds):
+    """
+    Measure the CPU cost of one login for different password hash methods.
+    """
+    current = current_app.config['PASSWORD_HASH_METHOD']
+    methods = list(methods) or BENCHMARK_HASH_METHODS + ([current] if current not in BENCHMARK_HASH_METHODS else [])
+    for method in methods:
+        milliseconds = time_password_check(method, rounds)
+        marker = "  (current setting)" if method == current else ""
+        click.echo(f"{method:<24} {milliseconds:8.1f} ms per login  {1000 / milliseconds:8.1f} logins per second per core{marker}")
+
+
+def measure_memory(build):
+    """
+    Measure the memory a data structure holds and the time it takes to build.
+
+    Args:
+        build (function): A function without arguments that builds the data structure.
+
+    Returns:
+        Tuple: The data structure, the number of bytes allocated for it and still held, and the build time in seconds.
+    """
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    built = build()
+    elapsed = time.perf_counter() - started
+    held, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return built, held, elapsed
+
+
+@click.command('schedule-memory-benchmark')
+@click.option('--screenings', default=1000000, show_default=True, help='Approximate number of synthetic screenings.')
+@with_appcontext
+def schedule_memory_benchmark_command(screenings):
+    """
+    Compare the memory of a large schedule held as ORM objects and in the compact schedule store.
+    """
+    from . import create_app
+    # 50 theaters show 20 movies 10 times a day, for as many days as it takes
+    theaters, movies, shows = 50, 20, 10
+    days = max(1, -(-screenings // (theaters * movies * shows)))
+    with tempfile.TemporaryDirectory() as folder:
+        # A separate application on a temporary database, so the real database and the csv files are not touched
+        app = create_app(lazy_init=True, database_uri=f"sqlite:///{os.path.join(folder, 'schedule.db')}")
+        with app.app_context():
+            click.echo(f"Building {theaters * movies * days * shows} screenings ...")
+            build_budget_dataset(theaters, movies, days, shows, 1)
+            start, end = date.today() + timedelta(days=days // 2), date.today() + timedelta(days=days // 2 + 13)
+            candidates = [
+                ('Screening objects', lambda: db.session.query(Screening).all()),
+                ('ScreeningListing objects', lambda: db.session.query(ScreeningListing).all()),
+                ('ScheduleStore', lambda: ScheduleStore(read_schedule_rows([db.session]))),
+            ]
+            for name, build in candidates:
+                built, held, elapsed = measure_memory(build)
+                # Time the screenings of two weeks, as the currentMovies page asks for them
+                started = time.perf_counter()
+                if isinstance(built, ScheduleStore):
+                    found = len(built.entries(start, end))
+                else:
+                    found = len(db.session.query(ScreeningListing).filter(ScreeningListing.date.between(start, end))
+                                .order_by(ScreeningListing.date, ScreeningListing.theater_name, ScreeningListing.movie_title,
+                                          ScreeningListing.time).all())
+                lookup = (time.perf_counter() - started) * 1000
+                click.echo(f"{name:<25} {held / 1024 / 1024:9.1f} MB  {held / len(built):7.1f} bytes per screening  "
+                           f"built in {elapsed:6.2f} s  two weeks ({found} screenings) in {lookup:7.1f} ms")
+                del built
+                db.session.expunge_all()
+            db.engine.dispose()
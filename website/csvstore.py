@@ -0,0 +1,396 @@
+"""
+The purpose of csvstore.py is to write the csv files that mirror the database so that a crash never leaves a broken file.
+
+Every csv file is written through a CsvFile:
+    - A lock file next to it ('.booking.csv.lock') is locked with fcntl, so requests in other worker processes
+      (and other threads of this one) wait instead of writing rows into the middle of each other.
+      fcntl only exists on Unix; elsewhere only the threads of one process are kept apart.
+    - Every row ends with a 'checksum' column, a CRC32 of the other values, so a row that was only partly written is recognized.
+    - A file is replaced by writing a temporary file in the same directory, syncing it to disk and renaming it over the original,
+      which is atomic because it never crosses a filesystem.
+    - Appended rows are synced to disk (fsync) before the request continues, but requests that append at the same time
+      share one fsync, so a burst of bookings does not wait for the disk once per booking.
+At startup recover_csv_files() reads every file the website writes (WRITTEN_FILES) once: it removes the temporary files
+of interrupted replacements, moves torn rows and rows with a wrong checksum into '<file>.rejected', and adds checksums
+to files written before this module existed (a one-time format upgrade, reported apart from the repairs).
+After that insert_data() only ever sees complete rows. movie.csv and theater.csv are only read, so they are never rewritten
+and can stay plain csv files without checksums.
+"""
+# Import necessary modules for file I/O
+import csv
+import io
+import os
+import stat
+from tempfile import NamedTemporaryFile
+# Import the modules used for the checksums and the locks
+import threading
+import zlib
+from contextlib import contextmanager
+try:
+    import fcntl
+except ImportError:
+    # Windows has no fcntl, the locks then only work between the threads of one process
+    fcntl = None
+
+# The name of the column that holds the checksum of a row
+CHECKSUM_FIELD = 'checksum'
+
+# The csv files the website writes, the only ones that get checksums and are recovered at startup
+WRITTEN_FILES = ['booking', 'screening', 'user', 'booking_archive']
+
+
+def row_checksum(fieldnames, row):
+    """
+    Compute the checksum of a row, as it is written into the 'checksum' column.
+
+    Args:
+        fieldnames (list): The columns of the csv file, without the checksum column.
+        row (dict): The row, with values as written by the csv module.
+
+    Returns:
+        str: The CRC32 of the values as eight hexadecimal digits.
+    """
+    values = ['' if row.get(field) is None else str(row.get(field)) for field in fieldnames]
+    return format(zlib.crc32('\x1f'.join(values).encode()), '08x')
+
+
+def checked_row(header, fieldnames, values):
+    """
+    Turn the values of a csv record into a row, if the record is complete and its checksum is right.
+
+    Args:
+        header (list): The columns of the csv file, with the checksum column if the file has one.
+        fieldnames (list): The columns of the csv file, without the checksum column.
+        values (list): The values of the record.
+
+    Returns:
+        dict or None: The row without the checksum column, or None if the record is torn or fails its checksum.
+    """
+    if len(values) != len(header) or '\x00' in ''.join(values):
+        return None
+    row = dict(zip(header, values))
+    if header[-1] == CHECKSUM_FIELD and row.pop(CHECKSUM_FIELD) != row_checksum(fieldnames, row):
+        return None
+    return row
+
+
+class CsvFile:
+    """
+    A class that reads and writes one csv file with locking, checksums and atomic replacement.
+
+        Attributes:
+            path (str): The path of the csv file.
+            lock_path (str): The path of the lock file next to it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        folder, name = os.path.split(path)
+        self.lock_path = os.path.join(folder, f".{name}.lock")
+        self._thread_lock = threading.Lock()
+        # Appends are numbered, so one fsync can cover all appends made before it
+        self._sync_lock = threading.Lock()
+        self._appended = 0
+        self._synced = 0
+
+    @contextmanager
+    def lock(self):
+        """
+        Hold the lock of the file while the 'with' block runs, in this process and in every other process.
+        """
+        with self._thread_lock:
+            with open(self.lock_path, 'a') as lock_file:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if fcntl:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _parse(self):
+        """
+        Read the file and check every row. The caller holds the lock.
+
+        Returns:
+            Tuple: The columns without the checksum column (None if the file is empty or missing), the valid rows,
+                the rejected rows as lists of values, and why the file has to be written again to be clean:
+                'repair' if it has broken rows, 'upgrade' if it only has no checksums yet, None if it is clean.
+        """
+        if not os.path.exists(self.path):
+            return None, [], [], None
+        with open(self.path, 'r', newline='') as file:
+            text = file.read()
+        if not text:
+            return None, [], [], None
+        records = list(csv.reader(io.StringIO(text)))
+        header, records = records[0], records[1:]
+        has_checksum = header[-1] == CHECKSUM_FIELD
+        fieldnames = header[:-1] if has_checksum else header
+        # A file that does not end with a newline may have stopped in the middle of its last row;
+        # such a row is caught by its number of values or its checksum, but the file has to be written again before appending
+        torn_tail = not text.endswith('\n')
+        rows = []
+        rejected = []
+        for values in records:
+            row = checked_row(header, fieldnames, values)
+            if row is None:
+                rejected.append(values)
+            else:
+                rows.append(row)
+        if rejected or torn_tail:
+            return fieldnames, rows, rejected, 'repair'
+        return fieldnames, rows, rejected, None if has_checksum else 'upgrade'
+
+    def _appendable_header(self):
+        """
+        Check, without reading the whole file, that rows can be appended to it. The caller holds the lock.
+
+        Returns:
+            list or None: The columns without the checksum column if the file has checksums and ends with a complete row, otherwise None.
+        """
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            return None
+        with open(self.path, 'rb') as file:
+            header = next(csv.reader([file.readline().decode()]))
+            file.seek(-1, os.SEEK_END)
+            complete = file.read(1) == b'\n'
+        if not complete or header[-1] != CHECKSUM_FIELD:
+            return None
+        return header[:-1]
+
+    def _write(self, fieldnames, rows):
+        """
+        Replace the file with the given rows through a synced temporary file in the same directory. The caller holds the lock.
+
+        Args:
+            fieldnames (list): The columns of the csv file, without the checksum column.
+            rows (list): A list of dictionaries, one per row.
+
+        Returns:
+            None
+        """
+        folder, name = os.path.split(self.path)
+        # The temporary file is only readable by its owner, so it gets the permissions of the file it replaces
+        try:
+            mode = stat.S_IMODE(os.stat(self.path).st_mode)
+        except FileNotFoundError:
+            mode = 0o644
+        with NamedTemporaryFile(mode='w', newline='', dir=folder, prefix=f".{name}.", suffix='.tmp', delete=False) as temporary:
+            writer = csv.DictWriter(temporary, fieldnames=list(fieldnames) + [CHECKSUM_FIELD], extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows({**row, CHECKSUM_FIELD: row_checksum(fieldnames, row)} for row in rows)
+            temporary.flush()
+            os.fsync(temporary.fileno())
+        os.chmod(temporary.name, mode)
+        os.replace(temporary.name, self.path)
+        sync_folder(folder)
+
+    def read(self):
+        """
+        Read the valid rows of the file. Rows that fail their checksum are left out.
+
+        Returns:
+            Tuple: The columns without the checksum column (None if the file is empty or missing), and the rows as dictionaries.
+        """
+        with self.lock():
+            fieldnames, rows, _, _ = self._parse()
+        return fieldnames, rows
+
+    def stream(self):
+        """
+        Read the valid rows of the file one at a time, so the whole file is never held in memory.
+        Rows that fail their checksum are left out. The lock is held until every row was read.
+
+        Returns:
+            generator: The rows as dictionaries, without the checksum column.
+        """
+        with self.lock():
+            if not os.path.exists(self.path):
+                return
+            with open(self.path, 'r', newline='') as file:
+                reader = csv.reader(file)
+                header = next(reader, None)
+                if header is None:
+                    return
+                fieldnames = header[:-1] if header[-1] == CHECKSUM_FIELD else header
+                for values in reader:
+                    row = checked_row(header, fieldnames, values)
+                    if row is not None:
+                        yield row
+
+    def rewrite(self, fieldnames, rows):
+        """
+        Replace the file with the given rows.
+
+        Args:
+            fieldnames (list): The columns of the csv file.
+            rows (list): A list of dictionaries, one per row.
+
+        Returns:
+            None
+        """
+        with self.lock():
+            self._write(fieldnames, rows)
+
+    def update(self, change):
+        """
+        Read the rows, change them and replace the file, holding the lock the whole time so no other write is lost in between.
+
+        Args:
+            change (function): A function that takes the list of rows and returns the new list of rows.
+
+        Returns:
+            None
+        """
+        with self.lock():
+            fieldnames, rows, rejected, _ = self._parse()
+            if fieldnames is None:
+                return
+            self._reject(rejected)
+            self._write(fieldnames, change(rows))
+
+    def append(self, fieldnames, rows):
+        """
+        Append rows to the file and return once they are on disk.
+
+        Args:
+            fieldnames (list): The columns of the csv file, used if the file is new.
+            rows (list): A list of dictionaries, one per row.
+
+        Returns:
+            None
+        """
+        if not rows:
+            return
+        with self.lock():
+            existing = self._appendable_header()
+            if existing is None:
+                # A new file, or one with a torn last row or without checksums, is written whole (and synced) instead
+                header, old_rows, rejected, _ = self._parse()
+                self._reject(rejected)
+                self._write(header or fieldnames, old_rows + list(rows))
+                return
+            with open(self.path, 'a', newline='') as file:
+                writer = csv.DictWriter(file, fieldnames=existing + [CHECKSUM_FIELD], extrasaction='ignore')
+                writer.writerows({**row, CHECKSUM_FIELD: row_checksum(existing, row)} for row in rows)
+            self._appended += 1
+            ticket = self._appended
+        self._sync(ticket)
+
+    def _sync(self, ticket):
+        """
+        Make sure the append with the given number is on disk, sharing the fsync with the appends made at the same time.
+
+        Args:
+            ticket (int): The number of the append.
+
+        Returns:
+            None
+        """
+        with self._sync_lock:
+            # Another thread's fsync may already have covered this append while this one waited for the lock
+            if self._synced >= ticket:
+                return
+            target = self._appended
+            with open(self.path, 'a') as file:
+                os.fsync(file.fileno())
+            self._synced = target
+
+    def _reject(self, rejected):
+        """
+        Keep the rejected rows in '<file>.rejected', so they can be looked at later. The caller holds the lock.
+
+        Args:
+            rejected (list): The rejected rows as lists of values.
+
+        Returns:
+            None
+        """
+        if rejected:
+            with open(self.path + '.rejected', 'a', newline='') as file:
+                csv.writer(file).writerows(rejected)
+
+    def recover(self):
+        """
+        Bring the file into a clean state after a crash.
+
+        Returns:
+            Tuple: 'repair' or 'upgrade' if the file had to be written again (see _parse()), otherwise None,
+                and the number of rows moved into '<file>.rejected'.
+        """
+        folder, name = os.path.split(self.path)
+        with self.lock():
+            # Temporary files of a replacement that was interrupted; a replacement in progress would hold the lock
+            for leftover in os.listdir(folder):
+                if leftover.startswith(f".{name}.") and leftover.endswith('.tmp'):
+                    os.remove(os.path.join(folder, leftover))
+            fieldnames, rows, rejected, reason = self._parse()
+            if fieldnames is None or reason is None:
+                return None, 0
+            self._reject(rejected)
+            self._write(fieldnames, rows)
+            return reason, len(rejected)
+
+
+def sync_folder(folder):
+    """
+    Sync a directory to disk, so a rename in it survives a power loss. Not possible (and not needed) on Windows.
+
+    Args:
+        folder (str): The path of the directory.
+
+    Returns:
+        None
+    """
+    if not hasattr(os, 'O_DIRECTORY'):
+        return
+    descriptor = os.open(folder, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+
+# One CsvFile per path in this process, so all threads share its lock and fsync batching
+_csv_files = {}
+_csv_files_lock = threading.Lock()
+
+
+def csv_file(path):
+    """
+    Return the CsvFile of a path, creating it on first use.
+
+    Args:
+        path (str): The path of the csv file.
+
+    Returns:
+        CsvFile: The csv file.
+    """
+    path = os.path.abspath(path)
+    with _csv_files_lock:
+        if path not in _csv_files:
+            _csv_files[path] = CsvFile(path)
+        return _csv_files[path]
+
+
+def recover_csv_files(paths):
+    """
+    Check every csv file the website writes at startup and repair the ones a crash left behind.
+
+    Args:
+        paths (dict): A dictionary containing the absolute paths of the csv files.
+
+    Returns:
+        Tuple: A dictionary with the name of every repaired file as key and the number of rows moved into '<file>.rejected'
+            as value, and the list of names of the files that only got their checksums added.
+    """
+    repaired = {}
+    upgraded = []
+    for name in WRITTEN_FILES:
+        reason, rejected = csv_file(paths[name]).recover()
+        if reason == 'repair':
+            repaired[name] = rejected
+        elif reason == 'upgrade':
+            upgraded.append(name)
+    return repaired, upgraded
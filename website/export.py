@@ -0,0 +1,219 @@
+"""
+The purpose of export.py is to export the booking history for analytics.
+
+booking.csv is row oriented text, so scanning months of sales means re-parsing every row.
+This module streams the Booking, Screening, Theater, Movie and User join out of the database in chunks,
+merged with the archived bookings of past screenings (see archive.py), and writes it to compressed,
+typed Parquet files partitioned by the date of the sale:
+
+    <output_dir>/sale_date=2023-03-28/part-0.parquet
+    <output_dir>/sale_date=2023-03-29/part-0.parquet
+
+The rows are read in sale order, so only one partition file is open at a time and only one chunk is held in memory,
+which keeps the export in bounded memory on very large tables. An archived booking keeps the names of its theater and movie
+but not their IDs, so its theater_id and movie_id are empty.
+
+pyarrow is only needed for this export, so it is imported when the export runs rather than when the website starts.
+"""
+# Import the 'db' object located in __init__.py from the current package (website) for database operations
+from . import db
+# Imports the models from the current package, which define the database tables and their relationships
+from .models import Booking, Screening, Theater, Movie, User, ArchivedBooking
+# Import the router, so the export also reads screenings split across shard files
+from .sharding import data_sessions
+# Import click to define the command line interface of the export
+import click
+# Import with_appcontext so the command runs inside the Flask application context
+from flask.cli import with_appcontext
+# Import necessary modules to build file paths
+import os
+# Import heapq to merge the ordered rows of several shard files
+import heapq
+
+# Columns of the exported files, in order, with the pyarrow type name of each column
+EXPORT_COLUMNS = [
+    ('booking_id', 'int64'),
+    ('user_id', 'int64'),
+    ('customer_name', 'string'),
+    ('number_of_tickets', 'int32'),
+    ('screening_id', 'int64'),
+    ('screening_date', 'date32'),
+    ('screening_time', 'time32'),
+    ('theater_id', 'int64'),
+    ('theater_name', 'string'),
+    ('movie_id', 'int64'),
+    ('movie_title', 'string'),
+    ('ticket_price', 'float64'),
+    ('total_price', 'float64'),
+    ('timestamp', 'timestamp'),
+]
+
+
+def export_schema(pa):
+    """
+    Build the pyarrow schema of the exported files.
+
+    Args:
+        pa (module): The imported pyarrow module.
+
+    Returns:
+        pyarrow.Schema: The typed schema of the export.
+    """
+    types = {
+        'int32': pa.int32(),
+        'int64': pa.int64(),
+        'float64': pa.float64(),
+        'string': pa.string(),
+        'date32': pa.date32(),
+        'time32': pa.time32('s'),
+        'timestamp': pa.timestamp('s'),
+    }
+    return pa.schema([(name, types[type_name]) for name, type_name in EXPORT_COLUMNS])
+
+
+def booking_rows(chunk_size):
+    """
+    Stream the denormalized booking history out of the database, ordered by the time of the sale.
+
+    Only plain columns are selected (no ORM objects), and rows are fetched 'chunk_size' at a time.
+
+    Args:
+        chunk_size (int): The number of rows fetched from the database at a time.
+
+    Returns:
+        generator: Tuples of column values in the order of EXPORT_COLUMNS.
+    """
+    # Every database file (one per shard when sharding is enabled) and the archive return their rows in sale order,
+    # and the ordered streams are merged into one
+    streams = [sale_ordered_rows(session, chunk_size) for session in data_sessions()]
+    streams.append(archived_sale_ordered_rows(chunk_size))
+    for (booking_id, user_id, customer_name, tickets, screening_id, date, time,
+         theater_id, theater_name, movie_id, title, price, timestamp) in heapq.merge(*streams, key=lambda row: (row[-1], row[0])):
+        price = float(price) if price is not None else None
+        total = price * tickets if price is not None else None
+        yield (booking_id, user_id, customer_name, tickets, screening_id, date, time,
+               theater_id, theater_name, movie_id, title, price, total, timestamp)
+
+
+def sale_ordered_rows(session, chunk_size):
+    """
+    Stream the booking history of one database file, ordered by the time of the sale.
+
+    Args:
+        session (Session): The session of the database file.
+        chunk_size (int): The number of rows fetched from the database at a time.
+
+    Returns:
+        Query: An iterable query of plain column tuples.
+    """
+    return (session.query(Booking.id, Booking.user_id,
+                          # The customer name comes from the user table (every shard has a copy of it)
+                          User.first_name + " " + User.last_name,
+                          Booking.number_of_tickets,
+                          Screening.id, Screening.date, Screening.time,
+                          Theater.id, Theater.name,
+                          Movie.id, Movie.title, db.func.coalesce(Booking.price, Movie.price),
+                          Booking.timestamp)
+            # Booking is the table on the left
+            .join(Screening, Booking.screenings)
+            .join(Theater)
+            .join(Movie)
+            # A booking whose user no longer exists is still exported, without a customer name
+            .outerjoin(User, User.id == Booking.user_id)
+            .order_by(Booking.timestamp, Booking.id)
+            .execution_options(yield_per=chunk_size))
+
+
+def archived_sale_ordered_rows(chunk_size):
+    """
+    Stream the archived booking history, ordered by the time of the sale, in the same columns as sale_ordered_rows().
+
+    Args:
+        chunk_size (int): The number of rows fetched from the database at a time.
+
+    Returns:
+        Query: An iterable query of plain column tuples, without theater and movie IDs.
+    """
+    return (db.session.query(ArchivedBooking.id, ArchivedBooking.user_id,
+                             User.first_name + " " + User.last_name,
+                             ArchivedBooking.number_of_tickets,
+                             ArchivedBooking.screening_id, ArchivedBooking.date, ArchivedBooking.time,
+                             db.null(), ArchivedBooking.theater_name,
+                             db.null(), ArchivedBooking.movie_title, ArchivedBooking.price,
+                             ArchivedBooking.timestamp)
+            .outerjoin(User, User.id == ArchivedBooking.user_id)
+            .order_by(ArchivedBooking.timestamp, ArchivedBooking.id)
+            .execution_options(yield_per=chunk_size))
+
+
+def export_bookings(output_dir, chunk_size=10000, compression='zstd'):
+    """
+    Export the booking history into Parquet files partitioned by sale date.
+
+    Args:
+        output_dir (str): The directory the partitions are written into.
+        chunk_size (int): The maximum number of rows held in memory and written as one row group.
+        compression (str): The Parquet compression codec.
+
+    Returns:
+        dict: A dictionary with sale date as key and the number of exported rows as value.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise click.ClickException("The booking export needs pyarrow. Install it with 'pip install pyarrow'.")
+
+    schema = export_schema(pa)
+    names = [name for name, _ in EXPORT_COLUMNS]
+    counts = {}
+    # The partition currently being written, its writer and the rows of the current chunk (one list per column)
+    current_date = None
+    writer = None
+    columns = [[] for _ in names]
+
+    def flush():
+        # Write the buffered rows as one row group and empty the buffer
+        if columns[0]:
+            writer.write_table(pa.Table.from_arrays([pa.array(values, type=field.type) for values, field in zip(columns, schema)], schema=schema))
+            for values in columns:
+                values.clear()
+
+    try:
+        for row in booking_rows(chunk_size):
+            sale_date = row[-1].date()
+            # Rows come in sale order, so a new date means the previous partition is complete
+            if sale_date != current_date:
+                if writer is not None:
+                    flush()
+                    writer.close()
+                current_date = sale_date
+                partition = os.path.join(output_dir, f"sale_date={sale_date.isoformat()}")
+                os.makedirs(partition, exist_ok=True)
+                writer = pq.ParquetWriter(os.path.join(partition, "part-0.parquet"), schema, compression=compression)
+                counts[sale_date] = 0
+            for values, value in zip(columns, row):
+                values.append(value)
+            counts[sale_date] += 1
+            # Keep memory bounded by writing a row group whenever the chunk is full
+            if len(columns[0]) >= chunk_size:
+                flush()
+        if writer is not None:
+            flush()
+    finally:
+        if writer is not None:
+            writer.close()
+    return counts
+
+
+@click.command('export-bookings')
+@click.argument('output_dir', type=click.Path(file_okay=False))
+@click.option('--chunk-size', default=10000, show_default=True, help='Rows held in memory and written per row group.')
+@click.option('--compression', default='zstd', show_default=True, help='Parquet compression codec.')
+@with_appcontext
+def export_bookings_command(output_dir, chunk_size, compression):
+    """
+    Export the booking history into Parquet files partitioned by sale date.
+    """
+    counts = export_bookings(output_dir, chunk_size=chunk_size, compression=compression)
+    click.echo(f"Exported {sum(counts.values())} bookings into {len(counts)} partitions in {output_dir}")
@@ -0,0 +1,107 @@
+"""
+The purpose of groupcommit.py is to commit bursts of bookings together (group commit).
+
+Every commit of SQLite waits for the disk (fsync), so booking one request at a time caps the bookings per second
+at the number of commits the disk can do. When the GROUP_COMMIT setting is True, the ticket page does not book itself:
+it hands its Reservation to one background batcher thread and waits for the result.
+The batcher collects the reservations that arrive within GROUP_COMMIT_WINDOW_MS milliseconds
+(at most GROUP_COMMIT_MAX_BATCH of them), books them with reserve_batch() in one transaction,
+and gives every waiting request its own result. A burst of bookings then costs one commit per batch instead of one per booking.
+"""
+# Import the booking transaction shared with the normal (one by one) booking path
+from .reservations import reserve_batch
+# Import the modules used to run the batcher thread and hand results back to the waiting requests
+from concurrent.futures import Future
+import queue
+import threading
+import time
+
+
+class BookingBatcher:
+    """
+    A class that collects reservations from many request threads and books them in micro-batches.
+
+        Attributes:
+            app (Flask): The Flask application, whose context the batcher thread runs in.
+            window (float): How long (in seconds) a batch waits for more reservations after the first one arrived.
+            max_batch (int): The largest number of reservations booked in one transaction.
+    """
+
+    def __init__(self, app, window_ms, max_batch):
+        self.app = app
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, reservation):
+        """
+        Queue a reservation for the next batch.
+
+        Args:
+            reservation (Reservation): The reservation to book.
+
+        Returns:
+            Future: A future that is resolved with the processed reservation.
+        """
+        self._start()
+        future = Future()
+        self._queue.put((reservation, future))
+        return future
+
+    def _start(self):
+        # Start the batcher thread on the first submission
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='booking-batcher', daemon=True)
+                self._thread.start()
+
+    def _collect(self):
+        # Wait for the first reservation, then keep collecting until the window closes or the batch is full
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        from . import get_csv_paths, db
+        with self.app.app_context():
+            paths = get_csv_paths()
+        while True:
+            batch = self._collect()
+            reservations = [reservation for reservation, _ in batch]
+            # Every batch runs in its own application context, so it gets fresh sessions
+            with self.app.app_context():
+                try:
+                    reserve_batch(reservations, paths)
+                except Exception as error:
+                    db.session.rollback()
+                    for _, future in batch:
+                        future.set_exception(error)
+                    continue
+            for reservation, future in batch:
+                future.set_result(reservation)
+
+
+def booking_batcher(app):
+    """
+    Return the booking batcher of the application, creating it on first use.
+
+    Args:
+        app (Flask): Flask application object
+
+    Returns:
+        BookingBatcher: The batcher of the application.
+    """
+    if 'booking_batcher' not in app.extensions:
+        # setdefault keeps the first batcher if two requests create one at the same time
+        app.extensions.setdefault('booking_batcher', BookingBatcher(app, app.config['GROUP_COMMIT_WINDOW_MS'], app.config['GROUP_COMMIT_MAX_BATCH']))
+    return app.extensions['booking_batcher']
@@ -0,0 +1,126 @@
+"""
+The purpose of idempotency.py is to make ticket submissions safe to retry.
+
+The ticket form carries a random idempotency key. The first submission with a key claims it in the BookingRequest table,
+and any repeat of the same key (a double-click or a client retry) is answered from the stored row instead of running
+the booking transaction again: the booking of the first submission once its booking ID is stored, or a "still processing"
+message while the first submission is still booking. A submission that fails releases its key, so a retry books again.
+Keys are evicted after a time to live (TTL) so the dedup table stays small.
+
+Every function takes the session of the database file that stores the booked screening, so in sharded mode a key lives
+in the same shard file as its booking and a booking never writes to the main database.
+"""
+# Import the 'db' object located in __init__.py from the current package (website) for database operations
+from . import db
+# Imports the model from the current package used as the dedup table
+from .models import BookingRequest
+# Import the error raised when a primary key is inserted twice
+from sqlalchemy.exc import IntegrityError
+# Import current_app to read the configured TTL
+from flask import current_app
+# Import necessary modules to work with dates and times.
+from datetime import datetime, timedelta
+# Import necessary module to create random keys
+import uuid
+
+
+def new_idempotency_key():
+    """
+    Create a new random idempotency key for a ticket form.
+
+    Returns:
+        str: A random hexadecimal key.
+    """
+    return uuid.uuid4().hex
+
+
+def evict_expired_keys(session):
+    """
+    Delete the idempotency keys of a database file that are older than the configured TTL.
+
+    The delete runs at most once per TTL/10 seconds per application and database file, so most bookings do not pay for it.
+
+    Args:
+        session (Session): The session of the database file that stores the keys.
+
+    Returns:
+        None
+    """
+    app = current_app._get_current_object()
+    # Read the TTL (in seconds) from the application configuration
+    ttl = timedelta(seconds=app.config.get('IDEMPOTENCY_KEY_TTL', 3600))
+    now = datetime.now()
+    # Skip the delete if it already ran recently; every application remembers the last eviction of each of its database files
+    last_evictions = app.extensions.setdefault('idempotency_last_eviction', {})
+    database = str(session.get_bind().url)
+    if now - last_evictions.get(database, datetime.min) < ttl / 10:
+        return
+    last_evictions[database] = now
+    # Delete every key created before the TTL window in one range delete using the index on 'created'
+    session.query(BookingRequest).filter(BookingRequest.created < now - ttl).delete()
+    session.commit()
+
+
+def claim_idempotency_key(key, user_id, session=None):
+    """
+    Claim an idempotency key for the current submission.
+
+    Args:
+        key (str): The idempotency key sent with the ticket form.
+        user_id (int): The ID of the user who submitted the form.
+        session (Session or None): The session of the database file that stores the booked screening, 'db.session' by default.
+
+    Returns:
+        BookingRequest or None: The new BookingRequest if this is the first submission with the key,
+            or None if the key was already claimed by an earlier submission.
+    """
+    session = session or db.session
+    evict_expired_keys(session)
+    booking_request = BookingRequest(key=key, user_id=user_id, created=datetime.now())
+    session.add(booking_request)
+    try:
+        # The primary key makes the insert fail if another submission already claimed the key
+        session.commit()
+    except IntegrityError:
+        session.rollback()
+        return None
+    return booking_request
+
+
+def find_idempotency_key(key, user_id, session=None):
+    """
+    Look up the stored result of the submission that claimed an idempotency key.
+
+    Args:
+        key (str): The idempotency key sent with the ticket form.
+        user_id (int): The ID of the user who submitted the form; another user's key is never shown.
+        session (Session or None): The session of the database file that stores the booked screening, 'db.session' by default.
+
+    Returns:
+        BookingRequest or None: The BookingRequest of the key, its booking_id is None while the booking is still being processed.
+            None if the key is not claimed (anymore) or was claimed by another user.
+    """
+    session = session or db.session
+    return session.query(BookingRequest).filter(BookingRequest.key == key, BookingRequest.user_id == user_id).first()
+
+
+def release_idempotency_key(booking_request, session=None):
+    """
+    Release a claimed key when the submission did not create a booking, so a retry is evaluated again.
+
+    The key is kept if a booking was stored for it, so a failure after the booking was committed cannot lead to a second booking.
+
+    Args:
+        booking_request (BookingRequest): The BookingRequest returned by claim_idempotency_key().
+        session (Session or None): The session the key was claimed in, 'db.session' by default.
+
+    Returns:
+        None
+    """
+    session = session or db.session
+    # Drop whatever the failed submission left in the session first
+    session.rollback()
+    (session.query(BookingRequest)
+     .filter(BookingRequest.key == booking_request.key, BookingRequest.booking_id.is_(None))
+     .delete(synchronize_session=False))
+    session.commit()
@@ -0,0 +1,100 @@
+"""
+The purpose of listings.py is to check and repair the screening_listing read model.
+
+The ScreeningListing table holds one row per screening with the theater and movie details copied in,
+and the triggers defined in models.py keep it in sync. 'flask check-listings' compares it with the join of the
+normalized Screening, Theater and Movie tables in every database file, and '--repair' builds it again from that join.
+"""
+# Import the 'db' object located in __init__.py from the current package (website) for database operations
+from . import db
+# Imports the models from the current package, which define the database tables and their relationships
+from .models import Screening, Theater, Movie, ScreeningListing
+# Import the router, so the check also covers screenings split across shard files
+from .sharding import data_sessions
+# Import click and with_appcontext to define the command line interface
+import click
+from flask.cli import with_appcontext
+
+# The listing columns, in the order both sides of the comparison return them
+LISTING_COLUMNS = ['date', 'time', 'available_seats', 'theater_id', 'theater_name', 'movie_id', 'movie_title', 'price']
+
+# The INSERT that builds the whole listing from the normalized tables
+# The price is the screening's price, or the movie's price in a database upgraded from before the screenings had prices
+REBUILD_SQL = """
+    INSERT INTO screening_listing (screening_id, date, time, available_seats, theater_id, theater_name, movie_id, movie_title, price)
+    SELECT screening.id, screening.date, screening.time, screening.available_seats, screening.theater_id, theater.name,
+           screening.movie_id, movie.title, {price}
+    FROM screening JOIN theater ON theater.id = screening.theater_id JOIN movie ON movie.id = screening.movie_id
+"""
+
+
+def rebuild_listing(connection):
+    """
+    Fill the screening_listing table again from the Screening, Theater and Movie tables.
+
+    Args:
+        connection (Connection or Session): The connection or session of the database file.
+
+    Returns:
+        None
+    """
+    # Migration 3 builds the listing before migration 5 adds the screening prices
+    screening_columns = {name for (name,) in connection.execute(db.text("SELECT name FROM pragma_table_info('screening')"))}
+    price = 'COALESCE(screening.price, movie.price)' if 'price' in screening_columns else 'movie.price'
+    connection.execute(db.text("DELETE FROM screening_listing"))
+    connection.execute(db.text(REBUILD_SQL.format(price=price)))
+
+
+def listing_differences(session):
+    """
+    Compare the screening_listing table of a database file with the normalized tables.
+
+    Args:
+        session (Session): The session of the database file.
+
+    Returns:
+        list: (screening ID, problem) pairs, empty if the listing is consistent.
+    """
+    expected = {row[0]: tuple(row[1:]) for row in
+                session.query(Screening.id, Screening.date, Screening.time, Screening.available_seats,
+                              Theater.id, Theater.name, Movie.id, Movie.title, db.func.coalesce(Screening.price, Movie.price))
+                .join(Theater, Theater.id == Screening.theater_id)
+                .join(Movie, Movie.id == Screening.movie_id)}
+    actual = {row[0]: tuple(row[1:]) for row in
+              session.query(ScreeningListing.screening_id, *[getattr(ScreeningListing, column) for column in LISTING_COLUMNS])}
+    differences = []
+    for screening_id in sorted(expected.keys() | actual.keys()):
+        if screening_id not in actual:
+            differences.append((screening_id, "missing from the listing"))
+        elif screening_id not in expected:
+            differences.append((screening_id, "listed but not a screening"))
+        else:
+            changed = [column for column, want, have in zip(LISTING_COLUMNS, expected[screening_id], actual[screening_id]) if want != have]
+            if changed:
+                differences.append((screening_id, "different " + ", ".join(changed)))
+    return differences
+
+
+@click.command('check-listings')
+@click.option('--repair', is_flag=True, help='Rebuild the listing from the normalized tables if it is not consistent.')
+@with_appcontext
+def check_listings_command(repair):
+    """
+    Check that the screening_listing read model matches the screening, theater and movie tables.
+    """
+    inconsistent = False
+    for index, session in enumerate(data_sessions()):
+        differences = listing_differences(session)
+        if not differences:
+            continue
+        inconsistent = True
+        click.echo(f"Database file {index}: {len(differences)} screenings differ, for example:")
+        for screening_id, problem in differences[:10]:
+            click.echo(f"  screening {screening_id}: {problem}")
+        if repair:
+            rebuild_listing(session)
+            session.commit()
+            click.echo(f"Database file {index}: listing rebuilt.")
+    if inconsistent and not repair:
+        raise click.ClickException("The screening listing is not consistent; run 'flask check-listings --repair'.")
+    click.echo("The screening listing is consistent." if not inconsistent else "The screening listing was repaired.")
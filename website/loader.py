@@ -0,0 +1,746 @@
+"""
+The purpose of loader.py is to load the csv files into the database when the application starts.
+
+The load is described as a small dependency graph of steps. Every step that reads a csv file has a parser,
+and all parsers run at the same time in a worker pool. They hand their rows over in batches through one queue
+to a single writer (the thread that starts the application), which inserts a step's batches as soon as
+the steps it depends on are in the database. For example users do not wait for screenings,
+and bookings only wait for the screenings they point at.
+The whole load is written in one transaction, and the time every step took is reported at the end.
+"""
+# Import the 'db' object located in __init__.py from the current package (website) for database operations
+from . import db, get_csv_paths
+# Import classes that are used in the function.
+from .models import Movie, Theater, Screening, User, Booking, ScreeningDate, screening_booking, theater_movie
+from .archive import archived_booking, reserve_booking_ids
+# Import the router, so the screenings kept in shard files are taken into account when new ones are scheduled
+from .sharding import data_sessions
+# Import the csv persistence layer, which only returns complete rows with a valid checksum
+from .csvstore import csv_file
+# Import the rebuild of the screening listing, needed when the screenings of an old file are numbered again
+from .listings import rebuild_listing
+# Import current_app to read the settings and store the timings
+from flask import current_app
+# Import the bulk insert statement
+from sqlalchemy import insert
+# Import the worker pool and the queue that connects the parsers with the writer
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue, Empty, Full
+import threading
+# Import necessary modules for file I/O
+import os
+from itertools import islice
+# Import necessary modules to work with dates and times.
+from datetime import datetime, timedelta
+import time as clock
+
+
+class LoadStep:
+    """
+    A class that represents one step of the startup load.
+
+        Attributes:
+            name (str): The name of the step, used for dependencies and in the timing report.
+            parse (function or None): A function that takes the csv paths and yields batches of parsed rows, or None if the step reads no file.
+            insert (function or None): A function that takes the shared state and one batch and inserts the batch.
+            finish (function or None): A function that takes the shared state and runs once after every batch was inserted,
+                returning the number of rows it created, or None.
+            depends_on (list): The names of the steps that must be in the database before this step inserts anything.
+    """
+
+    def __init__(self, name, parse=None, insert=None, finish=None, depends_on=()):
+        """
+        Create a load step.
+
+        Args:
+            name (str): The name of the step.
+            parse (function or None): The parser of the step.
+            insert (function or None): The insert function of the step.
+            finish (function or None): The function that completes the step.
+            depends_on (list): The names of the steps this step depends on.
+        """
+        self.name = name
+        self.parse = parse
+        self.insert = insert
+        self.finish = finish
+        self.depends_on = list(depends_on)
+
+
+def batches(rows, size):
+    """
+    Split an iterable of rows into lists of at most 'size' rows.
+
+    Args:
+        rows (iterable): The rows to split.
+        size (int): The largest number of rows in a batch.
+
+    Returns:
+        generator: Lists of rows.
+    """
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def read_rows(path):
+    """
+    Read the rows of a csv file in batches, handing every batch on while the rest of the file is still being read.
+
+    Args:
+        path (str): The path of the csv file.
+
+    Returns:
+        generator: Lists of rows, each row is a dictionary.
+    """
+    size = current_app.config.get('STARTUP_BATCH_SIZE', 5000)
+    # The reader streams the file, so only one batch of a large file is held in memory
+    yield from batches(csv_file(path).stream(), size)
+
+
+def parse_users(paths):
+    """
+    Parse user.csv into rows of the User table.
+
+    Args:
+        paths (dict): A dictionary containing the absolute paths of the csv files.
+
+    Returns:
+        generator: Batches of dictionaries with the columns of the User table.
+    """
+    for batch in read_rows(paths['user']):
+        yield [{'email': row['email'], 'password': row['password'], 'first_name': row['first_name'], 'last_name': row['last_name']} for row in batch]
+
+
+def parse_movies(paths):
+    """
+    Parse movie.csv into rows of the Movie table, each with the list of show times of the movie as time objects.
+
+    Args:
+        paths (dict): A dictionary containing the absolute paths of the csv files.
+
+    Returns:
+        generator: Batches of (row, show times) pairs.
+    """
+    for batch in read_rows(paths['movie']):
+        # Convert the price string to a float (it has cents) and the release date string to a datetime object.
+        yield [({'title': row['title'], 'price': float(row['price']) if row['price'] else None,
+                 'release_date': datetime.strptime(row['release_date'], '%Y-%m-%d').date()},
+                [datetime.strptime(time, '%H:%M').time() for time in row['show_times'].split(", ")]) for row in batch]
+
+
+def parse_theaters(paths):
+    """
+    Parse theater.csv into rows of the Theater table, each with the titles of the movies the theater shows.
+
+    Args:
+        paths (dict): A dictionary containing the absolute paths of the csv files.
+
+    Returns:
+        generator: Batches of (row, movie titles) pairs.
+    """
+    for batch in read_rows(paths['theater']):
+        # The titles are split once here; from then on the lineup is kept as ids in the theater_movie table
+        yield [({'name': row['theater_name'], 'number_of_seats': row['number_of_seats']},
+                row['available_movies'].split(", ")) for row in batch]
+
+
+def parse_screenings(paths):
+    """
+    Parse screening.csv into rows of the Screening table.
+
+    The rows keep the ids of the file. Older versions could write duplicate ids into the file;
+    insert_screenings() and finish_screenings() repair them once the whole file was parsed.
+
+    Args:
+        paths (dict): A dictionary containing the absolute paths of the csv files.
+
+    Returns:
+        generator: Batches of dictionaries with the columns of the Screening table.
+    """
+    for batch in read_rows(paths['screening']):
+        # Convert date and time strings to datetime objects for storing in the Screening table.
+        # The id is kept from the file, so bookings keep pointing at the right screening even after old rows are archived.
+        yield [{'id': int(row['id']),
+                'date': datetime.strptime(row['date'], '%Y-%m-%d').date(),
+                'time': datetime.strptime(row['time'], '%H:%M:%S').time(),
+                'available_seats': int(row['available_seats']),
+                'theater_id': int(row['theater_id']),
+                'movie_id': int(row['movie_id'])} for row in batch]
+
+
+def parse_bookings(paths):
+    """
+    Parse booking.csv into rows of the Booking table, each with the ID of the booked screening.
+
+    Args:
+        paths (dict): A dictionary containing the absolute paths of the csv files.
+
+    Returns:
+        generator: Batches of (row, screening ID) pairs.
+    """
+    for batch in read_rows(paths['booking']):
+        # Keep the transaction ID from the file, so it stays the same across restarts and archiving
+        yield [({'id': int(row['transaction_id']),
+                 'number_of_tickets': int(row['number_of_tickets']),
+                 'timestamp': datetime.strptime(row['timestamp'], '%Y-%m-%d %H:%M:%S'),
+                 'user_id': int(row['user_id'])},
+                int(row['screening_id'])) for row in batch]
+
+
+def parse_archived_bookings(paths):
+    """
+    Parse booking_archive.csv into ArchivedBooking objects.
+
+    Args:
+        paths (dict): A dictionary containing the absolute paths of the csv files.
+
+    Returns:
+        generator: Batches of ArchivedBooking objects, nothing if no booking was archived yet.
+    """
+    if not os.path.exists(paths['booking_archive']):
+        return
+    for batch in read_rows(paths['booking_archive']):
+        yield [archived_booking(row) for row in batch]
+
+
+def insert_users(state, batch):
+    """
+    Insert a batch of users.
+
+    Args:
+        state (dict): The state shared by the load steps.
+        batch (list): Rows of the User table.
+
+    Returns:
+        None
+    """
+    db.session.execute(insert(User), batch)
+
+
+def insert_movies(state, batch):
+    """
+    Insert a batch of movies and remember their show times.
+
+    Args:
+        state (dict): The state shared by the load steps.
+        batch (list): (row, show times) pairs.
+
+    Returns:
+        None
+    """
+    db.session.execute(insert(Movie), [row for row, _ in batch])
+    # Store the show times by title until the lineup step knows the ids of the movies
+    state['show_times_by_title'].update({row['title']: show_times for row, show_times in batch})
+
+
+def insert_theaters(state, batch):
+    """
+    Insert a batch of theaters and remember the titles of their movies.
+
+    Args:
+        state (dict): The state shared by the load steps.
+        batch (list): (row, movie titles) pairs.
+
+    Returns:
+        None
+    """
+    db.session.execute(insert(Theater), [row for row, _ in batch])
+    # Store the movie titles by theater name until the lineup step knows the ids
+    state['movie_titles'].update({row['name']: titles for row, titles in batch})
+
+
+def insert_screenings(state, batch):
+    """
+    Insert a batch of screenings and remember their ids and dates.
+
+    Older versions renumbered the screenings on every load and could write duplicate ids into the file.
+    Once an id repeats, the rest of the screenings get a temporary negative id from their position in the file,
+    and finish_screenings() numbers every screening by its position.
+
+    Args:
+        state (dict): The state shared by the load steps.
+        batch (list): Rows of the Screening table.
+
+    Returns:
+        None
+    """
+    for row in batch:
+        state['screening_count'] += 1
+        if not state['renumber_screenings'] and row['id'] in state['screening_ids']:
+            state['renumber_screenings'] = True
+        if state['renumber_screenings']:
+            row['id'] = -state['screening_count']
+        else:
+            state['screening_ids'].add(row['id'])
+            state['screening_file_ids'].append(row['id'])
+    db.session.execute(insert(Screening), batch)
+    state['existing_dates'].update(row['date'] for row in batch)
+
+
+def insert_bookings(state, batch):
+    """
+    Insert a batch of bookings and link them to their screenings.
+
+    Bookings of screenings that are not in the database are skipped.
+
+    Args:
+        state (dict): The state shared by the load steps.
+        batch (list): (row, screening ID) pairs.
+
+    Returns:
+        None
+    """
+    batch = [(row, screening_id) for row, screening_id in batch if screening_id in state['screening_ids']]
+    if not batch:
+        return
+    db.session.execute(insert(Booking), [row for row, _ in batch])
+    # Create the relationship between the Screening and Booking tables (Booking and Screening has many-to-many relationship)
+    db.session.execute(insert(screening_booking), [{'screening_id': screening_id, 'booking_id': row['id']} for row, screening_id in batch])
+
+
+def insert_archived_bookings(state, batch):
+    """
+    Insert a batch of archived bookings.
+
+    Args:
+        state (dict): The state shared by the load steps.
+        batch (list): ArchivedBooking objects.
+
+    Returns:
+        None
+    """
+    db.session.add_all(batch)
+
+
+def finish_screenings(state):
+    """
+    Number the screenings by their position in screening.csv if the file had duplicate ids, and write the new ids into the file.
+
+    It runs once the whole file is parsed and inserted, so the file is not rewritten while it is being read.
+
+    Args:
+        state (dict): The state shared by the load steps.
+
+    Returns:
+        None
+    """
+    if not state['renumber_screenings']:
+        return
+    # The screenings inserted before the first repeated id still have the ids of the file
+    table = Screening.__table__
+    db.session.execute(table.update().where(table.c.id == db.bindparam('file_id')).values(id=db.bindparam('new_id')),
+                       [{'file_id': file_id, 'new_id': -position} for position, file_id in enumerate(state['screening_file_ids'], start=1)])
+    db.session.execute(table.update().where(table.c.id < 0).values(id=-table.c.id))
+    state['screening_ids'] = set(range(1, state['screening_count'] + 1))
+    # The listing triggers do not follow a change of id
+    rebuild_listing(db.session)
+    screenings = db.session.query(Screening).order_by(Screening.id).all()
+    csv_file(state['paths']['screening']).rewrite(SCREENING_FIELDNAMES, [screening_row(screening) for screening in screenings])
+
+
+def finish_lineup(state):
+    """
+    Store the lineup of every theater in the theater_movie table, matching the movie titles of theater.csv once.
+
+    Afterwards the lineup, the seats and the show times are kept by theater and movie ID for the schedule.
+
+    Args:
+        state (dict): The state shared by the load steps.
+
+    Returns:
+        int: The number of theater_movie rows.
+    """
+    movie_ids = {title: movie_id for movie_id, title in db.session.query(Movie.id, Movie.title)}
+    rows = []
+    for theater_id, name, number_of_seats in db.session.query(Theater.id, Theater.name, Theater.number_of_seats):
+        state['theater_seats'][theater_id] = number_of_seats
+        # Titles that are not in movie.csv cannot be scheduled and are left out
+        state['lineup'][theater_id] = {movie_ids[title] for title in state['movie_titles'].get(name, []) if title in movie_ids}
+        rows.extend({'theater_id': theater_id, 'movie_id': movie_id} for movie_id in state['lineup'][theater_id])
+    if rows:
+        db.session.execute(insert(theater_movie), rows)
+    state['show_times'] = {movie_ids[title]: times for title, times in state['show_times_by_title'].items() if title in movie_ids}
+    return len(rows)
+
+
+def finish_new_screenings(state):
+    """
+    Generate the screenings of the coming days that are not scheduled yet.
+
+    Args:
+        state (dict): The state shared by the load steps.
+
+    Returns:
+        int: The number of new screenings.
+    """
+    screenings = create_new_screening_data(state['existing_dates'], state['lineup'],
+                                           state['theater_seats'], state['show_times'], state['paths'])
+    state['new_dates'] = {screening.date for screening in screenings}
+    return len(screenings)
+
+
+def finish_screening_dates(state):
+    """
+    Record every date that has screenings in the distinct-dates index used by the date picker.
+
+    Args:
+        state (dict): The state shared by the load steps.
+
+    Returns:
+        int: The number of indexed dates.
+    """
+    return index_screening_dates(state['existing_dates'] | state['new_dates'])
+
+
+def finish_archived_bookings(state):
+    """
+    Make sure new bookings are numbered above every archived booking.
+
+    Args:
+        state (dict): The state shared by the load steps.
+
+    Returns:
+        None
+    """
+    db.session.flush()
+    reserve_booking_ids()
+
+
+# The steps of the startup load and their dependencies
+LOAD_STEPS = [
+    LoadStep('users', parse=parse_users, insert=insert_users),
+    LoadStep('movies', parse=parse_movies, insert=insert_movies),
+    LoadStep('theaters', parse=parse_theaters, insert=insert_theaters),
+    LoadStep('screenings', parse=parse_screenings, insert=insert_screenings, finish=finish_screenings, depends_on=['movies', 'theaters']),
+    LoadStep('lineup', finish=finish_lineup, depends_on=['movies', 'theaters']),
+    LoadStep('new_screenings', finish=finish_new_screenings, depends_on=['lineup', 'screenings']),
+    LoadStep('screening_dates', finish=finish_screening_dates, depends_on=['screenings', 'new_screenings']),
+    LoadStep('bookings', parse=parse_bookings, insert=insert_bookings, depends_on=['screenings']),
+    LoadStep('archived_bookings', parse=parse_archived_bookings, insert=insert_archived_bookings,
+             finish=finish_archived_bookings, depends_on=['bookings']),
+]
+
+
+def hand_over(queue, item, stop):
+    """
+    Put an item into the queue, waiting for room until the writer stops the load.
+
+    Args:
+        queue (Queue): The queue read by the writer.
+        item (tuple): The item to put.
+        stop (threading.Event): Set by the writer when the load failed and nobody reads the queue anymore.
+
+    Returns:
+        bool: True if the item was put, False if the load was stopped.
+    """
+    # A blocking put() would wait forever for a writer that gave up, so wait in short steps and check the stop event
+    while not stop.is_set():
+        try:
+            queue.put(item, timeout=0.1)
+            return True
+        except Full:
+            continue
+    return False
+
+
+def run_parser(app, step, paths, queue, stop):
+    """
+    Run the parser of a step in a worker thread and put its batches into the queue.
+
+    The queue receives (step name, batch) for every batch, then (step name, None) when the file is done,
+    or (step name, exception) if the parser failed. The parser ends early once the stop event is set.
+
+    Args:
+        app (Flask): The Flask application, needed to read the settings in the worker thread.
+        step (LoadStep): The step to parse.
+        paths (dict): A dictionary containing the absolute paths of the csv files.
+        queue (Queue): The queue read by the writer.
+        stop (threading.Event): Set by the writer when the load failed.
+
+    Returns:
+        float: The number of seconds the parser ran.
+    """
+    started = clock.perf_counter()
+    try:
+        with app.app_context():
+            for batch in step.parse(paths):
+                if not hand_over(queue, (step.name, batch), stop):
+                    break
+            else:
+                hand_over(queue, (step.name, None), stop)
+    except Exception as error:
+        hand_over(queue, (step.name, error), stop)
+    return clock.perf_counter() - started
+
+
+def drain(queue):
+    """
+    Remove every item left in the queue, so no parser waits for room in it.
+
+    Args:
+        queue (Queue): The queue read by the writer.
+
+    Returns:
+        None
+    """
+    while True:
+        try:
+            queue.get_nowait()
+        except Empty:
+            return
+
+
+def insert_data(steps=LOAD_STEPS):
+    """
+    Inserts data from csv files into the respective tables in the database.
+
+    All csv files are parsed at the same time in a worker pool, and the parsed batches are inserted by this thread
+    in dependency order, all in one transaction. If a row cannot be parsed or inserted, the parsers are stopped,
+    the transaction is rolled back and the error is raised.
+
+    Args:
+        steps (list): The load steps, LOAD_STEPS by default.
+
+    Returns:
+        dict: A dictionary with step name as key and its timings (in seconds) as value.
+    """
+    started = clock.perf_counter()
+    app = current_app._get_current_object()
+    paths = get_csv_paths()
+    state = {'paths': paths, 'show_times_by_title': {}, 'movie_titles': {}, 'show_times': {}, 'lineup': {}, 'theater_seats': {},
+             'existing_dates': set(), 'new_dates': set(), 'screening_ids': set(), 'screening_file_ids': [], 'screening_count': 0,
+             'renumber_screenings': False}
+    by_name = {step.name: step for step in steps}
+    timings = {step.name: {'parse': 0.0, 'insert': 0.0, 'rows': 0, 'done_at': 0.0} for step in steps}
+    # Batches that arrived before the step's dependencies were inserted
+    waiting = {step.name: [] for step in steps}
+    parsed = {step.name for step in steps if step.parse is None}
+    done = set()
+    # A bounded queue keeps the parsers from reading far ahead of the writer
+    queue = Queue(maxsize=app.config.get('STARTUP_QUEUE_SIZE', 16))
+    # Set when the load fails, so the parsers stop instead of waiting for room in the queue
+    stop = threading.Event()
+
+    def insert_batch(name, batch):
+        step_started = clock.perf_counter()
+        by_name[name].insert(state, batch)
+        timings[name]['insert'] += clock.perf_counter() - step_started
+        timings[name]['rows'] += len(batch)
+
+    def advance():
+        # Insert what is ready and finish the steps whose file is parsed and whose dependencies are done
+        progress = True
+        while progress:
+            progress = False
+            for step in steps:
+                if step.name in done or not all(dependency in done for dependency in step.depends_on):
+                    continue
+                for batch in waiting[step.name]:
+                    insert_batch(step.name, batch)
+                waiting[step.name].clear()
+                if step.name in parsed:
+                    if step.finish is not None:
+                        step_started = clock.perf_counter()
+                        # A finish function returns the number of rows it created, if any
+                        timings[step.name]['rows'] += step.finish(state) or 0
+                        timings[step.name]['insert'] += clock.perf_counter() - step_started
+                    timings[step.name]['done_at'] = clock.perf_counter() - started
+                    done.add(step.name)
+                    progress = True
+
+    workers = app.config.get('STARTUP_WORKERS', 4)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {step.name: pool.submit(run_parser, app, step, paths, queue, stop) for step in steps if step.parse is not None}
+        try:
+            advance()
+            while len(done) < len(steps):
+                name, batch = queue.get()
+                if isinstance(batch, Exception):
+                    raise batch
+                if batch is None:
+                    parsed.add(name)
+                elif all(dependency in done for dependency in by_name[name].depends_on):
+                    insert_batch(name, batch)
+                else:
+                    waiting[name].append(batch)
+                advance()
+        except BaseException:
+            # Stop the parsers and empty the queue, so the pool can shut down and the error is reported
+            stop.set()
+            drain(queue)
+            db.session.rollback()
+            raise
+        for name, future in futures.items():
+            timings[name]['parse'] = future.result()
+    # Commit the whole load at once
+    db.session.commit()
+    timings['total'] = {'parse': 0.0, 'insert': 0.0, 'rows': sum(timing['rows'] for timing in timings.values()),
+                        'done_at': clock.perf_counter() - started}
+    app.config['STARTUP_TIMINGS'] = timings
+    report_timings(timings)
+    return timings
+
+
+def report_timings(timings):
+    """
+    Print the time every load step took.
+
+    Args:
+        timings (dict): The timings returned by insert_data().
+
+    Returns:
+        None
+    """
+    print("Startup load (ms):  step                parse   insert   done at   rows")
+    for name, timing in timings.items():
+        print(f"                    {name:<18} {timing['parse'] * 1000:7.1f} {timing['insert'] * 1000:8.1f} {timing['done_at'] * 1000:9.1f} {timing['rows']:6d}")
+
+
+def theater_lineup():
+    """
+    Read the lineup of every theater from the theater_movie table.
+
+    Returns:
+        dict: A dictionary with theater ID as key and the set of IDs of the movies it shows as value.
+    """
+    lineup = {}
+    for theater_id, movie_id in db.session.query(theater_movie.c.theater_id, theater_movie.c.movie_id):
+        lineup.setdefault(theater_id, set()).add(movie_id)
+    return lineup
+
+
+def schedule_new_screenings():
+    """
+    Add the screenings of the coming days to a database that was kept from the last start.
+
+    The show times are read from movie.csv, the lineup of the theaters and the existing dates from the database.
+
+    Returns:
+        set: A set containing the dates of the newly created screenings.
+    """
+    paths = get_csv_paths()
+    movie_ids = {title: movie_id for movie_id, title in db.session.query(Movie.id, Movie.title)}
+    show_times = {}
+    for batch in parse_movies(paths):
+        show_times.update({movie_ids[row['title']]: times for row, times in batch if row['title'] in movie_ids})
+    theater_seats = dict(db.session.query(Theater.id, Theater.number_of_seats).all())
+    # With sharding the kept screenings are in the shard files, and the new ones are numbered after all of them
+    existing_dates = set()
+    first_id = 1
+    for session in data_sessions():
+        existing_dates.update(date for (date,) in session.query(Screening.date).distinct())
+        first_id = max(first_id, (session.query(db.func.max(Screening.id)).scalar() or 0) + 1)
+    new_dates = {screening.date for screening in
+                 create_new_screening_data(existing_dates, theater_lineup(), theater_seats, show_times, paths, first_id)}
+    index_screening_dates(new_dates)
+    db.session.commit()
+    return new_dates
+
+
+# Fieldnames for the screening.csv file for writing data
+SCREENING_FIELDNAMES = [
+    'id',
+    'date',
+    'time',
+    'available_seats',
+    'theater_id',
+    'movie_id'
+]
+
+
+def screening_row(screening):
+    """
+    Create the row of a screening in the screening.csv file.
+
+    Args:
+        screening (Screening): The screening.
+
+    Returns:
+        dict: A dictionary with the screening data for the row.
+    """
+    return {
+        'id': screening.id,
+        'date': screening.date,
+        'time': screening.time,
+        'available_seats': screening.available_seats,
+        'theater_id': screening.theater_id,
+        'movie_id': screening.movie_id
+    }
+
+
+def create_new_screening_data(existing_dates, lineup, theater_seats, show_times, paths, first_id=None):
+    """
+    Create new screening data for a movie theater based on available movies and show times.
+    Then store those data into the screening.csv file.
+
+    Args:
+        existing_dates (set): A set containing existing screening dates.
+        lineup (dict): A dictionary containing theater IDs as keys and the set of IDs of the movies they show as values.
+        theater_seats (dict): A dictionary containing theater IDs as keys and number of seats as values.
+        show_times (dict): A dictionary containing movie IDs as keys and a list of show times as values.
+        paths (dict): A dictionary containing file paths.
+        first_id (int or None): The ID of the first new screening, or None to let the database number them.
+
+    Returns:
+        list: The new Screening objects.
+
+    """
+    # Initialize an empty list for screenings objects
+    screenings = []
+    today = datetime.now().date()
+    duration = 7
+    # Iterate through the next 7 days starting from today, only creating screenings for new dates
+    for i in range(duration):
+        screening_date = today + timedelta(days = i)
+        if screening_date in existing_dates:
+            continue
+        # Iterate over every theater and the ids of the movies in its lineup
+        for theater_id, movie_ids in lineup.items():
+            # Create data for number_of_seats using theater_seats dictionary for creating Screening object later
+            number_of_seats = theater_seats[theater_id]
+            # Only the movies that have show times are scheduled (a set intersection of ids, no title matching)
+            for movie_id in sorted(movie_ids & show_times.keys()):
+                # Iterate over every show times for the current movie
+                for time in show_times[movie_id]:
+                    # Create a Screening object using data for current screening
+                    screening = Screening(date=screening_date, time=time, available_seats=number_of_seats, theater_id=theater_id, movie_id=movie_id)
+                    if first_id is not None:
+                        screening.id = first_id + len(screenings)
+                    # Append the Screening object to the list of Screenings
+                    screenings.append(screening)
+    # Add all screenings to the database
+    db.session.add_all(screenings)
+    # Write them to the database, the load is committed once at the end
+    db.session.flush()
+
+    # If no existing dates are provided, replace screening.csv with a row for each screening in the database
+    if not existing_dates:
+        screening_list = Screening.query.all()
+        csv_file(paths['screening']).rewrite(SCREENING_FIELDNAMES, [screening_row(screening) for screening in screening_list])
+    # Otherwise append a row for each screening (new data compared with the file) to screening.csv
+    else:
+        csv_file(paths['screening']).append(SCREENING_FIELDNAMES, [screening_row(screening) for screening in screenings])
+
+    # Return the new screenings
+    return screenings
+
+
+def index_screening_dates(dates):
+    """
+    Add dates to the ScreeningDate table, the distinct-dates index of the Screening table.
+
+    Args:
+        dates (set): A set of dates that have screenings.
+
+    Returns:
+        int: The number of dates added to the index.
+    """
+    # Only add the dates that are not in the index yet
+    indexed = {row.date for row in ScreeningDate.query.all()}
+    new_dates = [ScreeningDate(date=date) for date in dates - indexed]
+    db.session.add_all(new_dates)
+    db.session.flush()
+    return len(new_dates)
@@ -0,0 +1,523 @@
+"""
+The purpose of loadtest.py is to put a running server under realistic traffic instead of clicking through the site by hand.
+
+'flask load-test' sends real HTTP requests to a server started separately (for example with 'python main.py')
+from a number of virtual users, each with its own cookies, and reports per route the throughput, the share of errors
+(server errors and failed connections), the share of rejected requests (4xx, such as 429 from rate limiting)
+and the latency percentiles. Two kinds of traffic are generated:
+    - the traffic mix (the default): every virtual user repeatedly picks a scenario by the weights of TRAFFIC_MIX:
+      browsing the currentMovies page, the two steps of a booking, logging in again or registering a new account.
+      Bookings choose screenings with a Zipf distribution, so a few popular shows get most of the bookings, as on a real site.
+    - the replay (--replay): the timestamps of booking.csv are replayed as booking flows, compressed by --speedup,
+      so a day of past bookings becomes an on-sale spike of a few seconds.
+The virtual users log in to load test accounts that are created in the database (not in user.csv) on first use,
+so the command must run in the same project as the server. The bookings and registrations are real:
+they are written to the database and the csv files of the server, so run the load test on a copy of the project.
+"""
+# Import the 'db' object located in __init__.py from the current package (website) for database operations
+# and the helper that returns the paths of the csv files
+from . import db, get_csv_paths
+# Imports the models from the current package, which define the database tables and their relationships
+from .models import User, ScreeningListing, ScreeningDate
+# Import the router that returns the session of every database file
+from .sharding import data_sessions
+# Import the password policy, used to create the load test accounts
+from .passwords import password_policy
+# Import the csv persistence layer, used to read the timestamps of booking.csv
+from .csvstore import csv_file
+# Import the percentile helper shared with the other benchmarks
+from .benchmark import percentile
+# Import click and with_appcontext to define the command line interface
+import click
+from flask.cli import with_appcontext
+# Import the modules used to send the HTTP requests with a cookie jar per virtual user
+from http.cookiejar import CookieJar
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode
+from urllib.request import HTTPCookieProcessor, HTTPRedirectHandler, Request, build_opener
+# Import the modules used to run the virtual users and summarize the timings
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+import itertools
+import random
+import re
+import threading
+import time
+import uuid
+
+# The share of the scenarios in the traffic mix, mostly browsing
+TRAFFIC_MIX = {'browse': 70, 'book': 20, 'login': 8, 'register': 2}
+
+# The password of the load test accounts
+LOAD_TEST_PASSWORD = 'load-test-password'
+
+# The exponent of the Zipf distribution of the booked screenings; larger means more skew toward the popular shows
+POPULARITY_SKEW = 1.1
+
+# Finds the idempotency key in a rendered ticket form
+IDEMPOTENCY_KEY_PATTERN = re.compile(rb'name="idempotency_key" value="(\w+)"')
+
+
+class NoRedirect(HTTPRedirectHandler):
+    """
+    A class that stops urllib from following redirects, so a redirect is measured as the response it is.
+    """
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+class VirtualUser:
+    """
+    A class that represents one visitor of the site, with its own cookies.
+
+        Attributes:
+            base_url (str): The URL of the server, for example 'http://127.0.0.1:5000'.
+            email (str): The email of the user's load test account.
+            timeout (float): The number of seconds to wait for a response.
+    """
+
+    def __init__(self, base_url, email, timeout):
+        self.base_url = base_url.rstrip('/')
+        self.email = email
+        self.timeout = timeout
+        self.logged_in = False
+        self._opener = build_opener(HTTPCookieProcessor(CookieJar()), NoRedirect())
+
+    def request(self, method, path, form=None):
+        """
+        Send one request.
+
+        Args:
+            method (str): 'GET' or 'POST'.
+            path (str): The path of the page, for example '/currentMovies'.
+            form (dict or None): The form fields of a POST request.
+
+        Returns:
+            Tuple: The status code, the body and the Location header of the response.
+        """
+        data = urlencode(form, doseq=True).encode() if form is not None else None
+        try:
+            with self._opener.open(Request(self.base_url + path, data=data, method=method), timeout=self.timeout) as response:
+                return response.status, response.read(), response.headers.get('Location')
+        except HTTPError as error:
+            # Redirects and error statuses arrive as HTTPError, they are still responses of the server
+            with error:
+                return error.code, error.read(), error.headers.get('Location')
+
+
+class LoadStats:
+    """
+    A class that collects the latency and status of every request, shared by the threads of the virtual users.
+
+        Attributes:
+            latencies (defaultdict): The latencies in milliseconds of every route.
+            statuses (defaultdict): A Counter of the status codes of every route, 'error' for failed connections.
+            outcomes (Counter): The results of the booking flows, 'booked' or 'not booked'.
+    """
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+        self.outcomes = Counter()
+        self._lock = threading.Lock()
+
+    def send(self, route, user, method, path, form=None):
+        """
+        Send a request of a virtual user and record its latency and status.
+
+        Args:
+            route (str): The name of the route in the report.
+            user (VirtualUser): The user who sends the request.
+            method (str): 'GET' or 'POST'.
+            path (str): The path of the page.
+            form (dict or None): The form fields of a POST request.
+
+        Returns:
+            Tuple: The status code ('error' if the server could not be reached), the body and the Location header.
+        """
+        started = time.perf_counter()
+        try:
+            status, body, location = user.request(method, path, form)
+        except (URLError, OSError):
+            status, body, location = 'error', b'', None
+        elapsed = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self.latencies[route].append(elapsed)
+            self.statuses[route][status] += 1
+        return status, body, location
+
+    def count(self, outcome):
+        """
+        Count the result of a booking flow.
+
+        Args:
+            outcome (str): 'booked' or 'not booked'.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self.outcomes[outcome] += 1
+
+    def report(self, seconds):
+        """
+        Describe the throughput, errors and latency of every route.
+
+        Args:
+            seconds (float): How long the load test ran.
+
+        Returns:
+            list: The lines of the report.
+        """
+        lines = [f"{'route':<22} {'requests':>8} {'req/s':>8} {'errors':>7} {'rejected':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"]
+        for route in sorted(self.latencies):
+            latencies = self.latencies[route]
+            statuses = self.statuses[route]
+            total = len(latencies)
+            errors = sum(count for status, count in statuses.items() if status == 'error' or status >= 500)
+            rejected = sum(count for status, count in statuses.items() if status != 'error' and 400 <= status < 500)
+            lines.append(f"{route:<22} {total:>8} {total / seconds:>8.1f} {errors / total:>7.1%} {rejected / total:>8.1%} "
+                         f"{percentile(latencies, 0.50):>8.1f} {percentile(latencies, 0.95):>8.1f} {percentile(latencies, 0.99):>8.1f}")
+        for route in sorted(self.statuses):
+            lines.append(f"{route:<22} status codes: " + ", ".join(f"{count} x {status}" for status, count in
+                                                                   sorted(self.statuses[route].items(), key=str)))
+        if self.outcomes:
+            lines.append("booking flows: " + ", ".join(f"{count} {outcome}" for outcome, count in sorted(self.outcomes.items())))
+        return lines
+
+
+class LoadPlan:
+    """
+    A class that holds what the virtual users can ask for: the dates with screenings and the bookable screenings.
+
+        Attributes:
+            dates (list): The upcoming dates with screenings.
+            screenings (list): (screening ID, theater ID) pairs, the most popular first.
+            theaters (dict): The theater ID of every screening ID.
+    """
+
+    def __init__(self, dates, screenings, seed):
+        self.dates = dates
+        # A random but repeatable popularity order, so the popular shows are not simply the first ones in the table
+        self.screenings = list(screenings)
+        random.Random(seed).shuffle(self.screenings)
+        self.theaters = dict(self.screenings)
+        self._weights = list(itertools.accumulate(1 / (rank + 1) ** POPULARITY_SKEW for rank in range(len(self.screenings))))
+
+    def pick_screening(self, rng):
+        """
+        Choose a screening to book, more often a popular one.
+
+        Args:
+            rng (Random): The random number generator of the virtual user.
+
+        Returns:
+            Tuple: The screening ID and its theater ID.
+        """
+        return rng.choices(self.screenings, cum_weights=self._weights)[0]
+
+
+def load_plan(seed):
+    """
+    Read the upcoming dates and the screenings with free seats from the database.
+
+    Args:
+        seed (int): The seed of the popularity order.
+
+    Returns:
+        LoadPlan: The plan of the load test.
+    """
+    today = date.today()
+    dates = [row.date for row in ScreeningDate.query.filter(ScreeningDate.date >= today).order_by(ScreeningDate.date)]
+    screenings = []
+    for session in data_sessions():
+        screenings.extend(session.query(ScreeningListing.screening_id, ScreeningListing.theater_id)
+                          .filter(ScreeningListing.date >= today, ScreeningListing.available_seats > 0)
+                          .order_by(ScreeningListing.screening_id)
+                          .all())
+    return LoadPlan(dates, [tuple(row) for row in screenings], seed)
+
+
+def load_test_accounts(count):
+    """
+    Return the emails of the load test accounts, creating the missing ones in the database only.
+
+    Args:
+        count (int): The number of accounts, one per virtual user.
+
+    Returns:
+        list: The emails of the accounts.
+    """
+    emails = [f"loadtest-{number}@loadtest.invalid" for number in range(1, count + 1)]
+    existing = {email for (email,) in db.session.query(User.email).filter(User.email.in_(emails))}
+    password = password_policy().hash(LOAD_TEST_PASSWORD) if len(existing) < count else None
+    db.session.add_all([User(email=email, first_name='Load', last_name='Test', password=password)
+                        for email in emails if email not in existing])
+    db.session.commit()
+    return emails
+
+
+def log_in(user, stats):
+    """
+    Log a virtual user in to its load test account.
+
+    Args:
+        user (VirtualUser): The user.
+        stats (LoadStats): The recorded requests.
+
+    Returns:
+        None
+    """
+    stats.send('GET /logout', user, 'GET', '/logout')
+    status, _, _ = stats.send('POST /login', user, 'POST', '/login', {'email': user.email, 'password': LOAD_TEST_PASSWORD})
+    # A successful login redirects to the home page, a failed one shows the login form again
+    user.logged_in = status == 302
+
+
+def browse(user, stats, plan, rng):
+    """
+    Search the screenings of one to three upcoming days on the currentMovies page.
+
+    Args:
+        user (VirtualUser): The user.
+        stats (LoadStats): The recorded requests.
+        plan (LoadPlan): The dates and screenings to ask for.
+        rng (Random): The random number generator of the user.
+
+    Returns:
+        None
+    """
+    start = rng.choice(plan.dates)
+    end = start + timedelta(days=rng.randint(0, 2))
+    stats.send('POST /currentMovies', user, 'POST', '/currentMovies', {'start_date': str(start), 'end_date': str(end)})
+
+
+def book(user, stats, plan, rng, screening=None, number=None):
+    """
+    Open the ticket form of a screening and book tickets with it, the two steps of a booking.
+
+    Args:
+        user (VirtualUser): The user.
+        stats (LoadStats): The recorded requests.
+        plan (LoadPlan): The dates and screenings to ask for.
+        rng (Random): The random number generator of the user.
+        screening (tuple or None): The screening ID and theater ID to book, a popular screening if None.
+        number (int or None): The number of tickets, 1 to 4 if None.
+
+    Returns:
+        None
+    """
+    screening_id, theater_id = screening or plan.pick_screening(rng)
+    status, body, _ = stats.send('POST /getTicket form', user, 'POST', '/getTicket',
+                                 {'screening_id': screening_id, 'theater_id': theater_id})
+    key = IDEMPOTENCY_KEY_PATTERN.search(body) if status == 200 else None
+    if key is None:
+        stats.count('not booked')
+        return
+    status, _, location = stats.send('POST /getTicket book', user, 'POST', '/getTicket',
+                                     {'number_of_ticket': number or rng.randint(1, 4), 'booked_screening': screening_id,
+                                      'booked_theater': theater_id, 'idempotency_key': key.group(1).decode()})
+    # A booking redirects to the booking page, a sold out screening back to the movies page
+    stats.count('booked' if status == 302 and (location or '').endswith('/myBooking') else 'not booked')
+
+
+def register(user, stats, plan, rng):
+    """
+    Register a new account, which also logs the virtual user in to it.
+
+    Args:
+        user (VirtualUser): The user.
+        stats (LoadStats): The recorded requests.
+        plan (LoadPlan): The dates and screenings to ask for.
+        rng (Random): The random number generator of the user.
+
+    Returns:
+        None
+    """
+    email = f"loadtest-{uuid.uuid4().hex[:12]}@loadtest.invalid"
+    stats.send('GET /logout', user, 'GET', '/logout')
+    stats.send('POST /register', user, 'POST', '/register',
+               {'email': email, 'firstName': 'Load', 'lastName': 'Test',
+                'password1': LOAD_TEST_PASSWORD, 'password2': LOAD_TEST_PASSWORD})
+    # The next scenario logs in to the load test account again
+    user.logged_in = False
+
+
+# The scenarios of the traffic mix
+SCENARIOS = {'browse': browse, 'book': book, 'login': lambda user, stats, plan, rng: log_in(user, stats), 'register': register}
+
+
+def parse_mix(text):
+    """
+    Parse the --mix option, for example 'browse:70,book:20,login:8,register:2'.
+
+    Args:
+        text (str or None): The option value; None for TRAFFIC_MIX.
+
+    Returns:
+        dict: The weight of every scenario.
+    """
+    if not text:
+        return dict(TRAFFIC_MIX)
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition(':')
+        if name.strip() not in SCENARIOS or not weight.strip().replace('.', '', 1).isdigit():
+            raise click.BadParameter(f"'{part}' is not <scenario>:<weight> with a scenario of {', '.join(SCENARIOS)}.", param_hint='--mix')
+        mix[name.strip()] = float(weight)
+    if not any(mix.values()):
+        raise click.BadParameter("At least one scenario needs a weight above 0.", param_hint='--mix')
+    return mix
+
+
+def run_mix(base_url, emails, plan, mix, seconds, think_time, timeout, seed):
+    """
+    Let every virtual user run scenarios of the traffic mix until the time is up.
+
+    Args:
+        base_url (str): The URL of the server.
+        emails (list): The load test account of every virtual user.
+        plan (LoadPlan): The dates and screenings to ask for.
+        mix (dict): The weight of every scenario.
+        seconds (float): How long to run.
+        think_time (float): The number of seconds a user waits between two scenarios.
+        timeout (float): The number of seconds to wait for a response.
+        seed (int): The seed of the random choices.
+
+    Returns:
+        LoadStats: The recorded requests.
+    """
+    stats = LoadStats()
+    names, weights = list(mix), list(mix.values())
+    deadline = time.perf_counter() + seconds
+
+    def visit(number, email):
+        rng = random.Random(seed * 100003 + number)
+        user = VirtualUser(base_url, email, timeout)
+        while time.perf_counter() < deadline:
+            if not user.logged_in:
+                log_in(user, stats)
+            scenario = rng.choices(names, weights=weights)[0]
+            SCENARIOS[scenario](user, stats, plan, rng)
+            if think_time:
+                time.sleep(think_time)
+
+    threads = [threading.Thread(target=visit, args=(number, email)) for number, email in enumerate(emails)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return stats
+
+
+def replay_schedule(path, speedup, seconds):
+    """
+    Turn the timestamps of booking.csv into a schedule of booking flows.
+
+    Args:
+        path (str): The path of booking.csv.
+        speedup (float): How many times faster than the original the bookings are replayed.
+        seconds (float): The length of the replay; later bookings are left out.
+
+    Returns:
+        list: (seconds after the start, screening ID, number of tickets) tuples, in time order.
+    """
+    _, rows = csv_file(path).read()
+    bookings = sorted((datetime.strptime(row['timestamp'], '%Y-%m-%d %H:%M:%S'), int(row['screening_id']), int(row['number_of_tickets']))
+                      for row in rows)
+    if not bookings:
+        return []
+    first = bookings[0][0]
+    schedule = [((timestamp - first).total_seconds() / speedup, screening_id, number) for timestamp, screening_id, number in bookings]
+    return [entry for entry in schedule if entry[0] <= seconds]
+
+
+def run_replay(base_url, emails, plan, schedule, timeout, seed):
+    """
+    Start the booking flows of the schedule at their time, on as many virtual users as there are accounts.
+
+    A booking of a screening that is no longer bookable books a popular screening instead.
+
+    Args:
+        base_url (str): The URL of the server.
+        emails (list): The load test account of every virtual user.
+        plan (LoadPlan): The dates and screenings to ask for.
+        schedule (list): The booking flows from replay_schedule().
+        timeout (float): The number of seconds to wait for a response.
+        seed (int): The seed of the random choices.
+
+    Returns:
+        LoadStats: The recorded requests.
+    """
+    stats = LoadStats()
+    local = threading.local()
+    free_accounts = list(emails)
+    accounts_lock = threading.Lock()
+
+    def replay_booking(screening_id, number):
+        # Every worker thread is one virtual user, logged in on its first booking
+        if not hasattr(local, 'user'):
+            with accounts_lock:
+                local.user = VirtualUser(base_url, free_accounts.pop(), timeout)
+            local.rng = random.Random(seed * 100003 + len(free_accounts))
+        if not local.user.logged_in:
+            log_in(local.user, stats)
+        theater_id = plan.theaters.get(screening_id)
+        screening = (screening_id, theater_id) if theater_id is not None else None
+        book(local.user, stats, plan, local.rng, screening=screening, number=number)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(emails)) as executor:
+        for offset, screening_id, number in schedule:
+            # The schedule is open: a booking starts at its time even if earlier ones have not finished
+            time.sleep(max(0, started + offset - time.perf_counter()))
+            executor.submit(replay_booking, screening_id, number)
+    return stats
+
+
+@click.command('load-test')
+@click.option('--url', default='http://127.0.0.1:5000', show_default=True, help='URL of the running server.')
+@click.option('--users', default=10, show_default=True, help='Number of concurrent virtual users.')
+@click.option('--seconds', default=30.0, show_default=True, help='How long the traffic mix runs, or the longest replay.')
+@click.option('--mix', default=None, help="Scenario weights, for example 'browse:70,book:20,login:8,register:2'.")
+@click.option('--think-time', default=0.0, show_default=True, help='Seconds every user waits between two scenarios.')
+@click.option('--replay', is_flag=True, help='Replay the booking timestamps of booking.csv instead of the traffic mix.')
+@click.option('--speedup', default=3600.0, show_default=True, help='How many times faster the replay runs than the original bookings.')
+@click.option('--timeout', default=30.0, show_default=True, help='Seconds to wait for a response.')
+@click.option('--seed', default=1, show_default=True, help='Seed of the random choices, for repeatable runs.')
+@with_appcontext
+def load_test_command(url, users, seconds, mix, think_time, replay, speedup, timeout, seed):
+    """
+    Send realistic traffic to a running server and report throughput, errors and latency per route.
+    """
+    if users < 1:
+        raise click.BadParameter("There must be at least one virtual user.", param_hint='--users')
+    mix = parse_mix(mix)
+    plan = load_plan(seed)
+    if not plan.dates or not plan.screenings:
+        raise click.ClickException("The load test needs upcoming screenings with free seats in the database.")
+    emails = load_test_accounts(users)
+    # The database is read by the server too, so end this command's transaction before the traffic starts
+    db.session.commit()
+
+    started = time.perf_counter()
+    if replay:
+        schedule = replay_schedule(get_csv_paths()['booking'], speedup, seconds)
+        if not schedule:
+            raise click.ClickException("booking.csv has no bookings to replay.")
+        click.echo(f"Replaying {len(schedule)} bookings of booking.csv in {schedule[-1][0]:.1f} seconds with {users} users against {url} ...")
+        stats = run_replay(url, emails, plan, schedule, timeout, seed)
+    else:
+        click.echo(f"Running {users} users for {seconds:g} seconds against {url}, mix "
+                   + ", ".join(f"{name} {weight:g}" for name, weight in mix.items()) + " ...")
+        stats = run_mix(url, emails, plan, mix, seconds, think_time, timeout, seed)
+    elapsed = time.perf_counter() - started
+
+    if not stats.latencies:
+        raise click.ClickException("No request was sent.")
+    for line in stats.report(elapsed):
+        click.echo(line)
+    if all(set(statuses) == {'error'} for statuses in stats.statuses.values()):
+        raise click.ClickException(f"The server at {url} could not be reached.")
@@ -0,0 +1,245 @@
+"""
+The purpose of migrations.py is to upgrade the schema of an existing database in place.
+
+Startup used to drop every table and load the csv files again, so any change to the models meant a full reload.
+Now the database keeps a schema_version table with one row per applied migration, and startup only runs
+the migrations in MIGRATIONS that the database does not have yet:
+    - a new database is created from the models and marked as up to date,
+    - a database without a schema_version table was made by the old startup, so it is rebuilt from the csv files once,
+    - any other database is upgraded in place and keeps its data.
+
+Migrations must be additive, so they can run on a large live database without downtime:
+create a table, add a column that is nullable or has a default (SQLite only changes the table definition),
+or create an index. Every migration runs in its own transaction together with its schema_version row,
+so a failed migration leaves the database at the previous version.
+To change the schema, change the model and append a Migration with the next version number that makes the same change.
+"""
+# Import the 'db' object located in __init__.py from the current package (website) for database operations
+from . import db
+# Imports the model of the table that records the applied migrations
+from .models import SchemaVersion
+# Import inspect to look at the tables and columns of the database
+from sqlalchemy import inspect
+# Import click and with_appcontext to define the command line interface
+import click
+from flask.cli import with_appcontext
+# Import necessary modules to work with dates and times.
+from datetime import datetime
+
+
+class Migration:
+    """
+    A class that represents one versioned change of the database schema.
+
+        Attributes:
+            version (int): The number of the migration, one more than the previous migration.
+            description (str): What the migration changes.
+            upgrade (function): A function that takes a database connection and applies the change.
+    """
+
+    def __init__(self, version, description, upgrade):
+        self.version = version
+        self.description = description
+        self.upgrade = upgrade
+
+
+def create_missing_tables(connection):
+    """
+    Create the tables of the models that do not exist yet.
+
+    Args:
+        connection (Connection): The database connection of the migration.
+
+    Returns:
+        None
+    """
+    db.metadata.create_all(bind=connection, checkfirst=True)
+
+
+def create_index(connection, name, table, columns):
+    """
+    Create an index if it does not exist yet.
+
+    Args:
+        connection (Connection): The database connection of the migration.
+        name (str): The name of the index.
+        table (str): The name of the table.
+        columns (list): The names of the indexed columns.
+
+    Returns:
+        None
+    """
+    connection.execute(db.text(f'CREATE INDEX IF NOT EXISTS "{name}" ON "{table}" ({", ".join(columns)})'))
+
+
+def add_column(connection, table, column, definition):
+    """
+    Add a column to a table if the table does not have it yet.
+
+    Args:
+        connection (Connection): The database connection of the migration.
+        table (str): The name of the table.
+        column (str): The name of the new column.
+        definition (str): The SQL type of the column, with a DEFAULT if it is not nullable.
+
+    Returns:
+        None
+    """
+    if column not in {existing['name'] for existing in inspect(connection).get_columns(table)}:
+        connection.execute(db.text(f'ALTER TABLE "{table}" ADD COLUMN "{column}" {definition}'))
+
+
+def index_bookings(connection):
+    """
+    Index the screening_booking links in both directions and the bookings by user, used by the booking history.
+
+    Args:
+        connection (Connection): The database connection of the migration.
+
+    Returns:
+        None
+    """
+    create_index(connection, 'ix_screening_booking_screening_id', 'screening_booking', ['screening_id'])
+    create_index(connection, 'ix_screening_booking_booking_id', 'screening_booking', ['booking_id'])
+    create_index(connection, 'ix_booking_user_id', 'booking', ['user_id'])
+
+
+def add_screening_listing(connection):
+    """
+    Create the screening_listing read model with its triggers and fill it from the normalized tables.
+
+    Args:
+        connection (Connection): The database connection of the migration.
+
+    Returns:
+        None
+    """
+    from .models import ScreeningListing
+    from .listings import rebuild_listing
+    # Creating the table also creates its triggers (see LISTING_TRIGGERS in models.py)
+    ScreeningListing.__table__.create(bind=connection, checkfirst=True)
+    rebuild_listing(connection)
+
+
+def add_theater_lineup(connection):
+    """
+    Create the theater_movie table and fill it from the comma separated movie titles of the theater table.
+
+    Args:
+        connection (Connection): The database connection of the migration.
+
+    Returns:
+        None
+    """
+    from .models import theater_movie
+    theater_movie.create(bind=connection, checkfirst=True)
+    # The old column stays in the table (migrations only add), but the models no longer use it
+    if 'available_movies' not in {column['name'] for column in inspect(connection).get_columns('theater')}:
+        return
+    movie_ids = {title: movie_id for movie_id, title in connection.execute(db.text("SELECT id, title FROM movie"))}
+    rows = [{'theater_id': theater_id, 'movie_id': movie_ids[title]}
+            for theater_id, titles in connection.execute(db.text("SELECT id, available_movies FROM theater"))
+            for title in set((titles or '').split(", ")) if title in movie_ids]
+    if rows:
+        connection.execute(theater_movie.insert().prefix_with('OR IGNORE'), rows)
+
+
+def add_screening_prices(connection):
+    """
+    Add the price columns of the screenings and bookings, and let the listing triggers copy the screening prices.
+
+    The movie and listing prices are now declared as floats. SQLite cannot change the type of a column in place,
+    but it already stored the decimal prices of movie.csv as REAL values in those columns, so their data does not change.
+    The screenings are priced by the startup (or 'flask reprice-screenings'), until then the listing shows the movie prices.
+
+    Args:
+        connection (Connection): The database connection of the migration.
+
+    Returns:
+        None
+    """
+    from .models import LISTING_TRIGGERS
+    add_column(connection, 'screening', 'price', 'FLOAT')
+    add_column(connection, 'booking', 'price', 'FLOAT')
+    # Replace the triggers whose SQL changed and create the new one
+    for name in ('screening_listing_insert', 'screening_listing_update', 'screening_listing_movie', 'screening_listing_price'):
+        connection.execute(db.text(f"DROP TRIGGER IF EXISTS {name}"))
+        connection.execute(db.text(LISTING_TRIGGERS[name]))
+
+
+# Every schema change, in order. Append new migrations at the end and never change the applied ones.
+MIGRATIONS = [
+    Migration(1, 'Create the tables of the models', create_missing_tables),
+    Migration(2, 'Index screening_booking and booking.user_id', index_bookings),
+    Migration(3, 'Add the screening_listing read model', add_screening_listing),
+    Migration(4, 'Add the theater_movie lineup table', add_theater_lineup),
+    Migration(5, 'Add the screening and booking prices', add_screening_prices),
+]
+
+
+def latest_version():
+    """
+    Return the version of the newest migration.
+
+    Returns:
+        int: The version the models correspond to.
+    """
+    return MIGRATIONS[-1].version
+
+
+def current_version():
+    """
+    Return the schema version of the database.
+
+    Returns:
+        int or None: The highest applied migration, 0 if none was applied, or None if the database has no schema_version table.
+    """
+    if not inspect(db.engine).has_table(SchemaVersion.__tablename__):
+        return None
+    return db.session.query(db.func.max(SchemaVersion.version)).scalar() or 0
+
+
+def stamp_latest_version():
+    """
+    Mark a database created from the current models as up to date, without running the migrations.
+
+    Returns:
+        None
+    """
+    now = datetime.now()
+    db.session.add_all([SchemaVersion(version=migration.version, description=migration.description, applied_at=now)
+                        for migration in MIGRATIONS])
+    db.session.commit()
+
+
+def upgrade_database():
+    """
+    Apply the migrations the database does not have yet, each in its own transaction.
+
+    Returns:
+        list: The migrations that were applied.
+    """
+    version = current_version() or 0
+    applied = []
+    for migration in MIGRATIONS:
+        if migration.version <= version:
+            continue
+        # The change and its schema_version row are committed together
+        with db.engine.begin() as connection:
+            migration.upgrade(connection)
+            connection.execute(SchemaVersion.__table__.insert().values(
+                version=migration.version, description=migration.description, applied_at=datetime.now()))
+        applied.append(migration)
+    return applied
+
+
+@click.command('db-upgrade')
+@with_appcontext
+def db_upgrade_command():
+    """
+    Apply the pending schema migrations to the database.
+    """
+    applied = upgrade_database()
+    for migration in applied:
+        click.echo(f"Applied migration {migration.version}: {migration.description}")
+    click.echo(f"Database is at schema version {current_version()}.")
@@ -74,6 +74,8 @@ from flask_login import UserMixin
 # Import the func object from the sqlalchemy module. 
 # func is used to call SQL functions in SQLAlchemy and it is used in Booking model to create timestamp.
 from sqlalchemy import func
+# Import event and DDL to create the triggers that keep the ScreeningListing table in sync
+from sqlalchemy import event, DDL
     
 
 class User(db.Model, UserMixin):
@@ -101,7 +103,7 @@ class User(db.Model, UserMixin):
     # Define an integer column 'id' as the primary key of the User table.
     email = db.Column(db.String(length=80), nullable=False, unique=True)
     # Define a string column 'email' that cannot be null and must be unique.
-    password = db.Column(db.String(length=50), nullable=False)
+    password = db.Column(db.String(length=255), nullable=False)
     # Define a string column 'password' that cannot be null and will store hashed passwords.
     first_name = db.Column(db.String(length=20), nullable=False)
     # Define a string column 'first_name' that cannot be null.
@@ -136,7 +138,7 @@ class Theater(db.Model):
             id (int): An integer column 'id' as the primary key of the User table.
             name (str): A string column 'name' of the theater.
             number_of_seats (int): An integer column 'number_of_seats' that cannot be null.
-            available_movies (str): A string column 'available_movies' that stores movie ids separated by comma.
+            movies (relationship): A many-to-many relationship between the Theater and Movie models through the theater_movie table, the lineup of the theater.
             screenings (relationship): A one-to-many relationship between the Theater and Screening models, where each theater can have multiple screenings.
             screening_location (pseudo column): A backref to the Screening table that allows easy access to the theater where the screening is happening.
 
@@ -149,8 +151,9 @@ class Theater(db.Model):
     # Define a string column 'name' that can be up to 30 characters long.
     number_of_seats = db.Column(db.Integer, nullable=False)
     # Define an integer column 'number_of_seats' that cannot be null.
-    available_movies = db.Column(db.Text)
-    # Define a text column 'available_movies' that can contain multiple movies separated by commas.
+    movies = db.relationship('Movie', secondary='theater_movie', backref='theaters', order_by='Movie.title', lazy=True)
+    # Define a many-to-many relationship between the Theater and Movie models, the movies the theater shows, ordered by title.
+    # Add a pseudo column 'theaters' using backref to the Movie table that allows easy access to the theaters showing the movie.
     screenings = db.relationship('Screening', backref='screening_location', lazy=True)
     # Define a one-to-many relationship between the Theater and Screening models, where each theater can have multiple screenings.
     # Add a pseudo column 'screening_location' using backref to the Screening table that allows easy access to the theater where the screening takes place.
@@ -178,10 +181,11 @@ class Movie(db.Model):
         Attributes:
             id (int): An integer column 'id' as the primary key of the Movie table.
             title (str): A string column 'title' that cannot be null and can be up to 50 characters long.
-            price (int): An integer column 'price' that can be null.
+            price (float): A float column 'price' that can be null, the base ticket price of the movie.
             release_date (date): A date column 'release_date' that cannot be null.
             screenings (relationship): A one-to-many relationship between the Movie and Screening models, where each movie can have multiple screenings.
             available_movies (pseudo column): A backref to the Screening table that allows easy access to the movie being screened.
+            theaters (pseudo column): A backref to the Theater table with the theaters that show the movie.
 
         Methods:
             __repr__(): Returns a string representation of the Movie object.
@@ -190,8 +194,8 @@ class Movie(db.Model):
     # Define an integer column 'id' as the primary key of the Movie table.
     title = db.Column(db.String(50), nullable=False)
     # Define a string column 'title' that cannot be null and can be up to 50 characters long.
-    price = db.Column(db.Integer)
-    # Define an integer column 'price' that can be null.
+    price = db.Column(db.Float)
+    # Define a float column 'price' that can be null, the base ticket price of the movie.
     release_date = db.Column(db.Date, nullable=False)
     # Define a date column 'release_date' that cannot be null.
     screenings = db.relationship('Screening', backref='available_movies', lazy=True)
@@ -210,13 +214,27 @@ class Movie(db.Model):
         return f'<Movie {self.title}>'
 
 
+"""
+The theater_movie table is used to create a many-to-many relationship between Theater and Movie, the lineup of every theater.
+It replaces the comma separated movie titles of theater.csv, so schedules and lookups work with integer ids.
+"""
+theater_movie = db.Table('theater_movie',
+    db.Column('theater_id', db.Integer, db.ForeignKey('theater.id'), primary_key=True),
+    db.Column('movie_id', db.Integer, db.ForeignKey('movie.id'), primary_key=True, index=True)
+    )
+
+
+# A Table object 'theater_movie' is created using db.Table method that has two columns;
+# 'theater_id' and 'movie_id' which are foreign keys referencing 'id' columns of Theater and Movie tables, respectively.
+# The primary key (theater_id, movie_id) finds the movies of a theater, and the index on movie_id finds the theaters showing a movie.
+
 """
 The screening_booking table is used to create a many-to-many relationship between Booking and Screening.
 since bookings can be made multiple times on a screening and a screening can be booked multiple times until seats ran out.
 """
 screening_booking = db.Table('screening_booking',
-    db.Column('screening_id', db.Integer, db.ForeignKey('screening.id')),
-    db.Column('booking_id', db.Integer, db.ForeignKey('booking.id'))
+    db.Column('screening_id', db.Integer, db.ForeignKey('screening.id'), index=True),
+    db.Column('booking_id', db.Integer, db.ForeignKey('booking.id'), index=True)
     )
 
 
@@ -232,11 +250,12 @@ class Screening(db.Model):
 
         Attributes:
             id (int): An integer column 'id' as the primary key of the Screening table.
-            date (datetime): A date column 'date' representing the date of the screening.
+            date (datetime): An indexed date column 'date' representing the date of the screening.
             time (datetime): A time column 'time' representing the time of the screening.
             available_seats (int): An integer column 'available_seats' representing the number of available seats for the screening.
             theater_id (int): A foreign key column 'theater_id' referencing 'id' column of the Theater table.
             movie_id (int): A foreign key column 'movie_id' referencing 'id' column of the Movie table.
+            price (float): A float column 'price' with the ticket price of the screening, computed by pricing.py (null until it is priced).
             bookings (relationship): A many-to-many relationship between the Screening and Booking models, where each screening can have multiple bookings and each booking can be applied to multiple screenings.
 
         Methods:
@@ -244,8 +263,8 @@ class Screening(db.Model):
     """
     id = db.Column(db.Integer, primary_key=True)
     # Define an integer column 'id' as the primary key of the Screening table.
-    date = db.Column(db.Date)
-    # Define a date column 'date' representing the date of the screening.
+    date = db.Column(db.Date, index=True)
+    # Define an indexed date column 'date' representing the date of the screening, so listings can use a range scan.
     time = db.Column(db.Time)
     # Define a time column 'time' representing the time of the screening.
     available_seats = db.Column(db.Integer)
@@ -254,6 +273,8 @@ class Screening(db.Model):
     # Define a foreign key column 'theater_id' referencing 'id' column of the Theater table.
     movie_id = db.Column(db.Integer, db.ForeignKey('movie.id'))
     # Define a foreign key column 'movie_id' referencing 'id' column of the Movie table.
+    price = db.Column(db.Float)
+    # Define a float column 'price' with the ticket price of the screening, computed by pricing.py (null until it is priced).
     bookings = db.relationship('Booking', secondary=screening_booking, backref='screenings', lazy=True)
     # Define a many-to-many relationship between the Screening and Booking models, 
     # where each screening can have multiple bookings and each booking can be applied to multiple screenings.
@@ -271,6 +292,148 @@ class Screening(db.Model):
         return f'<Screening {self.id}>'
 
 
+class ScreeningDate(db.Model):
+    """
+    A class that represents a ScreeningDate model, the index of distinct dates that have screenings.
+
+    The date picker of the currentMovies page reads this small table instead of grouping every screening by date.
+    It is kept up to date by the code that creates screenings.
+
+        Inherits from:
+                db.Model: The base class for all models in Flask SQLAlchemy.
+
+        Attributes:
+            date (date): A date column 'date' as the primary key of the ScreeningDate table.
+
+        Methods:
+            __repr__(): Returns a string representation of the ScreeningDate object.
+    """
+    date = db.Column(db.Date, primary_key=True)
+    # Define a date column 'date' as the primary key, so every date is stored once.
+
+    def __repr__(self):
+        """Return a string representation of the ScreeningDate object.
+
+        This magic method returns a string representation of the ScreeningDate object that can be used for debugging purposes.
+        The returned string contains the date of the ScreeningDate object.
+
+        Returns:
+            str: A string representation of the ScreeningDate object.
+        """
+        return f'<ScreeningDate {self.date}>'
+
+
+class ScreeningListing(db.Model):
+    """
+    A class that represents a ScreeningListing model, a denormalized copy of every screening with its theater and movie details.
+
+    The listing pages read this one table instead of joining Screening, Theater and Movie on every request.
+    It is not written by the application: the database triggers in LISTING_TRIGGERS update it whenever a screening is added,
+    changed or deleted, its seats or price change, or a theater or movie is renamed.
+
+        Inherits from:
+                db.Model: The base class for all models in Flask SQLAlchemy.
+
+        Attributes:
+            screening_id (int): An integer column 'screening_id' as the primary key, the ID of the screening.
+            date (date): A date column 'date' representing the date of the screening.
+            time (time): A time column 'time' representing the time of the screening.
+            available_seats (int): An integer column 'available_seats' with the seats left.
+            theater_id (int): An integer column 'theater_id' with the ID of the theater.
+            theater_name (str): A string column 'theater_name' with the name of the theater.
+            movie_id (int): An integer column 'movie_id' with the ID of the movie.
+            movie_title (str): A string column 'movie_title' with the title of the movie.
+            price (float): A float column 'price' with the ticket price of the screening (the movie's price until the screening is priced).
+
+        Methods:
+            __repr__(): Returns a string representation of the ScreeningListing object.
+    """
+    __tablename__ = 'screening_listing'
+    # One index in the order of the currentMovies page, so a date range is read in page order without sorting
+    __table_args__ = (db.Index('ix_screening_listing_page', 'date', 'theater_name', 'movie_title', 'time'),)
+    screening_id = db.Column(db.Integer, db.ForeignKey('screening.id'), primary_key=True)
+    # Define an integer column 'screening_id' as the primary key, the ID of the screening.
+    date = db.Column(db.Date)
+    # Define a date column 'date' representing the date of the screening.
+    time = db.Column(db.Time)
+    # Define a time column 'time' representing the time of the screening.
+    available_seats = db.Column(db.Integer)
+    # Define an integer column 'available_seats' with the seats left.
+    theater_id = db.Column(db.Integer, db.ForeignKey('theater.id'), index=True)
+    # Define an integer column 'theater_id' with the ID of the theater, indexed for the theater filter.
+    theater_name = db.Column(db.String(150))
+    # Define a string column 'theater_name' with the name of the theater.
+    movie_id = db.Column(db.Integer, db.ForeignKey('movie.id'), index=True)
+    # Define an integer column 'movie_id' with the ID of the movie, indexed for the movie filter.
+    movie_title = db.Column(db.String(150))
+    # Define a string column 'movie_title' with the title of the movie.
+    price = db.Column(db.Float)
+    # Define a float column 'price' with the ticket price of the screening (the movie's price until the screening is priced).
+
+    def __repr__(self):
+        """Return a string representation of the ScreeningListing object.
+
+        This magic method returns a string representation of the ScreeningListing object that can be used for debugging purposes.
+        The returned string contains the screening ID of the ScreeningListing object.
+
+        Returns:
+            str: A string representation of the ScreeningListing object.
+        """
+        return f'<ScreeningListing {self.screening_id}>'
+
+
+# The SELECT that builds the listing row of the screening a trigger fires for ('NEW' is the screening)
+LISTING_ROW = """
+    SELECT NEW.id, NEW.date, NEW.time, NEW.available_seats, NEW.theater_id, theater.name, NEW.movie_id, movie.title, COALESCE(NEW.price, movie.price)
+    FROM theater, movie WHERE theater.id = NEW.theater_id AND movie.id = NEW.movie_id;
+"""
+LISTING_INSERT = ("INSERT OR REPLACE INTO screening_listing "
+                  "(screening_id, date, time, available_seats, theater_id, theater_name, movie_id, movie_title, price)")
+
+# The triggers that keep the screening_listing table in sync with the normalized tables, by name
+LISTING_TRIGGERS = {
+    'screening_listing_insert': f"""
+        CREATE TRIGGER screening_listing_insert AFTER INSERT ON screening BEGIN
+            {LISTING_INSERT} {LISTING_ROW}
+        END""",
+    # Booking only changes the seats, so that update touches a single column
+    'screening_listing_seats': """
+        CREATE TRIGGER screening_listing_seats AFTER UPDATE OF available_seats ON screening BEGIN
+            UPDATE screening_listing SET available_seats = NEW.available_seats WHERE screening_id = NEW.id;
+        END""",
+    # Repricing only changes the price
+    'screening_listing_price': """
+        CREATE TRIGGER screening_listing_price AFTER UPDATE OF price ON screening BEGIN
+            UPDATE screening_listing SET price = COALESCE(NEW.price, (SELECT price FROM movie WHERE id = NEW.movie_id))
+            WHERE screening_id = NEW.id;
+        END""",
+    'screening_listing_update': f"""
+        CREATE TRIGGER screening_listing_update AFTER UPDATE OF id, date, time, theater_id, movie_id ON screening BEGIN
+            DELETE FROM screening_listing WHERE screening_id = OLD.id;
+            {LISTING_INSERT} {LISTING_ROW}
+        END""",
+    'screening_listing_delete': """
+        CREATE TRIGGER screening_listing_delete AFTER DELETE ON screening BEGIN
+            DELETE FROM screening_listing WHERE screening_id = OLD.id;
+        END""",
+    'screening_listing_theater': """
+        CREATE TRIGGER screening_listing_theater AFTER UPDATE OF name ON theater BEGIN
+            UPDATE screening_listing SET theater_name = NEW.name WHERE theater_id = NEW.id;
+        END""",
+    'screening_listing_movie': """
+        CREATE TRIGGER screening_listing_movie AFTER UPDATE OF title, price ON movie BEGIN
+            UPDATE screening_listing SET movie_title = NEW.title,
+                price = COALESCE((SELECT price FROM screening WHERE id = screening_listing.screening_id), NEW.price)
+            WHERE movie_id = NEW.id;
+        END""",
+}
+
+# Create the triggers together with the screening_listing table (in database.db and in every shard file), and drop them with it
+for trigger_name, trigger_sql in LISTING_TRIGGERS.items():
+    event.listen(ScreeningListing.__table__, 'after_create', DDL(trigger_sql))
+    event.listen(ScreeningListing.__table__, 'before_drop', DDL(f"DROP TRIGGER IF EXISTS {trigger_name}"))
+
+
 class Booking(db.Model):
     """
     A class that represents a Booking model.
@@ -283,18 +446,23 @@ class Booking(db.Model):
             number_of_tickets (int): An integer column 'number_of_tickets' that cannot be null and represents the number of tickets for a booking.
             timestamp (DateTime): A datetime column 'timestamp' that cannot be null and represents the date and time of a booking.
             user_id (int): An integer column 'user_id' that references the 'id' column in the User table using foreign key.
+            price (float): A float column 'price' with the price of one ticket when the booking was made.
 
         Methods:
             __repr__(): Returns a string representation of the Booking object.
     """
+    __table_args__ = {'sqlite_autoincrement': True}
+    # Use AUTOINCREMENT, so a transaction ID is never handed out twice, even after old bookings are archived.
     id = db.Column(db.Integer, primary_key=True)
     # Define an integer column 'id' as the primary key of the Booking table.
     number_of_tickets = db.Column(db.Integer, nullable=False)
     # Define an integer column 'number_of_tickets' that cannot be null and represents the number of tickets for a booking.
     timestamp = db.Column(db.DateTime(timezone=True), default=func.now())
     # Define a datetime column 'timestamp' that cannot be null and represents the date and time of a booking.
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
-    # Define an integer column 'user_id' that references the 'id' column in the User table using foreign key.
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
+    # Define an integer column 'user_id' that references the 'id' column in the User table using foreign key, indexed for the booking history.
+    price = db.Column(db.Float)
+    # Define a float column 'price' with the price of one ticket when the booking was made.
 
     def __repr__(self):
         """Return a string representation of the Booking object.
@@ -305,4 +473,124 @@ class Booking(db.Model):
         Returns:
             str: A string representation of the Booking object.
         """
-        return f'<Booking {self.id}>'
\ No newline at end of file
+        return f'<Booking {self.id}>'
+
+class BookingRequest(db.Model):
+    """
+    A class that represents a BookingRequest model, the dedup table for idempotent ticket submissions.
+
+    Every ticket form carries a random idempotency key. The first submission with a key claims a row in this table,
+    so a double-click or a client retry of the same form finds the row and gets the original result back
+    instead of creating a second booking.
+
+        Inherits from:
+                db.Model: The base class for all models in Flask SQLAlchemy.
+
+        Attributes:
+            key (str): A string column 'key' as the primary key of the BookingRequest table, holding the idempotency key of the form.
+            user_id (int): An integer column 'user_id' that references the 'id' column in the User table using foreign key.
+            booking_id (int): An integer column 'booking_id' that references the booking created by the first submission, null while it is still being processed.
+            created (DateTime): A datetime column 'created' representing when the key was first seen, used for TTL eviction.
+
+        Methods:
+            __repr__(): Returns a string representation of the BookingRequest object.
+    """
+    key = db.Column(db.String(64), primary_key=True)
+    # Define a string column 'key' as the primary key, so a repeated key cannot be inserted twice.
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    # Define an integer column 'user_id' that references the 'id' column in the User table using foreign key.
+    booking_id = db.Column(db.Integer, db.ForeignKey('booking.id'))
+    # Define an integer column 'booking_id' that references the booking created for this key.
+    created = db.Column(db.DateTime, nullable=False, index=True)
+    # Define an indexed datetime column 'created' so expired keys can be evicted with a range delete.
+
+    def __repr__(self):
+        """Return a string representation of the BookingRequest object.
+
+        This magic method returns a string representation of the BookingRequest object that can be used for debugging purposes.
+        The returned string contains the key of the BookingRequest object.
+
+        Returns:
+            str: A string representation of the BookingRequest object.
+        """
+        return f'<BookingRequest {self.key}>'
+
+
+class ArchivedBooking(db.Model):
+    """
+    A class that represents an ArchivedBooking model, a booking of a screening that was moved out of the hot tables.
+
+    Archived bookings are stored as one flat row with the screening, theater and movie details copied in,
+    so the booking history stays queryable without keeping old screenings in the Screening table.
+
+        Inherits from:
+                db.Model: The base class for all models in Flask SQLAlchemy.
+
+        Attributes:
+            id (int): An integer column 'id' as the primary key of the ArchivedBooking table, the transaction ID of the booking.
+            user_id (int): An indexed integer column 'user_id' that references the 'id' column in the User table using foreign key.
+            number_of_tickets (int): An integer column 'number_of_tickets' representing the number of tickets for the booking.
+            timestamp (DateTime): A datetime column 'timestamp' representing the date and time of the booking.
+            screening_id (int): An integer column 'screening_id' with the ID the screening had before it was archived.
+            date (date): A date column 'date' representing the date of the screening.
+            time (time): A time column 'time' representing the time of the screening.
+            theater_name (str): A string column 'theater_name' with the name of the theater.
+            movie_title (str): A string column 'movie_title' with the title of the movie.
+            price (float): A float column 'price' with the ticket price of the movie.
+
+        Methods:
+            __repr__(): Returns a string representation of the ArchivedBooking object.
+    """
+    __tablename__ = 'booking_archive'
+    id = db.Column(db.Integer, primary_key=True)
+    # Define an integer column 'id' as the primary key, keeping the transaction ID of the booking.
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
+    # Define an indexed integer column 'user_id', so the booking page can look up a user's archived bookings.
+    number_of_tickets = db.Column(db.Integer, nullable=False)
+    # Define an integer column 'number_of_tickets' that cannot be null.
+    timestamp = db.Column(db.DateTime)
+    # Define a datetime column 'timestamp' representing the date and time of the booking.
+    screening_id = db.Column(db.Integer)
+    # Define an integer column 'screening_id' with the ID the screening had before it was archived.
+    date = db.Column(db.Date)
+    # Define a date column 'date' representing the date of the screening.
+    time = db.Column(db.Time)
+    # Define a time column 'time' representing the time of the screening.
+    theater_name = db.Column(db.String(30))
+    # Define a string column 'theater_name' copied from the Theater table.
+    movie_title = db.Column(db.String(50))
+    # Define a string column 'movie_title' copied from the Movie table.
+    price = db.Column(db.Float)
+    # Define a float column 'price' copied from the Movie table.
+
+    def __repr__(self):
+        """Return a string representation of the ArchivedBooking object.
+
+        This magic method returns a string representation of the ArchivedBooking object that can be used for debugging purposes.
+        The returned string contains the id of the ArchivedBooking object.
+
+        Returns:
+            str: A string representation of the ArchivedBooking object.
+        """
+        return f'<ArchivedBooking {self.id}>'
+
+
+class SchemaVersion(db.Model):
+    """
+    A class that represents a SchemaVersion model, the list of schema migrations applied to the database.
+
+        Inherits from:
+                db.Model: The base class for all models in Flask SQLAlchemy.
+
+        Attributes:
+            version (int): An integer column 'version' as the primary key, the number of the migration.
+            description (str): A string column 'description' describing the migration.
+            applied_at (DateTime): A datetime column 'applied_at' with the date and time the migration was applied.
+    """
+    __tablename__ = 'schema_version'
+    version = db.Column(db.Integer, primary_key=True)
+    # Define an integer column 'version' as the primary key, the number of the migration.
+    description = db.Column(db.String(200))
+    # Define a string column 'description' describing the migration.
+    applied_at = db.Column(db.DateTime)
+    # Define a datetime column 'applied_at' with the date and time the migration was applied.
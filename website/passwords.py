@@ -0,0 +1,103 @@
+"""
+The purpose of passwords.py is to hash and check passwords with one configurable policy.
+
+The PASSWORD_HASH_METHOD setting chooses the algorithm and its cost in werkzeug's notation,
+for example 'scrypt:32768:8:1' or 'pbkdf2:sha256:600000'. A higher cost is safer against stolen hashes
+but makes every login use more CPU, so the setting can be tuned with 'flask password-benchmark'.
+
+Changing the setting does not break existing accounts. Every stored hash names the method it was made with,
+so old hashes are still checked with their own method, and after a successful login the password is hashed again
+with the current policy (in the database and in user.csv). The accounts in user.csv were created with an older
+werkzeug that wrote 'sha256$salt$hash' (an HMAC-SHA256 of the password keyed with the salt); those are checked here as well.
+"""
+# Import the functions that hash and check passwords in werkzeug's format
+from werkzeug.security import generate_password_hash, check_password_hash
+# Import current_app to read the settings
+from flask import current_app
+# Import the modules used to check the hashes of older werkzeug versions
+import hashlib
+import hmac
+
+
+class PasswordPolicy:
+    """
+    A class that represents how passwords are hashed.
+
+        Attributes:
+            method (str): The werkzeug hash method with its cost, for example 'scrypt:32768:8:1'.
+            salt_length (int): The number of characters of the random salt.
+    """
+
+    def __init__(self, method, salt_length=16):
+        self.method = method
+        self.salt_length = salt_length
+        self._prefix = None
+
+    def hash(self, password):
+        """
+        Hash a password with the policy.
+
+        Args:
+            password (str): The plain text password.
+
+        Returns:
+            str: The hash in the 'method$salt$hash' format.
+        """
+        return generate_password_hash(password, method=self.method, salt_length=self.salt_length)
+
+    def verify(self, stored, password):
+        """
+        Check a password against a stored hash, whatever method the hash was made with.
+
+        Args:
+            stored (str): The stored hash.
+            password (str): The plain text password.
+
+        Returns:
+            bool: True if the password matches.
+        """
+        if stored.count('$') != 2:
+            return False
+        method, salt, expected = stored.split('$')
+        # Hashes of werkzeug before 2.3 name only the hash function and are an HMAC keyed with the salt
+        if method in hashlib.algorithms_guaranteed:
+            actual = hmac.new(salt.encode(), password.encode(), method).hexdigest()
+            return hmac.compare_digest(actual, expected)
+        try:
+            return check_password_hash(stored, password)
+        except ValueError:
+            # An unknown method can never match
+            return False
+
+    def needs_rehash(self, stored):
+        """
+        Check if a stored hash was made with another method or cost than the policy.
+
+        Args:
+            stored (str): The stored hash.
+
+        Returns:
+            bool: True if the password should be hashed again with the policy.
+        """
+        if self._prefix is None:
+            # werkzeug writes the full method with its default cost (for example 'scrypt' becomes 'scrypt:32768:8:1'),
+            # so hash once to learn the exact prefix the policy writes
+            self._prefix = self.hash('').split('$', 1)[0]
+        return stored.split('$', 1)[0] != self._prefix
+
+
+def password_policy(app=None):
+    """
+    Return the password policy of the application, creating it on first use.
+
+    Args:
+        app (Flask or None): Flask application object, the current application if None.
+
+    Returns:
+        PasswordPolicy: The policy built from the PASSWORD_HASH_METHOD and PASSWORD_SALT_LENGTH settings.
+    """
+    app = app or current_app._get_current_object()
+    if 'password_policy' not in app.extensions:
+        app.extensions.setdefault('password_policy', PasswordPolicy(app.config['PASSWORD_HASH_METHOD'],
+                                                                    app.config['PASSWORD_SALT_LENGTH']))
+    return app.extensions['password_policy']
@@ -0,0 +1,184 @@
+"""
+The purpose of pricing.py is to compute the ticket price of every screening and store it with the screening.
+
+Every movie has one base price. When the DYNAMIC_PRICING setting is True, the price of a screening is the base price
+times three multipliers from the PRICING_RULES setting:
+    - how full the screening is (occupancy = seats taken / seats of the theater), so the last seats cost more,
+    - the hour the screening starts, so matinees are cheaper than evening screenings,
+    - the day of the week, so weekend screenings cost more than weekday ones.
+The result is rounded to cents and never lower than the 'minimum_price' rule. When DYNAMIC_PRICING is False, every screening costs the base price.
+
+The pages never evaluate the rules. reprice_screenings() prices a whole batch of screenings at once, column by column
+with lookup tables, and writes the prices that changed into Screening.price with one UPDATE statement;
+the triggers of the screening_listing table copy them into the listing, which the currentMovies and ticket pages read.
+It runs inside every booking transaction for the screenings whose seats changed (the whole micro-batch with group commit),
+on startup for every screening, and with 'flask reprice-screenings' after the rules or the movie prices were changed.
+Every booking keeps the price its tickets were sold for in Booking.price.
+"""
+# Import the 'db' object located in __init__.py from the current package (website) for database operations
+from . import db
+# Imports the models from the current package, which define the database tables and their relationships
+from .models import Screening, Theater, Movie
+# Import the router, so repricing also covers screenings split across shard files
+from .sharding import data_sessions
+# Import click and with_appcontext to define the command line interface
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+# Import bisect to find the tier of a value in a sorted list of tier starts
+from bisect import bisect_right
+
+# Write the new prices with one executemany statement (the bind names differ from the column names, as UPDATE requires)
+REPRICE_SQL = (Screening.__table__.update()
+               .where(Screening.__table__.c.id == db.bindparam('screening_id'))
+               .values(price=db.bindparam('new_price')))
+
+# Give every booking without a price the base price of the booked movie (bookings loaded from booking.csv have none)
+FILL_BOOKING_PRICES_SQL = """
+    UPDATE booking SET price = (
+        SELECT movie.price FROM screening_booking
+        JOIN screening ON screening.id = screening_booking.screening_id
+        JOIN movie ON movie.id = screening.movie_id
+        WHERE screening_booking.booking_id = booking.id)
+    WHERE price IS NULL
+"""
+
+
+class PricingRules:
+    """
+    A class that holds the pricing rules as lookup tables, so a batch of screenings is priced with a few list lookups each.
+
+        Attributes:
+            dynamic (bool): False if every screening costs the base price of its movie.
+            occupancy_starts (list): The lowest occupancy of every occupancy tier, in increasing order.
+            occupancy_multipliers (list): The multiplier of every occupancy tier.
+            hour_multipliers (list): The multiplier of every hour of the day, 0 to 23.
+            weekday_multipliers (list): The multiplier of every day of the week, Monday first.
+            minimum_price (float): The lowest price of a ticket.
+    """
+
+    def __init__(self, dynamic, rules):
+        """
+        Turn the PRICING_RULES setting into lookup tables.
+
+        Args:
+            dynamic (bool): The DYNAMIC_PRICING setting.
+            rules (dict): The PRICING_RULES setting.
+        """
+        self.dynamic = dynamic
+        occupancy = sorted(rules['occupancy'])
+        self.occupancy_starts = [start for start, _ in occupancy]
+        self.occupancy_multipliers = [multiplier for _, multiplier in occupancy]
+        # Expand the hour tiers into one multiplier per hour, so a screening needs a single lookup
+        hours = sorted(rules['hours'])
+        starts = [start for start, _ in hours]
+        self.hour_multipliers = [hours[bisect_right(starts, hour) - 1][1] if hour >= starts[0] else 1.0 for hour in range(24)]
+        self.weekday_multipliers = list(rules['weekdays'])
+        self.minimum_price = rules['minimum_price']
+
+    def occupancy_multiplier(self, occupancy):
+        """
+        Return the multiplier of the occupancy tier a screening has reached.
+
+        Args:
+            occupancy (float): The fraction of the theater's seats that are taken.
+
+        Returns:
+            float: The multiplier, 1.0 below the lowest tier.
+        """
+        tier = bisect_right(self.occupancy_starts, occupancy) - 1
+        return self.occupancy_multipliers[tier] if tier >= 0 else 1.0
+
+    def prices(self, base_prices, seats_left, capacities, weekdays, hours):
+        """
+        Compute the prices of a batch of screenings, given as columns of the same length.
+
+        Args:
+            base_prices (list): The base price of the movie of every screening (None if the movie has no price).
+            seats_left (list): The available seats of every screening.
+            capacities (list): The number of seats of the theater of every screening.
+            weekdays (list): The day of the week of every screening, 0 for Monday.
+            hours (list): The hour every screening starts.
+
+        Returns:
+            list: The price of every screening, None where the movie has no price.
+        """
+        if not self.dynamic:
+            return [float(base) if base is not None else None for base in base_prices]
+        # One pass per rule over the whole batch, then one pass to combine them
+        occupancy = [self.occupancy_multiplier(1 - left / capacity if capacity else 0.0)
+                     for left, capacity in zip(seats_left, capacities)]
+        time_of_day = [self.hour_multipliers[hour] for hour in hours]
+        day_of_week = [self.weekday_multipliers[weekday] for weekday in weekdays]
+        return [max(self.minimum_price, round(base * o * t * d, 2)) if base is not None else None
+                for base, o, t, d in zip(base_prices, occupancy, time_of_day, day_of_week)]
+
+
+def pricing_rules():
+    """
+    Return the pricing rules of the current application.
+
+    Returns:
+        PricingRules: The rules of the DYNAMIC_PRICING and PRICING_RULES settings.
+    """
+    return PricingRules(current_app.config['DYNAMIC_PRICING'], current_app.config['PRICING_RULES'])
+
+
+def reprice_screenings(session, screening_ids=None):
+    """
+    Compute the prices of screenings again and store the ones that changed, inside the caller's transaction.
+
+    Args:
+        session (Session): The session of the database file that stores the screenings.
+        screening_ids (iterable or None): The IDs of the screenings to price, or None for every screening of the database file.
+
+    Returns:
+        int: The number of screenings whose price changed.
+    """
+    query = (session.query(Screening.id, Screening.date, Screening.time, Screening.available_seats, Screening.price,
+                           Theater.number_of_seats, Movie.price)
+             .join(Theater, Theater.id == Screening.theater_id)
+             .join(Movie, Movie.id == Screening.movie_id))
+    if screening_ids is not None:
+        screening_ids = list(screening_ids)
+        if not screening_ids:
+            return 0
+        query = query.filter(Screening.id.in_(screening_ids))
+    rows = query.all()
+    if not rows:
+        return 0
+    ids, dates, times, seats_left, current_prices, capacities, base_prices = zip(*rows)
+    prices = pricing_rules().prices(base_prices, seats_left, capacities,
+                                    [day.weekday() for day in dates], [show_time.hour for show_time in times])
+    # Only write the prices that changed, so the listing triggers fire for those screenings only
+    changed = [{'screening_id': screening_id, 'new_price': price}
+               for screening_id, current, price in zip(ids, current_prices, prices) if current != price]
+    if changed:
+        session.execute(REPRICE_SQL, changed)
+    return len(changed)
+
+
+def fill_booking_prices(session):
+    """
+    Give the bookings that have no ticket price the base price of their movie, inside the caller's transaction.
+
+    Args:
+        session (Session): The session of the database file that stores the bookings.
+
+    Returns:
+        None
+    """
+    session.execute(db.text(FILL_BOOKING_PRICES_SQL))
+
+
+@click.command('reprice-screenings')
+@with_appcontext
+def reprice_screenings_command():
+    """
+    Compute the price of every screening again, for example after changing PRICING_RULES or a movie's price.
+    """
+    changed = 0
+    for session in data_sessions():
+        changed += reprice_screenings(session)
+        session.commit()
+    click.echo(f"{changed} screening prices changed.")
@@ -0,0 +1,254 @@
+"""
+The purpose of querybudget.py is to catch pages that start sending more SQL statements than they should.
+
+A small template or relationship change, for example reading 'booking.screenings' or 'user.bookings' (which load lazily)
+inside a loop, can turn a page into one query per row (the N+1 problem) without anything failing.
+count_queries() records every statement sent to the database through SQLAlchemy's engine events,
+and 'flask check-query-budgets' builds a large synthetic dataset in a temporary database, requests every page once
+and fails, listing the statements, when a page sends more statements than its budget in the QUERY_BUDGETS setting.
+The budget of a page does not depend on the size of the data, so a page that goes over it with a large dataset has an N+1 query.
+"""
+# Import the 'db' object located in __init__.py from the current package (website) for database operations
+from . import db
+# Imports the models from the current package, which define the database tables and their relationships
+from .models import User, Theater, Movie, Screening, Booking, screening_booking, theater_movie
+# Import the function that records the schema version of a new database
+from .migrations import stamp_latest_version
+# Import the password policy, used to create the synthetic user
+from .passwords import PasswordPolicy
+# Import the random keys of the ticket forms, also used to make unique emails for the registrations
+from .idempotency import new_idempotency_key
+# Import the event API to listen to the statements sent by the engines
+from sqlalchemy import event
+# Import click and with_appcontext to define the command line interface
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+# Import the modules used to build the dataset and summarize the statements
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, date, time, timedelta
+import os
+import tempfile
+import threading
+
+# The password of the synthetic user
+BUDGET_PASSWORD = 'budget-password'
+
+# The request made for every route, as (budget name, method, path, logged in, form data).
+# The budget name is the endpoint of the route, with a suffix for a second kind of request to the same route.
+# The form data is a function of the synthetic dataset, so the requests hit real screenings. It is built again for every
+# request, so every booking gets a new idempotency key and every registration a new email.
+BUDGET_REQUESTS = [
+    ('views.home', 'GET', '/', True, None),
+    ('views.theater', 'GET', '/theater', True, None),
+    ('views.movies', 'GET', '/currentMovies', True, None),
+    ('views.movies', 'POST', '/currentMovies', True,
+     lambda dataset: {'start_date': str(dataset['start']), 'end_date': str(dataset['end'])}),
+    ('views.ticket', 'POST', '/getTicket', True,
+     lambda dataset: {'screening_id': dataset['screening_id'], 'theater_id': dataset['theater_id']}),
+    ('views.ticket.book', 'POST', '/getTicket', True,
+     lambda dataset: {'number_of_ticket': 1, 'booked_screening': dataset['screening_id'], 'booked_theater': dataset['theater_id'],
+                      'idempotency_key': new_idempotency_key()}),
+    ('views.group_ticket', 'POST', '/groupTicket', True, lambda dataset: {'screening_ids': dataset['group_selection']}),
+    ('views.booking', 'GET', '/myBooking', True, None),
+    ('auth.login', 'GET', '/login', False, None),
+    ('auth.login', 'POST', '/login', False, lambda dataset: {'email': dataset['email'], 'password': 'not-the-password'}),
+    ('auth.login.success', 'POST', '/login', False, lambda dataset: {'email': dataset['email'], 'password': dataset['password']}),
+    ('auth.register', 'GET', '/register', False, None),
+    ('auth.register.submit', 'POST', '/register', False,
+     lambda dataset: {'email': f"{new_idempotency_key()}@benchmark.invalid", 'firstName': 'Query', 'lastName': 'Budget',
+                      'password1': dataset['password'], 'password2': dataset['password']}),
+]
+
+
+class QueryLog:
+    """
+    A class that collects the SQL statements sent while it is active.
+
+        Attributes:
+            statements (list): The SQL text of every statement, in the order they were sent.
+    """
+
+    def __init__(self):
+        self.statements = []
+        self._lock = threading.Lock()
+
+    def record(self, conn, cursor, statement, parameters, context, executemany):
+        """
+        Record one statement. Registered as the 'before_cursor_execute' event of the engines.
+        """
+        with self._lock:
+            self.statements.append(statement)
+
+    @property
+    def count(self):
+        """
+        Return the number of statements that were sent.
+
+        Returns:
+            int: The number of statements.
+        """
+        return len(self.statements)
+
+    def summary(self, limit=10):
+        """
+        Describe the statements that were sent most often, which is where an N+1 query shows up.
+
+        Args:
+            limit (int): The largest number of different statements to describe.
+
+        Returns:
+            list: Lines of the form '<times> x <statement>'.
+        """
+        counts = Counter(' '.join(statement.split()) for statement in self.statements)
+        return [f"{times} x {statement}" for statement, times in counts.most_common(limit)]
+
+
+@contextmanager
+def count_queries():
+    """
+    Record the statements sent by every engine of the current application while the 'with' block runs.
+
+    Returns:
+        QueryLog: The log of the statements, filled while the block runs.
+    """
+    log = QueryLog()
+    engines = list(db.engines.values())
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', log.record)
+    try:
+        yield log
+    finally:
+        for engine in engines:
+            event.remove(engine, 'before_cursor_execute', log.record)
+
+
+def build_budget_dataset(theaters, movies, days, shows, bookings):
+    """
+    Fill an empty database with a synthetic cinema: every theater shows every movie a few times a day.
+
+    Args:
+        theaters (int): The number of theaters.
+        movies (int): The number of movies.
+        days (int): The number of days with screenings, starting today.
+        shows (int): The number of screenings per theater, movie and day.
+        bookings (int): The number of bookings of the synthetic user, spread over the screenings.
+
+    Returns:
+        dict: The facts the budget requests need: the user's 'email', 'password' and 'user_id', the listed 'start' and 'end' dates,
+            a 'screening_id' with its 'theater_id', and a 'group_selection' of screenings chosen for a group booking.
+    """
+    db.create_all(bind_key=None)
+    stamp_latest_version()
+    # A cheap hash method, the dataset does not need a secure password
+    password = PasswordPolicy('pbkdf2:sha256:1000').hash(BUDGET_PASSWORD)
+    user = User(email='budget@benchmark.invalid', first_name='Query', last_name='Budget', password=password)
+    db.session.add(user)
+    db.session.flush()
+
+    movie_titles = [f"Movie {number}" for number in range(1, movies + 1)]
+    db.session.execute(Movie.__table__.insert(), [
+        {'id': number, 'title': title, 'price': 10 + number % 5, 'release_date': date(2020, 1, 1)}
+        for number, title in enumerate(movie_titles, start=1)])
+    db.session.execute(Theater.__table__.insert(), [
+        {'id': number, 'name': f"Theater {number}", 'number_of_seats': 200} for number in range(1, theaters + 1)])
+    db.session.execute(theater_movie.insert(), [
+        {'theater_id': theater_id, 'movie_id': movie_id}
+        for theater_id in range(1, theaters + 1) for movie_id in range(1, movies + 1)])
+
+    start = date.today()
+    screening_rows = []
+    for day in range(days):
+        for theater_id in range(1, theaters + 1):
+            for movie_id in range(1, movies + 1):
+                for show in range(shows):
+                    screening_rows.append({'id': len(screening_rows) + 1, 'date': start + timedelta(days=day),
+                                           'time': time(10 + (show * 3) % 14, 0), 'available_seats': 200,
+                                           'theater_id': theater_id, 'movie_id': movie_id})
+    db.session.execute(Screening.__table__.insert(), screening_rows)
+    db.session.execute(db.text("INSERT INTO screening_date (date) SELECT DISTINCT date FROM screening"))
+
+    # Spread the bookings over the screenings, so the booking history joins many different screenings
+    step = max(1, len(screening_rows) // max(1, bookings))
+    db.session.execute(Booking.__table__.insert(), [
+        {'id': number, 'number_of_tickets': 2, 'timestamp': datetime(2020, 1, 1), 'user_id': user.id, 'price': 10.0}
+        for number in range(1, bookings + 1)])
+    db.session.execute(screening_booking.insert(), [
+        {'screening_id': screening_rows[(number * step) % len(screening_rows)]['id'], 'booking_id': number}
+        for number in range(1, bookings + 1)])
+    db.session.commit()
+    return {'email': user.email, 'password': BUDGET_PASSWORD, 'user_id': user.id, 'start': start,
+            'end': start + timedelta(days=min(days, current_app.config['MAX_LISTING_DAYS']) - 1),
+            'screening_id': screening_rows[0]['id'], 'theater_id': screening_rows[0]['theater_id'],
+            'group_selection': [f"{row['theater_id']}:{row['id']}" for row in screening_rows[:5]]}
+
+
+def measure_route_queries(app, dataset):
+    """
+    Request every route of BUDGET_REQUESTS once and record the statements each request sends.
+
+    Args:
+        app (Flask): Flask application object with the synthetic dataset.
+        dataset (dict): The facts returned by build_budget_dataset.
+
+    Returns:
+        list: (budget name, method, path, status code, QueryLog) tuples, one per request.
+    """
+    results = []
+    for name, method, path, logged_in, form in BUDGET_REQUESTS:
+        client = app.test_client()
+        if logged_in:
+            with client.session_transaction() as session:
+                session['_user_id'] = str(dataset['user_id'])
+                session['_fresh'] = True
+        with app.app_context():
+            with count_queries() as log:
+                response = client.open(path, method=method, data=form(dataset) if form else None)
+        results.append((name, method, path, response.status_code, log))
+    return results
+
+
+@click.command('check-query-budgets')
+@click.option('--theaters', default=20, show_default=True, help='Number of theaters in the synthetic dataset.')
+@click.option('--movies', default=10, show_default=True, help='Number of movies in the synthetic dataset.')
+@click.option('--days', default=14, show_default=True, help='Number of days with screenings.')
+@click.option('--shows', default=4, show_default=True, help='Number of screenings per theater, movie and day.')
+@click.option('--bookings', default=500, show_default=True, help='Number of bookings of the synthetic user.')
+@with_appcontext
+def check_query_budgets_command(theaters, movies, days, shows, bookings):
+    """
+    Check that every page sends no more SQL statements than its budget, on a large synthetic dataset.
+    """
+    from . import create_app
+    if current_app.config['SHARD_COUNT'] > 1:
+        raise click.ClickException("The check uses a temporary database; run it with SHARD_COUNT set to 0.")
+    budgets = current_app.config['QUERY_BUDGETS']
+    with tempfile.TemporaryDirectory() as folder:
+        # A separate application on a temporary database and csv folder, so the real database and the csv files are not touched
+        # by the bookings and registrations
+        app = create_app(lazy_init=True, database_uri=f"sqlite:///{os.path.join(folder, 'budget.db')}", csv_folder=folder)
+        app.config['RATE_LIMITS'] = {}
+        with app.app_context():
+            dataset = build_budget_dataset(theaters, movies, days, shows, bookings)
+            click.echo(f"Synthetic dataset: {Screening.query.count()} screenings, {bookings} bookings.")
+        # The data is loaded, so the lazy initialization must not load the csv files on the first request
+        app.extensions['cinema3000_initialized'] = True
+        results = measure_route_queries(app, dataset)
+        with app.app_context():
+            db.engine.dispose()
+
+    over_budget = []
+    for name, method, path, status, log in results:
+        budget = budgets.get(name)
+        verdict = "no budget" if budget is None else ("ok" if log.count <= budget else "OVER BUDGET")
+        click.echo(f"{method:<5} {path:<16} {status}  {log.count:3} statements (budget {budget})  {verdict}")
+        if budget is not None and log.count > budget:
+            over_budget.append((method, path, budget, log))
+    for method, path, budget, log in over_budget:
+        click.echo(f"\n{method} {path} sent {log.count} statements, the budget is {budget}. Most frequent statements:")
+        for line in log.summary():
+            click.echo(f"  {line}")
+    if over_budget:
+        raise click.ClickException(f"{len(over_budget)} requests are over their query budget.")
+    click.echo("Every page is within its query budget.")
@@ -0,0 +1,263 @@
+"""
+The purpose of queryprofiler.py is to find out which SQL statement makes a page slow.
+
+When SLOW_QUERY_LOG is True, every statement sent to the database is timed through SQLAlchemy's engine events.
+A statement that takes longer than SLOW_QUERY_THRESHOLD_MS is written as one JSON line to a rotating log file
+in the instance folder, together with:
+    - its bound parameters (hidden for statements that touch passwords),
+    - the route and HTTP method of the request that sent it,
+    - SQLite's EXPLAIN QUERY PLAN, which shows for example whether a table was scanned instead of searched with an index,
+    - a fingerprint: the statement with its numbers, strings and IN lists replaced by '?', so the same query with
+      different values is counted together.
+'flask slow-queries' reads the log and ranks the fingerprints by the total time they took.
+"""
+# Import functions from the Flask framework to find the request that sent a statement
+from flask import current_app, has_request_context, request
+from flask.cli import with_appcontext
+# Import the event API to time the statements sent by the engines
+from sqlalchemy import event
+# Import the modules used to write and rotate the log
+import logging
+from logging.handlers import RotatingFileHandler
+# Import the modules used to build and read the log records
+import click
+import json
+import os
+import re
+import sqlite3
+import time
+from datetime import datetime
+
+# The name of the logger the slow statements are written to
+SLOW_QUERY_LOGGER = 'website.slow_queries'
+
+# The patterns replaced by '?' to build the fingerprint of a statement
+FINGERPRINT_PATTERNS = [
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'\bIN\s*\(\s*(?:\?|\[POSTCOMPILE_\w+\])(?:\s*,\s*\?)*\s*\)', re.IGNORECASE), 'IN (...)'),
+    (re.compile(r'\s+'), ' '),
+]
+
+
+def fingerprint(statement):
+    """
+    Return the fingerprint of a statement, the same for every run of the query whatever its values.
+
+    Args:
+        statement (str): The SQL statement.
+
+    Returns:
+        str: The statement with its literal values and IN lists replaced by placeholders.
+    """
+    for pattern, replacement in FINGERPRINT_PATTERNS:
+        statement = pattern.sub(replacement, statement)
+    return statement.strip()
+
+
+def explain_query_plan(connection, statement, parameters):
+    """
+    Ask SQLite how it runs a statement, without running it.
+
+    Args:
+        connection (Connection): The SQLAlchemy connection the statement was sent on.
+        statement (str): The SQL statement.
+        parameters (tuple or dict): The bound parameters of the statement.
+
+    Returns:
+        list or None: The 'detail' column of every step of the plan, or None if there is no plan.
+    """
+    if connection.dialect.name != 'sqlite':
+        return None
+    try:
+        cursor = connection.connection.dbapi_connection.cursor()
+        try:
+            cursor.execute('EXPLAIN QUERY PLAN ' + statement, parameters)
+            return [row[-1] for row in cursor.fetchall()]
+        finally:
+            cursor.close()
+    except sqlite3.Error:
+        # Statements such as BEGIN or PRAGMA have no query plan
+        return None
+
+
+def format_parameters(statement, parameters):
+    """
+    Return the bound parameters of a statement as they are written into the log.
+
+    Args:
+        statement (str): The SQL statement.
+        parameters (tuple, dict or list): The bound parameters.
+
+    Returns:
+        str: The parameters, hidden if the statement touches passwords, and at most 500 characters long.
+    """
+    if 'password' in statement.lower():
+        return '[hidden]'
+    text = repr(parameters)
+    return text if len(text) <= 500 else text[:500] + '...'
+
+
+class QueryProfiler:
+    """
+    A class that times the statements of the engines and logs the slow ones.
+
+        Attributes:
+            threshold (float): The number of seconds above which a statement is logged.
+            logger (Logger): The logger that writes the rotating log file.
+    """
+
+    def __init__(self, threshold_ms, logger):
+        self.threshold = threshold_ms / 1000
+        self.logger = logger
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        """
+        Remember when the statement started. Registered as the 'before_cursor_execute' event of the engines.
+        """
+        # Every connection is used by one thread at a time, so a stack in its info dictionary is enough
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        """
+        Log the statement if it was slow. Registered as the 'after_cursor_execute' event of the engines.
+        """
+        elapsed = time.perf_counter() - conn.info['query_started'].pop()
+        if elapsed < self.threshold:
+            return
+        record = {
+            'time': datetime.now().isoformat(timespec='seconds'),
+            'duration_ms': round(elapsed * 1000, 3),
+            'route': request.endpoint if has_request_context() else None,
+            'method': request.method if has_request_context() else None,
+            'statement': statement,
+            'parameters': format_parameters(statement, parameters),
+            'rows': len(parameters) if executemany else None,
+            'fingerprint': fingerprint(statement),
+            # A statement sent for many rows at once has no single set of parameters to explain
+            'plan': None if executemany else explain_query_plan(conn, statement, parameters),
+        }
+        self.logger.info(json.dumps(record, default=str))
+
+    def install(self, engine):
+        """
+        Start timing the statements of an engine.
+
+        Args:
+            engine (Engine): The SQLAlchemy engine.
+
+        Returns:
+            None
+        """
+        event.listen(engine, 'before_cursor_execute', self.before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self.after_cursor_execute)
+
+
+def slow_query_log_path(app):
+    """
+    Return the path of the slow query log.
+
+    Args:
+        app (Flask): Flask application object
+
+    Returns:
+        str: The SLOW_QUERY_LOG_FILE setting, relative to the instance folder.
+    """
+    return os.path.join(app.instance_path, app.config['SLOW_QUERY_LOG_FILE'])
+
+
+def install_query_profiler(app, engines):
+    """
+    Log the slow statements of the application's engines into the rotating slow query log.
+
+    Args:
+        app (Flask): Flask application object
+        engines (list): The SQLAlchemy engines of the application (the main database and the shards).
+
+    Returns:
+        QueryProfiler: The profiler.
+    """
+    os.makedirs(app.instance_path, exist_ok=True)
+    logger = logging.getLogger(SLOW_QUERY_LOGGER)
+    logger.setLevel(logging.INFO)
+    # The slow statements only go to their own file, not to the console
+    logger.propagate = False
+    path = slow_query_log_path(app)
+    if not any(getattr(handler, 'baseFilename', None) == path for handler in logger.handlers):
+        logger.addHandler(RotatingFileHandler(path, maxBytes=app.config['SLOW_QUERY_LOG_MAX_BYTES'],
+                                              backupCount=app.config['SLOW_QUERY_LOG_BACKUPS']))
+    profiler = app.extensions.setdefault('query_profiler', QueryProfiler(app.config['SLOW_QUERY_THRESHOLD_MS'], logger))
+    for engine in engines:
+        profiler.install(engine)
+    return profiler
+
+
+def read_slow_queries(path, backups):
+    """
+    Read the records of the slow query log and its rotated files, oldest first.
+
+    Args:
+        path (str): The path of the slow query log.
+        backups (int): The number of rotated files ('<path>.1' is the newest of them).
+
+    Returns:
+        list: The records as dictionaries.
+    """
+    records = []
+    for name in [f"{path}.{number}" for number in range(backups, 0, -1)] + [path]:
+        if not os.path.exists(name):
+            continue
+        with open(name) as file:
+            for line in file:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # A line cut off by a crash is skipped
+                    continue
+    return records
+
+
+def summarize_slow_queries(records):
+    """
+    Group the records by fingerprint and rank the groups by their total time.
+
+    Args:
+        records (list): The records of the slow query log.
+
+    Returns:
+        list: One dictionary per fingerprint with 'fingerprint', 'count', 'total_ms', 'max_ms', 'routes' and the latest 'plan',
+            ordered by total time, slowest first.
+    """
+    groups = {}
+    for record in records:
+        group = groups.setdefault(record['fingerprint'], {'fingerprint': record['fingerprint'], 'count': 0,
+                                                          'total_ms': 0.0, 'max_ms': 0.0, 'routes': set(), 'plan': None})
+        group['count'] += 1
+        group['total_ms'] += record['duration_ms']
+        group['max_ms'] = max(group['max_ms'], record['duration_ms'])
+        group['routes'].add(record['route'] or '(no request)')
+        group['plan'] = record['plan'] or group['plan']
+    return sorted(groups.values(), key=lambda group: group['total_ms'], reverse=True)
+
+
+@click.command('slow-queries')
+@click.option('--limit', default=10, show_default=True, help='Number of query fingerprints to show.')
+@with_appcontext
+def slow_queries_command(limit):
+    """
+    Rank the statements of the slow query log by the total time they took.
+    """
+    app = current_app._get_current_object()
+    path = slow_query_log_path(app)
+    records = read_slow_queries(path, app.config['SLOW_QUERY_LOG_BACKUPS'])
+    if not records:
+        click.echo(f"No slow queries logged in {path}. Set SLOW_QUERY_LOG to True to record them.")
+        return
+    click.echo(f"{len(records)} slow statements logged in {path} and its rotated files:")
+    for rank, group in enumerate(summarize_slow_queries(records)[:limit], start=1):
+        click.echo(f"\n{rank}. total {group['total_ms']:.1f} ms, {group['count']} times, "
+                   f"mean {group['total_ms'] / group['count']:.1f} ms, max {group['max_ms']:.1f} ms, "
+                   f"routes: {', '.join(sorted(group['routes']))}")
+        click.echo(f"   {group['fingerprint'][:300]}")
+        for step in group['plan'] or []:
+            click.echo(f"   plan: {step}")
@@ -0,0 +1,120 @@
+"""
+The purpose of ratelimit.py is to limit how often the login and register forms can be submitted.
+
+Checking a password hash (login) and creating one (register) are slow on purpose, so a script that floods these forms
+keeps the CPU busy and slows down everybody who is booking tickets. Every limited route gets token buckets:
+    - one bucket per client IP address and, for forms with an email field, one bucket per email,
+    - a bucket holds at most 'burst' tokens and refills 'per_minute' tokens every minute,
+    - every submission takes one token from each of its buckets; with an empty bucket the request is turned away
+      with 429 Too Many Requests before any password hashing or database work happens.
+The buckets are kept in memory as (tokens, time) pairs in a least recently used (LRU) order,
+so at most RATE_LIMIT_MAX_KEYS buckets per route and key type exist and the oldest idle ones are dropped first.
+The limits of each route are set in the RATE_LIMITS setting.
+"""
+# Import functions from the Flask framework to read the request and build the rejection
+from flask import current_app, request, make_response
+# Import wraps to keep the name of the decorated view function
+from functools import wraps
+# Import OrderedDict, which keeps the buckets in least recently used order
+from collections import OrderedDict
+# Import the modules used to share the buckets between request threads
+import math
+import threading
+import time
+
+
+class TokenBucketLimiter:
+    """
+    A class that keeps one token bucket per key (an IP address or an email).
+
+        Attributes:
+            burst (int): The number of tokens in a full bucket, which is the number of requests allowed at once.
+            rate (float): The number of tokens added per second.
+            max_keys (int): The largest number of buckets kept in memory.
+    """
+
+    def __init__(self, burst, per_minute, max_keys):
+        self.burst = burst
+        self.rate = per_minute / 60
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key):
+        """
+        Take a token from the bucket of a key.
+
+        Args:
+            key (str): The IP address or email of the request.
+
+        Returns:
+            float: 0 if a token was taken, otherwise the number of seconds until the bucket has a token again.
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.burst, now))
+            # Refill the tokens earned since the last request, up to a full bucket
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0
+            else:
+                wait = (1 - tokens) / self.rate
+            # Put the bucket back as the most recently used one and drop the least recently used buckets
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+
+def rate_limiter(app, endpoint, key_type, burst, per_minute):
+    """
+    Return the limiter of a route and key type, creating it on first use.
+
+    Args:
+        app (Flask): Flask application object
+        endpoint (str): The name of the route, for example 'auth.login'.
+        key_type (str): 'ip' or 'email'.
+        burst (int): The number of tokens in a full bucket.
+        per_minute (float): The number of tokens added per minute.
+
+    Returns:
+        TokenBucketLimiter: The limiter.
+    """
+    limiters = app.extensions.setdefault('rate_limiters', {})
+    name = (endpoint, key_type, burst, per_minute)
+    if name not in limiters:
+        limiters.setdefault(name, TokenBucketLimiter(burst, per_minute, app.config['RATE_LIMIT_MAX_KEYS']))
+    return limiters[name]
+
+
+def rate_limited(view):
+    """
+    Decorator that applies the RATE_LIMITS of the route to its form submissions.
+
+    Args:
+        view (function): The view function of the route.
+
+    Returns:
+        function: The decorated view function.
+    """
+    @wraps(view)
+    def decorated_view(*args, **kwargs):
+        limits = current_app.config['RATE_LIMITS'].get(request.endpoint)
+        # Only form submissions are limited, showing the form is cheap
+        if not limits or request.method != 'POST':
+            return view(*args, **kwargs)
+
+        keys = {'ip': request.remote_addr or '', 'email': (request.form.get('email') or '').strip().lower()}
+        app = current_app._get_current_object()
+        wait = 0
+        for key_type, (burst, per_minute) in limits.items():
+            if keys.get(key_type):
+                wait = max(wait, rate_limiter(app, request.endpoint, key_type, burst, per_minute).take(keys[key_type]))
+        if wait:
+            # Turn the request away before the view hashes a password or touches the database
+            response = make_response("Too many attempts. Please try again later.", 429)
+            response.headers['Retry-After'] = str(math.ceil(wait))
+            return response
+        return view(*args, **kwargs)
+    return decorated_view
@@ -0,0 +1,210 @@
+"""
+The purpose of replica.py is to let the browsing pages read from a copy of the database, so they do not compete with bookings.
+
+SQLite has one file per database, and the theater, currentMovies and myBooking pages read the same file the bookings write to.
+When the READ_REPLICA setting is True, a background thread copies the database into READ_REPLICA_FILE in the instance folder
+every READ_REPLICA_REFRESH_SECONDS with SQLite's online backup API, which copies a consistent snapshot while the database stays in use.
+The browsing pages read from that copy through a separate, read-only engine (read_session() and read_sessions() below).
+
+Everything else stays on the primary database:
+    - all writes, and the booking transaction with its seat check (reservations.py), so a booking never trusts an old seat count,
+    - the reads of a user who has just booked, for READ_REPLICA_MAX_STALENESS_SECONDS, so the new booking shows up on myBooking,
+    - every read while the copy is older than READ_REPLICA_MAX_STALENESS_SECONDS, for example when the copy could not be refreshed.
+With sharding every shard file would need its own copy, so the browsing pages keep reading the shards when SHARD_COUNT is larger than 1.
+"""
+# Import the 'db' object located in __init__.py from the current package (website) for database operations
+from . import db
+# Import the router that returns the session of every database file
+from .sharding import sharding_enabled, data_sessions
+# Import functions from the Flask framework to read the settings and remember the replica session of the request
+from flask import current_app, g, session
+# Import create_engine and Session to open the read-only copy
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+# Import the modules used to copy the database in a background thread
+import os
+import sqlite3
+import threading
+import time
+
+
+class ReadReplica:
+    """
+    A class that keeps a read-only copy of the primary database up to date.
+
+        Attributes:
+            app (Flask): The Flask application, whose context the refresh thread runs in.
+            path (str): The path of the copy.
+            refresh_interval (float): The number of seconds between two refreshes.
+            max_staleness (float): The largest age in seconds of a copy the pages may read.
+            engine (Engine): The read-only engine of the copy.
+            refreshed_at (float or None): The time.monotonic() at which the current copy was taken, None before the first copy.
+    """
+
+    def __init__(self, app, path, refresh_interval, max_staleness):
+        self.app = app
+        self.path = path
+        self.refresh_interval = refresh_interval
+        self.max_staleness = max_staleness
+        # 'mode=ro' opens the copy read-only, so a bug in a page can never change it
+        self.engine = create_engine(f"sqlite:///file:{path}?mode=ro&uri=true")
+        self.refreshed_at = None
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._thread = None
+
+    def refresh(self):
+        """
+        Copy the primary database into the replica file. Runs inside an application context.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            # The backup reads one consistent snapshot, taken no earlier than now
+            started = time.monotonic()
+            source = db.engine.raw_connection()
+            try:
+                target = sqlite3.connect(self.path)
+                try:
+                    source.driver_connection.backup(target)
+                finally:
+                    target.close()
+            finally:
+                source.close()
+            self.refreshed_at = started
+
+    def staleness(self):
+        """
+        Return the age of the copy.
+
+        Returns:
+            float or None: The number of seconds since the copy was taken, or None if there is no copy yet.
+        """
+        if self.refreshed_at is None:
+            return None
+        return time.monotonic() - self.refreshed_at
+
+    def fresh(self):
+        """
+        Check if the copy is recent enough to be read.
+
+        Returns:
+            bool: True if the copy is at most max_staleness seconds old.
+        """
+        staleness = self.staleness()
+        return staleness is not None and staleness <= self.max_staleness
+
+    def start(self):
+        """
+        Take the first copy and start the refresh thread, unless it is already running.
+
+        Returns:
+            None
+        """
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            # Requests arriving together wait for the first copy instead of taking one each
+            if self._thread is not None:
+                return
+            if self.refreshed_at is None:
+                self.refresh()
+            self._thread = threading.Thread(target=self._run, name='read-replica', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        with self.app.app_context():
+            while True:
+                time.sleep(self.refresh_interval)
+                try:
+                    self.refresh()
+                except Exception:
+                    # Keep refreshing; while the copy is too old the pages read the primary database
+                    self.app.logger.exception("Could not refresh the read replica")
+
+
+def replica_enabled():
+    """
+    Check if the browsing pages may read from the replica.
+
+    Returns:
+        bool: True if READ_REPLICA is on and sharding is disabled.
+    """
+    return current_app.config.get('READ_REPLICA', False) and not sharding_enabled()
+
+
+def read_replica(app):
+    """
+    Return the read replica of the application, creating it and taking the first copy on first use.
+
+    Args:
+        app (Flask): Flask application object
+
+    Returns:
+        ReadReplica: The replica of the application.
+    """
+    if 'read_replica' not in app.extensions:
+        os.makedirs(app.instance_path, exist_ok=True)
+        replica = ReadReplica(app, os.path.join(app.instance_path, app.config['READ_REPLICA_FILE']),
+                              app.config['READ_REPLICA_REFRESH_SECONDS'], app.config['READ_REPLICA_MAX_STALENESS_SECONDS'])
+        # setdefault keeps the first replica if two requests create one at the same time
+        app.extensions.setdefault('read_replica', replica)
+    replica = app.extensions['read_replica']
+    replica.start()
+    return replica
+
+
+def pin_reads_to_primary():
+    """
+    Let the current user read from the primary database until the replica has caught up with their booking.
+
+    Returns:
+        None
+    """
+    if replica_enabled():
+        session['read_primary_until'] = time.time() + current_app.config['READ_REPLICA_MAX_STALENESS_SECONDS']
+
+
+def read_session():
+    """
+    Return the session the browsing pages read the main database with.
+
+    Returns:
+        Session: The session of the replica if it is enabled and fresh and the user has not just booked, otherwise 'db.session'.
+    """
+    if not replica_enabled() or session.get('read_primary_until', 0) > time.time():
+        return db.session
+    replica = read_replica(current_app._get_current_object())
+    if not replica.fresh():
+        return db.session
+    if 'replica_session' not in g:
+        g.replica_session = Session(bind=replica.engine)
+    return g.replica_session
+
+
+def read_sessions():
+    """
+    Return every session the browsing pages read screenings and bookings with, for fan-out reads.
+
+    Returns:
+        list: The replica session (or 'db.session') without sharding, otherwise one session per shard.
+    """
+    if sharding_enabled():
+        return data_sessions()
+    return [read_session()]
+
+
+def close_replica_session(exception=None):
+    """
+    Close the replica session opened during the request. Registered as an app teardown function.
+
+    Args:
+        exception (Exception or None): The exception that ended the request, if any.
+
+    Returns:
+        None
+    """
+    replica_session = g.pop('replica_session', None)
+    if replica_session is not None:
+        replica_session.close()
@@ -0,0 +1,181 @@
+"""
+The purpose of requestprofiler.py is to show where one request spends its time, beyond the SQL statements.
+
+When REQUEST_PROFILING is True, a request is profiled if its REQUEST_PROFILING_HEADER header holds the
+REQUEST_PROFILING_SECRET value (any value while the application runs in debug mode and no secret is set),
+or at random with the probability REQUEST_PROFILING_SAMPLE_RATE. At most REQUEST_PROFILING_MAX_ACTIVE requests are
+profiled at the same time, the others run unprofiled, so nobody can slow the server down by asking for profiles. While a profiled request runs, a sampler thread looks at
+the request thread's call stack every REQUEST_PROFILING_INTERVAL_MS milliseconds and counts how often every stack was seen.
+The counts are saved in the 'collapsed stack' format (one 'outer;inner;innermost count' line per stack)
+as a .folded file in the REQUEST_PROFILING_FOLDER of the instance folder, which flamegraph tools read directly,
+for example flamegraph.pl, inferno-flamegraph or https://www.speedscope.app. Template code shows up under the
+name of the template, so the time of the loops of movies.html is as visible as the csv writes of views.ticket().
+
+When REQUEST_PROFILING is False the hooks are not even registered, so requests pay nothing for the profiler.
+Python only switches threads every few milliseconds, so intervals shorter than that do not add samples.
+"""
+# Import functions from the Flask framework to hook into the requests
+from flask import g, request
+# Import the modules used to sample the call stacks
+from collections import Counter
+import hmac
+import os
+import random
+import sys
+import threading
+from datetime import datetime
+
+
+def frame_label(code, labels):
+    """
+    Return the name of a function in a collapsed stack, for example 'ticket (website/views.py:215)'.
+
+    Args:
+        code (code): The code object of the function.
+        labels (dict): A cache of the labels already built, by code object.
+
+    Returns:
+        str: The function name with the last two parts of its file path and its first line.
+    """
+    label = labels.get(code)
+    if label is None:
+        path = '/'.join(code.co_filename.replace('\\', '/').split('/')[-2:])
+        # ';' separates the frames of a collapsed stack, so it cannot appear in a label
+        label = f"{code.co_name} ({path}:{code.co_firstlineno})".replace(';', ':')
+        labels[code] = label
+    return label
+
+
+class StackSampler:
+    """
+    A class that samples the call stack of one thread in a background thread.
+
+        Attributes:
+            thread_id (int): The identifier of the sampled thread.
+            interval (float): The number of seconds between two samples.
+            stacks (Counter): The number of samples of every collapsed stack.
+    """
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._labels = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        """
+        Start sampling.
+        """
+        self._thread.start()
+
+    def _run(self):
+        """
+        Take a sample every interval until stop() is called.
+        """
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None:
+                names.append(frame_label(frame.f_code, self._labels))
+                frame = frame.f_back
+            # The collapsed format lists the outermost frame first
+            self.stacks[';'.join(reversed(names))] += 1
+
+    def stop(self):
+        """
+        Stop sampling and wait for the sampler thread to end.
+
+        Returns:
+            Counter: The number of samples of every collapsed stack.
+        """
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+
+def profile_path(app, endpoint):
+    """
+    Return a new file path for the profile of a request.
+
+    Args:
+        app (Flask): Flask application object
+        endpoint (str or None): The route of the request.
+
+    Returns:
+        str: A path in the REQUEST_PROFILING_FOLDER of the instance folder, named after the time and the route.
+    """
+    folder = os.path.join(app.instance_path, app.config['REQUEST_PROFILING_FOLDER'])
+    os.makedirs(folder, exist_ok=True)
+    stamp = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+    return os.path.join(folder, f"{stamp}-{endpoint or 'unknown'}.folded")
+
+
+def write_collapsed_stacks(path, stacks):
+    """
+    Write stack counts in the collapsed stack format read by flamegraph tools.
+
+    Args:
+        path (str): The path of the .folded file.
+        stacks (Counter): The number of samples of every collapsed stack.
+
+    Returns:
+        None
+    """
+    with open(path, 'w') as file:
+        for stack, count in sorted(stacks.items()):
+            file.write(f"{stack} {count}\n")
+
+
+def install_request_profiler(app):
+    """
+    Register the hooks that profile the requests chosen by the REQUEST_PROFILING_HEADER, REQUEST_PROFILING_SECRET and
+    REQUEST_PROFILING_SAMPLE_RATE settings, at most REQUEST_PROFILING_MAX_ACTIVE at a time.
+
+    Args:
+        app (Flask): Flask application object
+
+    Returns:
+        None
+    """
+    header = app.config['REQUEST_PROFILING_HEADER']
+    sample_rate = app.config['REQUEST_PROFILING_SAMPLE_RATE']
+    interval = app.config['REQUEST_PROFILING_INTERVAL_MS'] / 1000
+    secret = app.config['REQUEST_PROFILING_SECRET']
+    # Every profiled request holds one slot until its profile is saved
+    slots = threading.BoundedSemaphore(app.config['REQUEST_PROFILING_MAX_ACTIVE'])
+
+    def profile_requested():
+        # Without a secret the header is only honoured on a debug server, with one it has to match (in constant time)
+        value = request.headers.get(header)
+        if not value:
+            return False
+        if secret is None:
+            return app.debug
+        return hmac.compare_digest(value.encode(), secret.encode())
+
+    @app.before_request
+    def start_profile():
+        if (profile_requested() or random.random() < sample_rate) and slots.acquire(blocking=False):
+            g.profile_path = profile_path(app, request.endpoint)
+            g.profile_sampler = StackSampler(threading.get_ident(), interval)
+            g.profile_sampler.start()
+
+    @app.after_request
+    def name_profile(response):
+        # Tell the client where the profile of its request is saved
+        if 'profile_sampler' in g:
+            response.headers[header] = os.path.basename(g.profile_path)
+        return response
+
+    @app.teardown_request
+    def save_profile(error):
+        sampler = g.pop('profile_sampler', None)
+        if sampler is not None:
+            try:
+                write_collapsed_stacks(g.pop('profile_path'), sampler.stop())
+            finally:
+                slots.release()
@@ -0,0 +1,317 @@
+"""
+The purpose of reservations.py is to run the booking transaction of the ticket page.
+
+A Reservation holds what one ticket form asked for and, once it has been processed, the result for that user.
+reserve_batch() books a list of reservations with one database commit per database file and one write per csv file,
+so it serves both a single booking and a micro-batch collected by the group commit batcher (see groupcommit.py).
+reserve_group() books the screenings of one group form (a movie marathon, for example) all or nothing in one transaction.
+
+The seats are taken with a conditional UPDATE (only if enough seats are left),
+so two bookings for the last seats can never both succeed, even from different processes.
+Every booking is sold at the price of its screening, and the booked screenings are priced again
+for their new seats (see pricing.py) in the same transaction.
+"""
+# Imports the models from the current package, which define the database tables and their relationships
+from .models import Screening, Booking, BookingRequest, screening_booking
+# Import the router that decides which database (shard) stores a theater's screenings and bookings
+from .sharding import sharding_enabled, screening_session, next_booking_id
+# Import the pricing, which prices the booked screenings again after their seats changed
+from .pricing import reprice_screenings
+# Import the notifier of the live seat counts
+from .seatstream import publish_seat_changes
+# Import the csv persistence layer that locks, checksums and atomically replaces the csv files
+from .csvstore import csv_file
+# Import necessary modules to work with dates and times.
+from datetime import datetime, timezone
+
+# Fieldnames of the booking.csv file
+BOOKING_FIELDNAMES = [
+    'transaction_id',
+    'user_id',
+    'customer_name',
+    'number_of_tickets',
+    'date',
+    'time',
+    'movie_id',
+    'screening_id',
+    'timestamp'
+]
+
+
+class Reservation:
+    """
+    A class that represents one request to book tickets for a screening, and its result.
+
+        Attributes:
+            screening_id (int): The ID of the screening to book.
+            number (int): The number of tickets.
+            user_id (int): The ID of the user who books.
+            customer_name (str): The name written into booking.csv.
+            theater_id (int or None): The ID of the screening's theater, if the form sent it.
+            idempotency_key (str or None): The claimed idempotency key of the submission.
+            booking_id (int or None): The ID of the new booking, or None if nothing was booked.
+            seats_left (int or None): The number of seats left for the screening after the reservation was processed.
+    """
+
+    def __init__(self, screening_id, number, user_id, customer_name, theater_id=None, idempotency_key=None):
+        self.screening_id = int(screening_id)
+        self.number = int(number)
+        self.user_id = user_id
+        self.customer_name = customer_name
+        self.theater_id = theater_id
+        self.idempotency_key = idempotency_key
+        self.booking_id = None
+        self.seats_left = None
+
+    @property
+    def booked(self):
+        """
+        Check if the reservation created a booking.
+
+        Returns:
+            bool: True if the tickets were booked.
+        """
+        return self.booking_id is not None
+
+
+def reserve_batch(reservations, paths):
+    """
+    Book a list of reservations in arrival order.
+
+    Every reservation gets its own result: a reservation for more seats than are left is not booked,
+    and the others in the batch are not affected by it.
+
+    Args:
+        reservations (list): The Reservation objects to process.
+        paths (dict): A dictionary containing the absolute paths of the csv files.
+
+    Returns:
+        list: The same Reservation objects with booking_id and seats_left filled in.
+    """
+    # Group the reservations by the database file that stores their screening
+    groups = []
+    for reservation in reservations:
+        session = screening_session(reservation.screening_id, reservation.theater_id)
+        for group_session, group in groups:
+            if group_session is session:
+                group.append(reservation)
+                break
+        else:
+            groups.append((session, [reservation]))
+
+    # The same timestamp format the database default writes (UTC, whole seconds)
+    timestamp = datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+    booking_rows = []
+    seats = {}
+    for session, group in groups:
+        screening_ids = {reservation.screening_id for reservation in group}
+        screenings = {screening.id: screening for screening in session.query(Screening).filter(Screening.id.in_(screening_ids))}
+        for reservation in group:
+            screening = screenings.get(reservation.screening_id)
+            if screening is None or reservation.number < 1:
+                continue
+            row = book_reservation(session, screening, reservation, timestamp)
+            if row is not None:
+                booking_rows.append(row)
+        # Price the screenings of the batch again for their new seats, in one batch
+        reprice_screenings(session, {row['screening_id'] for row in booking_rows if row['screening_id'] in screening_ids})
+        # Remember which booking each submission created; the keys are stored next to the bookings, so this joins the same commit
+        remember_bookings(session, group)
+        # Save the bookings, the seats, the links and the keys of this database file in one commit
+        session.commit()
+        # Read the seats left after the commit, for the results and for screening.csv
+        seats.update(session.query(Screening.id, Screening.available_seats).filter(Screening.id.in_(screening_ids)))
+
+    for reservation in reservations:
+        reservation.seats_left = seats.get(reservation.screening_id, 0)
+
+    # Tell the open pages and write the whole batch to the csv files at once
+    publish_bookings(booking_rows, seats, paths)
+    return reservations
+
+
+def book_reservation(session, screening, reservation, timestamp):
+    """
+    Take the seats of one reservation and create its booking, inside the caller's transaction.
+
+    Args:
+        session (Session): The session of the database file that stores the screening.
+        screening (Screening): The screening to book.
+        reservation (Reservation): The reservation, its booking_id is filled in if the seats were taken.
+        timestamp (datetime): The time of the booking.
+
+    Returns:
+        dict or None: The row for booking.csv, or None if not enough seats were left.
+    """
+    # Take the seats only if enough are left; the row count tells if it worked
+    taken = (session.query(Screening)
+             .filter(Screening.id == reservation.screening_id,
+                     Screening.available_seats >= reservation.number)
+             .update({Screening.available_seats: Screening.available_seats - reservation.number},
+                     synchronize_session=False))
+    if not taken:
+        return None
+    # The tickets are sold at the price the screening had before this batch
+    booking = Booking(number_of_tickets=reservation.number, user_id=reservation.user_id, timestamp=timestamp, price=screening.price)
+    # Shards number their bookings themselves, so transaction IDs stay unique across shard files
+    if sharding_enabled():
+        booking.id = next_booking_id(session, screening.theater_id)
+    session.add(booking)
+    # Flush to get the new booking's ID, then link the booking to the screening
+    session.flush()
+    session.execute(screening_booking.insert().values(screening_id=screening.id, booking_id=booking.id))
+    reservation.booking_id = booking.id
+    return {
+        'transaction_id': booking.id,
+        'user_id': reservation.user_id,
+        'customer_name': reservation.customer_name,
+        'number_of_tickets': reservation.number,
+        'date': screening.date,
+        'time': screening.time,
+        'movie_id': screening.movie_id,
+        'screening_id': screening.id,
+        'timestamp': timestamp
+    }
+
+
+def group_session(reservations):
+    """
+    Return the session of the database file that stores all screenings of a group booking.
+
+    Args:
+        reservations (list): The Reservation objects of the group.
+
+    Returns:
+        Session or None: The session, or None if the screenings are stored in different database files (shards),
+            which cannot be booked in one transaction.
+    """
+    sessions = []
+    for reservation in reservations:
+        session = screening_session(reservation.screening_id, reservation.theater_id)
+        if not any(session is other for other in sessions):
+            sessions.append(session)
+    return sessions[0] if len(sessions) == 1 else None
+
+
+def reserve_group(reservations, paths):
+    """
+    Book several screenings for one user all or nothing, in one transaction.
+
+    Every reservation gets its own booking, but either all of them are booked or, if one screening
+    does not have enough seats left, none of them is. The database is committed once and every csv file is written once.
+
+    Args:
+        reservations (list): The Reservation objects of the group, for different screenings of one database file.
+        paths (dict): A dictionary containing the absolute paths of the csv files.
+
+    Returns:
+        list: The same Reservation objects with seats_left filled in, and booking_id filled in if the group was booked.
+    """
+    session = group_session(reservations)
+    if session is None:
+        raise ValueError("The screenings of a group booking must be stored in the same database file.")
+    timestamp = datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+    screening_ids = {reservation.screening_id for reservation in reservations}
+    screenings = {screening.id: screening for screening in session.query(Screening).filter(Screening.id.in_(screening_ids))}
+    booking_rows = []
+    # Take the seats in the order of the screening IDs, so two groups always lock the screenings in the same order
+    for reservation in sorted(reservations, key=lambda reservation: reservation.screening_id):
+        screening = screenings.get(reservation.screening_id)
+        row = None
+        if screening is not None and reservation.number >= 1:
+            row = book_reservation(session, screening, reservation, timestamp)
+        if row is None:
+            # One screening failed, so undo the seats and bookings of the whole group
+            session.rollback()
+            for other in reservations:
+                other.booking_id = None
+            booking_rows = []
+            break
+        booking_rows.append(row)
+    else:
+        # Price the booked screenings again for their new seats
+        reprice_screenings(session, screening_ids)
+        # Remember which booking the submission created, in the same commit as the bookings
+        remember_bookings(session, reservations)
+        session.commit()
+
+    seats = dict(session.query(Screening.id, Screening.available_seats).filter(Screening.id.in_(screening_ids)))
+    for reservation in reservations:
+        reservation.seats_left = seats.get(reservation.screening_id, 0)
+    publish_bookings(booking_rows, seats, paths)
+    return reservations
+
+
+def publish_bookings(booking_rows, seats, paths):
+    """
+    Push the new seat counts to the open currentMovies pages and write committed bookings to the csv files, each file once.
+
+    Args:
+        booking_rows (list): The rows for booking.csv of the committed bookings.
+        seats (dict): A dictionary with screening ID as key and the number of seats left as value.
+        paths (dict): A dictionary containing the absolute paths of the csv files.
+
+    Returns:
+        None
+    """
+    publish_seat_changes([(row['screening_id'], row['date'], seats[row['screening_id']]) for row in booking_rows])
+    append_bookings_csv(paths['booking'], booking_rows)
+    changed_seats = {row['screening_id']: seats[row['screening_id']] for row in booking_rows}
+    if changed_seats:
+        update_screening_seats_csv(paths['screening'], changed_seats)
+
+
+def remember_bookings(session, reservations):
+    """
+    Store the new booking ID on the BookingRequest of every booked reservation that claimed an idempotency key,
+    inside the caller's transaction.
+
+    Args:
+        session (Session): The session of the database file that stores the bookings and their keys.
+        reservations (list): The processed Reservation objects.
+
+    Returns:
+        None
+    """
+    for reservation in reservations:
+        if reservation.booked and reservation.idempotency_key:
+            (session.query(BookingRequest)
+             .filter(BookingRequest.key == reservation.idempotency_key)
+             .update({BookingRequest.booking_id: reservation.booking_id}, synchronize_session=False))
+
+
+def append_bookings_csv(path, rows):
+    """
+    Append new bookings to booking.csv in one write, synced to disk together with the bookings of other requests.
+
+    Args:
+        path (str): The path of booking.csv.
+        rows (list): A list of dictionaries, one per booking.
+
+    Returns:
+        None
+    """
+    # The header is written first if the booking.csv file is new or empty
+    csv_file(path).append(BOOKING_FIELDNAMES, rows)
+
+
+def update_screening_seats_csv(path, seats):
+    """
+    Update the available seats of some screenings in screening.csv, rewriting the file once.
+
+    Args:
+        path (str): The path of screening.csv.
+        seats (dict): A dictionary with screening ID as key and the new number of available seats as value.
+
+    Returns:
+        None
+    """
+    def change_seats(rows):
+        for row in rows:
+            # Change the value of available seats if the screening was booked
+            if int(row['id']) in seats:
+                row['available_seats'] = seats[int(row['id'])]
+        return rows
+
+    # Read and replace the file under its lock, so two workers booking at the same time do not lose each other's seats
+    csv_file(path).update(change_seats)
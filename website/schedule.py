@@ -0,0 +1,252 @@
+"""
+The purpose of schedule.py is to keep the whole screening schedule in memory in a compact form for the currentMovies page.
+
+Loading screenings as ORM objects costs hundreds of bytes per screening (the object, its attribute dictionary,
+its entry in the session's identity map and its date and time objects), so a worker cannot cache a quarter of screenings of many theaters.
+A ScheduleStore keeps one typed array per column instead (screening ID, date, time, theater ID, movie ID, seats left and price),
+a few bytes per screening, with the theater names and movie titles kept once per theater and movie.
+The screenings are sorted in the order of the page (date, theater name, movie title, time), so the screenings of a date range
+are one slice of the arrays, found with the date -> slice index. Only the screenings of the requested range are turned into
+ScheduleEntry objects (with __slots__, so without an attribute dictionary) while the page is rendered.
+
+When the SCHEDULE_STORE setting is True, the currentMovies page lists screenings from the store of its worker process.
+The store is read-only and built again from the screening_listing table when it is older than SCHEDULE_STORE_MAX_AGE_SECONDS,
+so the seats left may be that old when the page loads; the live seat updates correct them, and bookings always check the database.
+'flask schedule-memory-benchmark' compares the memory of the store with ORM objects for a million screenings.
+"""
+# Import the models from the current package, which define the database tables
+from .models import ScreeningListing
+# Import the router that returns the session of every database file the pages read from
+from .replica import read_sessions
+# Import the modules used to store the columns compactly and to merge the shards
+from array import array
+from datetime import date, time as time_of_day
+import heapq
+import math
+import threading
+import time
+
+# The columns of the screening_listing table read into the store, in this order
+STORE_COLUMNS = [
+    ScreeningListing.screening_id,
+    ScreeningListing.date,
+    ScreeningListing.time,
+    ScreeningListing.theater_id,
+    ScreeningListing.theater_name,
+    ScreeningListing.movie_id,
+    ScreeningListing.movie_title,
+    ScreeningListing.price,
+    ScreeningListing.available_seats,
+]
+
+# The order of the currentMovies page, which is the order of the store
+PAGE_ORDER = [ScreeningListing.date, ScreeningListing.theater_name, ScreeningListing.movie_title, ScreeningListing.time]
+
+
+class ScheduleEntry:
+    """
+    A class that represents one screening read from the store, with the attributes of a ScreeningListing row.
+
+        Attributes:
+            screening_id (int): The ID of the screening.
+            date (date): The date of the screening.
+            time (time): The time of the screening.
+            theater_id (int): The ID of the theater.
+            theater_name (str): The name of the theater.
+            movie_id (int): The ID of the movie.
+            movie_title (str): The title of the movie.
+            price (float or None): The ticket price of the screening when the store was built.
+            available_seats (int): The number of seats left when the store was built.
+    """
+    __slots__ = ('screening_id', 'date', 'time', 'theater_id', 'theater_name', 'movie_id', 'movie_title', 'price', 'available_seats')
+
+    def __init__(self, screening_id, date, time, theater_id, theater_name, movie_id, movie_title, price, available_seats):
+        self.screening_id = screening_id
+        self.date = date
+        self.time = time
+        self.theater_id = theater_id
+        self.theater_name = theater_name
+        self.movie_id = movie_id
+        self.movie_title = movie_title
+        self.price = price
+        self.available_seats = available_seats
+
+
+class ScheduleStore:
+    """
+    A class that holds the screening schedule as typed arrays in page order, with an index from date to slice.
+
+        Attributes:
+            screening_ids (array): The screening ID of every screening.
+            dates (array): The date of every screening as a day number (date.toordinal()).
+            times (array): The time of every screening in seconds after midnight.
+            theater_ids (array): The theater ID of every screening.
+            movie_ids (array): The movie ID of every screening.
+            seats (array): The seats left of every screening.
+            prices (array): The ticket price of every screening, NaN if it has none.
+            theater_names (dict): The name of every theater ID.
+            movie_titles (dict): The title of every movie ID.
+            date_index (dict): The (start, stop) slice of the arrays of every day number.
+            built_at (float): The time.monotonic() at which the store was built.
+    """
+
+    def __init__(self, rows):
+        """
+        Build the store from screening_listing rows.
+
+        Args:
+            rows (iterable): Tuples with the values of STORE_COLUMNS, in page order.
+        """
+        self.screening_ids = array('i')
+        self.dates = array('i')
+        self.times = array('i')
+        self.theater_ids = array('i')
+        self.movie_ids = array('i')
+        self.seats = array('i')
+        self.prices = array('d')
+        self.theater_names = {}
+        self.movie_titles = {}
+        self.date_index = {}
+        self.built_at = time.monotonic()
+        for screening_id, day, show_time, theater_id, theater_name, movie_id, movie_title, price, seats in rows:
+            day = day.toordinal()
+            position = len(self.screening_ids)
+            # The rows are ordered by date first, so every date is one run of rows
+            start, _ = self.date_index.get(day, (position, position))
+            self.date_index[day] = (start, position + 1)
+            self.screening_ids.append(screening_id)
+            self.dates.append(day)
+            self.times.append(show_time.hour * 3600 + show_time.minute * 60 + show_time.second)
+            self.theater_ids.append(theater_id)
+            self.movie_ids.append(movie_id)
+            self.seats.append(seats)
+            self.prices.append(price if price is not None else math.nan)
+            self.theater_names[theater_id] = theater_name
+            self.movie_titles[movie_id] = movie_title
+
+    def __len__(self):
+        return len(self.screening_ids)
+
+    @property
+    def nbytes(self):
+        """
+        Return the memory used by the arrays.
+
+        Returns:
+            int: The number of bytes of the array buffers.
+        """
+        columns = [self.screening_ids, self.dates, self.times, self.theater_ids, self.movie_ids, self.seats, self.prices]
+        return sum(column.itemsize * len(column) for column in columns)
+
+    def entry(self, position):
+        """
+        Return the screening at a position of the arrays.
+
+        Args:
+            position (int): The position.
+
+        Returns:
+            ScheduleEntry: The screening.
+        """
+        seconds = self.times[position]
+        theater_id = self.theater_ids[position]
+        movie_id = self.movie_ids[position]
+        price = self.prices[position]
+        return ScheduleEntry(self.screening_ids[position], date.fromordinal(self.dates[position]),
+                             time_of_day(seconds // 3600, seconds // 60 % 60, seconds % 60),
+                             theater_id, self.theater_names[theater_id], movie_id, self.movie_titles[movie_id],
+                             None if math.isnan(price) else price, self.seats[position])
+
+    def entries(self, start_date, end_date, theater_id=None, movie_id=None):
+        """
+        Return the screenings of a date range in page order, like the listing query of the currentMovies page.
+
+        Args:
+            start_date (date): The first date.
+            end_date (date): The last date.
+            theater_id (int or None): Only screenings of this theater, if given.
+            movie_id (int or None): Only screenings of this movie, if given.
+
+        Returns:
+            list: ScheduleEntry objects ordered by date, theater name, movie title and time.
+        """
+        found = []
+        for day in range(start_date.toordinal(), end_date.toordinal() + 1):
+            start, stop = self.date_index.get(day, (0, 0))
+            for position in range(start, stop):
+                if theater_id and self.theater_ids[position] != theater_id:
+                    continue
+                if movie_id and self.movie_ids[position] != movie_id:
+                    continue
+                found.append(self.entry(position))
+        return found
+
+
+def read_schedule_rows(sessions):
+    """
+    Read the screening_listing rows of every database file as plain tuples, merged into page order.
+
+    Args:
+        sessions (list): The sessions to read from, one per database file.
+
+    Returns:
+        iterable: Tuples with the values of STORE_COLUMNS, in page order.
+    """
+    queries = [session.query(*STORE_COLUMNS).order_by(*PAGE_ORDER).yield_per(10000) for session in sessions]
+    if len(queries) == 1:
+        return (tuple(row) for row in queries[0])
+    # Every shard is already in page order, so merging keeps the order without sorting everything again
+    return heapq.merge(*[(tuple(row) for row in query) for query in queries], key=lambda row: (row[1], row[4], row[6], row[2]))
+
+
+class ScheduleCache:
+    """
+    A class that keeps the schedule store of a worker process and builds it again when it is too old.
+
+        Attributes:
+            max_age (float): The largest age in seconds of the store before it is built again.
+            store (ScheduleStore or None): The current store, None before the first build.
+    """
+
+    def __init__(self, max_age):
+        self.max_age = max_age
+        self.store = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        """
+        Return a store that is at most max_age seconds old, building one if needed.
+
+        While one request builds the new store, the other requests keep using the old one instead of waiting.
+
+        Returns:
+            ScheduleStore: The store.
+        """
+        store = self.store
+        if store is not None and time.monotonic() - store.built_at <= self.max_age:
+            return store
+        # Only the first request to notice builds the store; the others use the old store if there is one
+        if not self._lock.acquire(blocking=store is None):
+            return store
+        try:
+            if self.store is store:
+                self.store = ScheduleStore(read_schedule_rows(read_sessions()))
+            return self.store
+        finally:
+            self._lock.release()
+
+
+def schedule_store(app):
+    """
+    Return the schedule store of the application's worker process.
+
+    Args:
+        app (Flask): Flask application object
+
+    Returns:
+        ScheduleStore: The store.
+    """
+    if 'schedule_cache' not in app.extensions:
+        # setdefault keeps the first cache if two requests create one at the same time
+        app.extensions.setdefault('schedule_cache', ScheduleCache(app.config['SCHEDULE_STORE_MAX_AGE_SECONDS']))
+    return app.extensions['schedule_cache'].get()
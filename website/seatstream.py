@@ -0,0 +1,207 @@
+"""
+The purpose of seatstream.py is to push live seat counts to the currentMovies page.
+
+The listing shows the available seats at the time the page was rendered, so users used to reload the page to check again,
+which runs the whole listing query and template every time. Instead, the page opens one server-sent events (SSE)
+connection to '/seatStream' for the dates it shows. After every booking, reserve_batch() tells the SeatBroadcaster
+the new seat counts, and the broadcaster hands them to every open connection that watches the screening's date.
+
+The broadcaster lives in the memory of the application process:
+    - subscribers are indexed by date, so a booking only touches the connections that show its date,
+    - every subscriber has a small bounded queue; a subscriber that cannot keep up is disconnected,
+      and the browser reconnects by itself and starts again from a fresh snapshot.
+"""
+# Imports the models from the current package, which define the database tables and their relationships
+from .models import Screening
+# Import the router, so the snapshot also reads screenings split across shard files
+from .sharding import data_sessions
+# Import current_app to find the broadcaster of the application
+from flask import current_app
+# Import the modules used to hand seat counts from the booking threads to the streaming threads
+import json
+import queue
+import threading
+
+
+class SeatSubscription:
+    """
+    A class that represents one open seat stream.
+
+        Attributes:
+            dates (list): The screening dates the stream watches.
+            queue (queue.Queue): The seat changes waiting to be sent, each a dictionary of screening ID to available seats.
+            overflowed (bool): True if the stream fell too far behind and has to reconnect.
+            closed (bool): True once the stream was unsubscribed.
+    """
+
+    def __init__(self, dates, queue_size):
+        self.dates = dates
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.overflowed = False
+        self.closed = False
+
+
+class SeatBroadcaster:
+    """
+    A class that fans out seat count changes to the open seat streams.
+
+        Attributes:
+            queue_size (int): The number of pending changes a stream may have before it is disconnected.
+            max_subscribers (int): The largest number of open streams.
+    """
+
+    def __init__(self, queue_size, max_subscribers):
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self._by_date = {}
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def subscribe(self, dates):
+        """
+        Open a stream for some screening dates.
+
+        Args:
+            dates (list): The dates to watch.
+
+        Returns:
+            SeatSubscription or None: The new subscription, or None if there are already too many open streams.
+        """
+        with self._lock:
+            if self._count >= self.max_subscribers:
+                return None
+            subscription = SeatSubscription(dates, self.queue_size)
+            for date in dates:
+                self._by_date.setdefault(date, set()).add(subscription)
+            self._count += 1
+            return subscription
+
+    def unsubscribe(self, subscription):
+        """
+        Close a stream. Closing the same stream again does nothing.
+
+        Args:
+            subscription (SeatSubscription): The subscription returned by subscribe().
+
+        Returns:
+            None
+        """
+        with self._lock:
+            if subscription.closed:
+                return
+            subscription.closed = True
+            for date in subscription.dates:
+                subscribers = self._by_date.get(date)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._by_date[date]
+            self._count -= 1
+
+    def publish(self, changes):
+        """
+        Send new seat counts to the streams watching the screenings' dates.
+
+        Args:
+            changes (list): Tuples of (screening ID, screening date, available seats).
+
+        Returns:
+            None
+        """
+        # Collect one message per subscriber, so a batch of bookings is sent as one event
+        messages = {}
+        with self._lock:
+            for screening_id, date, seats in changes:
+                for subscription in self._by_date.get(date, ()):
+                    messages.setdefault(subscription, {})[screening_id] = seats
+        for subscription, message in messages.items():
+            try:
+                subscription.queue.put_nowait(message)
+            except queue.Full:
+                # The stream is too slow; it ends and the browser reconnects with a fresh snapshot
+                subscription.overflowed = True
+
+
+def seat_broadcaster(app):
+    """
+    Return the seat broadcaster of the application, creating it on first use.
+
+    Args:
+        app (Flask): Flask application object
+
+    Returns:
+        SeatBroadcaster: The broadcaster of the application.
+    """
+    if 'seat_broadcaster' not in app.extensions:
+        app.extensions.setdefault('seat_broadcaster', SeatBroadcaster(app.config['SEAT_STREAM_QUEUE_SIZE'],
+                                                                      app.config['SEAT_STREAM_MAX_SUBSCRIBERS']))
+    return app.extensions['seat_broadcaster']
+
+
+def publish_seat_changes(changes):
+    """
+    Tell the open seat streams about new seat counts. Called by the booking path after its commit.
+
+    Args:
+        changes (list): Tuples of (screening ID, screening date, available seats).
+
+    Returns:
+        None
+    """
+    if changes:
+        seat_broadcaster(current_app._get_current_object()).publish(changes)
+
+
+def seat_snapshot(start_date, end_date):
+    """
+    Read the current seat counts of the screenings between two dates, sent first when a stream opens.
+
+    Args:
+        start_date (date): The first date.
+        end_date (date): The last date.
+
+    Returns:
+        dict: A dictionary with screening ID as key and the available seats as value.
+    """
+    snapshot = {}
+    for session in data_sessions():
+        snapshot.update(session.query(Screening.id, Screening.available_seats)
+                        .filter(Screening.date.between(start_date, end_date)))
+    return snapshot
+
+
+def seat_event(seats):
+    """
+    Format seat counts as a server-sent event.
+
+    Args:
+        seats (dict): A dictionary with screening ID as key and the available seats as value.
+
+    Returns:
+        str: The event in the text/event-stream format.
+    """
+    return f"event: seats\ndata: {json.dumps(seats)}\n\n"
+
+
+def seat_stream(subscription, snapshot, heartbeat):
+    """
+    Generate the server-sent events of one open stream.
+
+    Args:
+        subscription (SeatSubscription): The subscription of the stream.
+        snapshot (dict): The seat counts when the stream opened.
+        heartbeat (int): The number of seconds between keep-alive comments when nothing changes.
+
+    Returns:
+        generator: The text of the events.
+    """
+    # Tell the browser to reconnect after 3 seconds if the connection drops, then send the snapshot
+    yield "retry: 3000\n" + seat_event(snapshot)
+    while not subscription.overflowed:
+        try:
+            seats = subscription.queue.get(timeout=heartbeat)
+        except queue.Empty:
+            # A comment line keeps proxies from closing an idle connection and notices closed browsers
+            yield ": keep-alive\n\n"
+            continue
+        yield seat_event(seats)
@@ -0,0 +1,345 @@
+"""
+The purpose of sharding.py is to split screenings and bookings across several SQLite files by theater.
+
+SQLite allows one writer at a time per database file, so with a single database.db a sellout at one theater
+stalls booking everywhere. When the SHARD_COUNT setting is larger than 1, every theater is assigned to one
+shard file (theater id modulo the number of shards). Each shard holds:
+    - the screenings of its theaters, their bookings and the screening_booking links,
+    - a copy of the small reference tables (user, theater, movie), so the usual joins work inside one shard.
+Bookings at theaters in different shards then write to different files and do not wait for each other.
+
+Every shard file also has a shard_info row with its number, the shard count and schema version it was filled for,
+and the booking ID floor its new bookings are numbered above. A restart keeps shard files that are still current
+and only moves the newly scheduled screenings into them; shards made for another shard count or schema are filled again.
+
+The router functions below decide which session a query uses.
+When sharding is disabled they simply return the normal 'db.session', so the views work the same in both modes.
+"""
+# Import the 'db' object located in __init__.py from the current package (website) for database operations
+from . import db
+# Imports the models from the current package, which define the database tables and their relationships
+from .models import User, Theater, Movie, Screening, Booking, ArchivedBooking, screening_booking, theater_movie
+# Import current_app and g to read the settings and keep one session per shard for the current request
+from flask import current_app, g
+# Import the Session class to open sessions bound to a shard engine
+from sqlalchemy.orm import Session
+# Import MetaData and inspect to keep the shard_info table out of the main database and to check if a shard has it
+from sqlalchemy import MetaData, inspect
+# Import make_url to name the shard files after the main database file
+from sqlalchemy.engine import make_url
+import os
+
+# Tables that are copied into every shard, and tables whose rows are split between the shards
+REFERENCE_TABLES = [User.__table__, Theater.__table__, Movie.__table__, theater_movie]
+PARTITIONED_TABLES = [Screening.__table__, Booking.__table__, screening_booking]
+
+# The shard_info table is only created in the shard files, so it has its own metadata
+SHARD_METADATA = MetaData()
+SHARD_INFO = db.Table(
+    'shard_info', SHARD_METADATA,
+    # The number of the shard, and the shard count and schema version it was filled for
+    db.Column('shard_index', db.Integer, nullable=False),
+    db.Column('shard_count', db.Integer, nullable=False),
+    db.Column('schema_version', db.Integer, nullable=False),
+    # The largest booking ID (archived bookings included) of the shard's bookings and of the bookings numbered before it
+    db.Column('booking_id_floor', db.Integer, nullable=False),
+)
+
+
+def shard_count():
+    """
+    Return the number of shards, 0 or 1 meaning that sharding is disabled.
+
+    Returns:
+        int: The SHARD_COUNT setting.
+    """
+    return current_app.config.get('SHARD_COUNT', 0)
+
+
+def sharding_enabled():
+    """
+    Check if screenings and bookings are split across shard files.
+
+    Returns:
+        bool: True if sharding is enabled.
+    """
+    return shard_count() > 1
+
+
+def shard_binds(database_uri, count):
+    """
+    Create the SQLALCHEMY_BINDS setting with one SQLite file per shard, next to the main database file.
+
+    Args:
+        database_uri (str): The URI of the main database, for example 'sqlite:///database.db' (a relative path is in the instance folder).
+        count (int): The number of shards.
+
+    Returns:
+        dict: A dictionary with the bind key of each shard as key and its database URI, for example 'sqlite:///database_shard0.db', as value.
+    """
+    url = make_url(database_uri)
+    stem, suffix = os.path.splitext(url.database)
+    return {shard_key(index): url.set(database=f"{stem}_shard{index}{suffix}").render_as_string(hide_password=False)
+            for index in range(count)}
+
+
+def shard_key(index):
+    """
+    Return the bind key of a shard.
+
+    Args:
+        index (int): The number of the shard.
+
+    Returns:
+        str: The bind key, for example 'shard0'.
+    """
+    return f'shard{index}'
+
+
+def shard_index(theater_id):
+    """
+    Return the number of the shard that stores a theater's screenings and bookings.
+
+    Args:
+        theater_id (int): The ID of the theater.
+
+    Returns:
+        int: The number of the shard.
+    """
+    return int(theater_id) % shard_count()
+
+
+def shard_session(theater_id):
+    """
+    Return the session for the shard of a theater.
+
+    The sessions are kept for the rest of the request in 'g' and closed when the request ends.
+
+    Args:
+        theater_id (int): The ID of the theater.
+
+    Returns:
+        Session: The shard's session, or 'db.session' if sharding is disabled.
+    """
+    if not sharding_enabled():
+        return db.session
+    return session_for_shard(shard_index(theater_id))
+
+
+def session_for_shard(index):
+    """
+    Return the session bound to a shard's engine, opening it on first use in the current request.
+
+    Args:
+        index (int): The number of the shard.
+
+    Returns:
+        Session: The session of the shard.
+    """
+    if 'shard_sessions' not in g:
+        g.shard_sessions = {}
+    if index not in g.shard_sessions:
+        g.shard_sessions[index] = Session(bind=db.engines[shard_key(index)])
+    return g.shard_sessions[index]
+
+
+def data_sessions():
+    """
+    Return every session that holds screenings and bookings, for fan-out reads.
+
+    Returns:
+        list: One session per shard, or just 'db.session' if sharding is disabled.
+    """
+    if not sharding_enabled():
+        return [db.session]
+    return [session_for_shard(index) for index in range(shard_count())]
+
+
+def find_screening_session(screening_id):
+    """
+    Find the session that stores a screening when the theater of the screening is not known.
+
+    Args:
+        screening_id (int): The ID of the screening.
+
+    Returns:
+        Session: The session of the shard holding the screening, or 'db.session' if sharding is disabled or the screening does not exist.
+    """
+    if not sharding_enabled():
+        return db.session
+    for session in data_sessions():
+        if session.get(Screening, int(screening_id)) is not None:
+            return session
+    return db.session
+
+
+def screening_session(screening_id, theater_id=None):
+    """
+    Return the session that stores a screening.
+
+    The theater sent by a form is only a hint: it is used if it is a number and its shard holds the screening,
+    otherwise every shard is asked.
+
+    Args:
+        screening_id (int): The ID of the screening.
+        theater_id (int, str or None): The ID of the screening's theater if the form sent it, which avoids asking every shard.
+
+    Returns:
+        Session: The session holding the screening, or 'db.session' if sharding is disabled or the screening does not exist.
+    """
+    if not sharding_enabled() or not str(screening_id).isdigit():
+        return db.session
+    if str(theater_id).isdigit():
+        session = shard_session(theater_id)
+        if session.get(Screening, int(screening_id)) is not None:
+            return session
+    return find_screening_session(screening_id)
+
+
+def close_shard_sessions(exception=None):
+    """
+    Close the shard sessions opened during the request. Registered as an app teardown function.
+
+    Args:
+        exception (Exception or None): The exception that ended the request, if any.
+
+    Returns:
+        None
+    """
+    for session in g.pop('shard_sessions', {}).values():
+        session.close()
+
+
+def next_booking_id(session, theater_id):
+    """
+    Choose the ID of a new booking in a shard.
+
+    Every shard hands out IDs from its own residue class (ID modulo number of shards equals the shard number),
+    starting above every ID that existed when the shards were filled (the booking ID floor stored in the shard),
+    so transaction IDs are unique across shards without any coordination between the shard files.
+
+    Args:
+        session (Session): The session of the shard.
+        theater_id (int): The ID of the theater being booked.
+
+    Returns:
+        int: The ID for the new booking.
+    """
+    count = shard_count()
+    index = shard_index(theater_id)
+    # The largest booking ID of the shard and its floor in one statement
+    largest_booking = db.select(db.func.max(Booking.id)).scalar_subquery()
+    largest = session.execute(db.select(db.func.max(db.func.coalesce(largest_booking, 0), SHARD_INFO.c.booking_id_floor))).scalar()
+    return ((largest or 0) // count + 1) * count + index
+
+
+def raise_booking_id_floor(session, booking_id):
+    """
+    Make sure a shard never hands out a booking ID again, for example after the booking with the largest ID was archived.
+
+    Args:
+        session (Session): The session of the shard, committed by the caller.
+        booking_id (int): The booking ID that must stay taken.
+
+    Returns:
+        None
+    """
+    session.execute(SHARD_INFO.update().values(booking_id_floor=db.func.max(SHARD_INFO.c.booking_id_floor, booking_id)))
+
+
+def shards_are_current():
+    """
+    Check if every shard file was filled for the current shard count and schema, so a restart can keep them.
+
+    Returns:
+        bool: True if every shard has the shard_info row of its number, the SHARD_COUNT setting and the latest schema version.
+    """
+    from .migrations import latest_version
+    count = shard_count()
+    for index in range(count):
+        engine = db.engines[shard_key(index)]
+        if not inspect(engine).has_table(SHARD_INFO.name):
+            return False
+        with engine.connect() as shard:
+            info = shard.execute(SHARD_INFO.select()).mappings().first()
+        if info is None or (info['shard_index'], info['shard_count'], info['schema_version']) != (index, count, latest_version()):
+            return False
+    return True
+
+
+def copy_user_to_shards(user):
+    """
+    Copy a new user into every shard, so the shards' copies of the user table stay complete.
+
+    Args:
+        user (User): The committed new user.
+
+    Returns:
+        None
+    """
+    if not sharding_enabled():
+        return
+    row = {column.name: getattr(user, column.key) for column in User.__table__.columns}
+    for index in range(shard_count()):
+        with db.engines[shard_key(index)].begin() as shard:
+            shard.execute(User.__table__.insert(), [row])
+
+
+def distribute_to_shards(recreate=True):
+    """
+    Move the screenings and bookings of the main database into the shard files.
+
+    Every screening moves (with its bookings) into the shard of its theater, and the reference tables are copied
+    into each shard again. When the shards are recreated, their tables are created from the models first and
+    every shard stores its shard_info row; otherwise only the rows added to the main database since the last start
+    (the newly scheduled screenings) are moved into the existing shards.
+
+    Args:
+        recreate (bool): True to drop and fill the shard files again, False to keep them (see shards_are_current()).
+
+    Returns:
+        None
+    """
+    from .migrations import latest_version
+    count = shard_count()
+    main = db.session.connection()
+    # Remember the largest booking ID (archived bookings included), new bookings in every shard are numbered above it
+    floor = max(db.session.query(db.func.max(Booking.id)).scalar() or 0,
+                db.session.query(db.func.max(ArchivedBooking.id)).scalar() or 0)
+    # Read the rows of the main database once
+    reference_rows = {table: main.execute(table.select()).mappings().all() for table in REFERENCE_TABLES}
+    screenings = main.execute(Screening.__table__.select()).mappings().all()
+    links = main.execute(screening_booking.select()).mappings().all()
+    bookings = {row['id']: row for row in main.execute(Booking.__table__.select()).mappings().all()}
+    theater_of_screening = {row['id']: row['theater_id'] for row in screenings}
+
+    for index in range(count):
+        engine = db.engines[shard_key(index)]
+        if recreate:
+            # Recreate the shard's tables, like the main database is recreated on a rebuild
+            SHARD_METADATA.drop_all(bind=engine)
+            db.metadata.drop_all(bind=engine)
+            db.metadata.create_all(bind=engine)
+            SHARD_METADATA.create_all(bind=engine)
+        shard_screenings = [row for row in screenings if int(row['theater_id']) % count == index]
+        shard_links = [row for row in links if int(theater_of_screening[row['screening_id']]) % count == index]
+        # A booking linked to several screenings of the shard is copied once
+        shard_bookings = list({row['booking_id']: bookings[row['booking_id']] for row in shard_links if row['booking_id'] in bookings}.values())
+        with engine.begin() as shard:
+            if recreate:
+                shard.execute(SHARD_INFO.insert().values(shard_index=index, shard_count=count,
+                                                         schema_version=latest_version(), booking_id_floor=floor))
+            # The reference tables are small, so they are copied again in full to match the main database
+            for table in reversed(REFERENCE_TABLES):
+                shard.execute(table.delete())
+            for table in REFERENCE_TABLES:
+                if reference_rows[table]:
+                    shard.execute(table.insert(), reference_rows[table])
+            for table, rows in ((Screening.__table__, shard_screenings), (Booking.__table__, shard_bookings), (screening_booking, shard_links)):
+                if rows:
+                    shard.execute(table.insert(), rows)
+
+    # The main database keeps only the reference tables
+    for table in reversed(PARTITIONED_TABLES):
+        main.execute(table.delete())
+    db.session.commit()
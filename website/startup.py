@@ -0,0 +1,95 @@
+"""
+The purpose of startup.py is to initialize the database on demand and to measure how long startup takes.
+
+'flask init-db' creates or upgrades the database explicitly, which is useful when the application was created with lazy_init=True,
+and 'flask init-db --rebuild' loads it from the csv files again.
+'flask startup-profile' measures, in a fresh Python process, how long it takes to import the website package,
+to create the application and to initialize the database, and can fail when the total is over a time budget.
+Every run loads a copy of the csv files into a new temporary database, so all runs measure the same cold start
+and the real database and csv files are never changed.
+"""
+# Import click and with_appcontext to define the command line interface
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+# Import necessary modules to run and time a fresh Python process
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+# Import the modules used to copy the csv files into a temporary folder
+import glob
+import os
+import shutil
+import tempfile
+
+# The script run in a fresh process, so the import time is not hidden by modules that are already imported
+# (the database URI and the csv folder are its arguments)
+PROFILE_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+import website
+imported = time.perf_counter()
+app = website.create_app(lazy_init=True, database_uri=sys.argv[1], csv_folder=sys.argv[2])
+created = time.perf_counter()
+website.init_database(app)
+initialized = time.perf_counter()
+print(json.dumps({'import_ms': (imported - started) * 1000,
+                  'create_app_ms': (created - imported) * 1000,
+                  'init_ms': (initialized - created) * 1000}))
+"""
+
+
+def measure_startup(csv_folder):
+    """
+    Measure the cold startup of the application in a fresh Python process, on a new temporary database
+    loaded from a copy of the csv files.
+
+    Args:
+        csv_folder (str): The folder of the csv files to copy.
+
+    Returns:
+        dict: The milliseconds spent importing the package ('import_ms'), creating the app ('create_app_ms'),
+            initializing the database ('init_ms') and in total ('total_ms').
+    """
+    # Run from the project folder (the folder that contains the website package)
+    project_folder = Path(__file__).absolute().parent.parent
+    with tempfile.TemporaryDirectory() as folder:
+        for path in glob.glob(os.path.join(csv_folder, '*.csv')):
+            shutil.copy(path, folder)
+        database_uri = f"sqlite:///{os.path.join(folder, 'startup.db')}"
+        result = subprocess.run([sys.executable, '-c', PROFILE_SCRIPT, database_uri, folder],
+                                cwd=project_folder, capture_output=True, text=True, check=True)
+    # The last line of the output is the JSON, the lines before it are the messages printed by the load
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    timings['total_ms'] = timings['import_ms'] + timings['create_app_ms'] + timings['init_ms']
+    return timings
+
+
+@click.command('init-db')
+@click.option('--rebuild', is_flag=True, help='Drop the tables and load the csv files again, even if the database could be upgraded in place.')
+@with_appcontext
+def init_db_command(rebuild):
+    """
+    Create or upgrade the database, loading the csv files into a new one.
+    """
+    from . import init_database
+    init_database(current_app._get_current_object(), rebuild=rebuild or None)
+    click.echo("Database initialized.")
+
+
+@click.command('startup-profile')
+@click.option('--runs', default=3, show_default=True, help='Number of fresh processes to measure; the median is reported.')
+@click.option('--budget-ms', type=float, default=None, help='Fail if the median total startup time is above this many milliseconds.')
+@with_appcontext
+def startup_profile_command(runs, budget_ms):
+    """
+    Measure import time and database initialization time of the application, loading copies of its csv files.
+    """
+    measurements = [measure_startup(current_app.config['CSV_FOLDER']) for _ in range(runs)]
+    median = {key: statistics.median(measurement[key] for measurement in measurements) for key in measurements[0]}
+    click.echo(f"import {median['import_ms']:.1f} ms, create_app {median['create_app_ms']:.1f} ms, "
+               f"init {median['init_ms']:.1f} ms, total {median['total_ms']:.1f} ms (median of {runs})")
+    if budget_ms is not None and median['total_ms'] > budget_ms:
+        raise click.ClickException(f"Startup took {median['total_ms']:.1f} ms, over the budget of {budget_ms:.1f} ms.")
@@ -5,25 +5,36 @@ This way the app.py can be nicely organized and separate the views from applicat
 """
 
 # Import the 'db' object located in __init__.py from the current package (website) for database operations
-from . import db
+# and the helper that returns the paths of the csv files
+from . import db, get_csv_paths
 # Import functions and classes from the Flask framework. 
 # These are used for creating routes, rendering templates, handling requests, flashing messages, and redirecting.
-from flask import Blueprint, render_template, request, flash, redirect, url_for
+from flask import Blueprint, render_template, request, flash, redirect, url_for, current_app, Response
 # Import for user authentication and user information access. 
 from flask_login import login_required, current_user
+# Import selectinload to load the movies of all theaters in one query instead of one query per theater
+from sqlalchemy.orm import selectinload
 # Imports the models from the current package, which define the database tables and their relationships
-from .models import Theater, Movie, Screening, Booking
+from .models import Theater, Movie, Booking, ScreeningDate, ArchivedBooking, ScreeningListing, screening_booking
+# Import the helpers that make ticket submissions safe to retry
+from .idempotency import new_idempotency_key, claim_idempotency_key, find_idempotency_key, release_idempotency_key
+# Import the router that decides which database (shard) stores a theater's screenings and bookings
+from .sharding import shard_session, screening_session, sharding_enabled
+# Import the router that sends the reads of the browsing pages to the read replica when it is enabled
+from .replica import read_session, read_sessions, pin_reads_to_primary
+# Import the compact in-memory screening schedule of the currentMovies page
+from .schedule import schedule_store
+# Import the booking transaction and the batcher that commits bursts of bookings together
+from .reservations import Reservation, reserve_batch, reserve_group, group_session
+from .groupcommit import booking_batcher
+# Import the waiting room that limits how many requests book the same screening at the same time
+from .admission import admission_control
+# Import the broadcaster that pushes new seat counts to the open currentMovies pages
+from .seatstream import seat_broadcaster, seat_snapshot, seat_stream
 # Import necessary modules to work with dates and times.
-from datetime import datetime
-# Import necessary modules to write data into csv
-import csv
-# Import necessary modules to create a temporary file to edit a row based on condition in csv 
-from tempfile import NamedTemporaryFile
-# Import necessary modules to move file
-import shutil
-# Import necessary modules to retrieve dynamic file location
-from pathlib import Path
-import os
+from datetime import datetime, timedelta
+# Import groupby to group ordered screenings by date, theater and movie
+from itertools import groupby
 
 # Define a blueprint named 'views' for this module
 # Blueprints are used to organize routes and views in Flask applications.
@@ -58,8 +69,8 @@ def theater():
     Returns:
         Response: The rendered template.
     """
-    # Retrieves all theater objects from the database
-    theater_list = Theater.query.all()
+    # Retrieves all theater objects from the database (or its read replica), with the movies of every theater loaded in one more query
+    theater_list = read_session().query(Theater).options(selectinload(Theater.movies)).all()
     # Returns the rendered template theater.html and passes theater_list and current_user to the template.
     return render_template("theater.html", user=current_user, theater_list=theater_list)
 
@@ -74,42 +85,145 @@ def movies():
 
     Renders the movies.html template to display movie screenings.
 
+    If a POST request is received:
+        - Reads a single 'date', or a 'start_date' and 'end_date' range, plus optional 'theater_id' and 'movie_id' filters.
+        - Retrieves all matching screenings with one range query on the screening_listing read model,
+          which already holds the theater name and movie title, so no join is needed.
+        - Groups the screenings by date, theater and movie before rendering.
+
     Returns:
         Response: The rendered template.
     """
-    # Retrieve all theater objects from the database
-    theater_list = Theater.query.all()
-    # Retrieve available screening dates (only showing 7 days from today)
-    screening_date = db.session.query(Screening).filter(Screening.date >= datetime.today().date()).group_by(Screening.date).all()
+    # Read from the read replica when it is enabled, otherwise from the database
+    reader = read_session()
+    # Retrieve all theater and movie objects from the database for the filters
+    theater_list = reader.query(Theater).all()
+    movie_options = reader.query(Movie).order_by(Movie.title).all()
+    # Retrieve available screening dates (only showing dates from today) from the distinct-dates index
+    screening_date = reader.query(ScreeningDate).filter(ScreeningDate.date >= datetime.today().date()).order_by(ScreeningDate.date).all()
     
     if request.method == "POST":
-        # Get the selected date from the form submission
-        date = request.form.get("date")
-        # Get screening times and associated theater and movie information for the selected date
-        screening_list = (db.session.query(Screening, Theater, Movie)
-                          .join(Theater)
-                          .join(Movie)
-                          .filter(Screening.date == date)
-                          ).all()
-        # Get distinct movie information for the selected date and group by theater name and movie title
-        movie_list = (db.session.query(Screening, Theater, Movie)
-                          .join(Theater)
-                          .join(Movie)
-                          .filter(Screening.date == date)
-                          .group_by(Theater.name, Movie.title)
-                          ).all()
-        # Render the movies.html template and pass the retrieved data to the template, showing users the page with list of movies on the desired date
+        # Get the selected date range from the form submission, a single date is a range of one day
+        start_date = parse_date(request.form.get("start_date") or request.form.get("date"))
+        end_date = parse_date(request.form.get("end_date")) or start_date
+        if start_date is None:
+            flash("Please choose a date.", category='error')
+            return redirect(url_for('views.movies'))
+        if end_date < start_date:
+            flash("The end date must not be before the start date.", category='error')
+            return redirect(url_for('views.movies'))
+        # Limit the range, so one request cannot render the whole schedule
+        max_days = current_app.config.get('MAX_LISTING_DAYS', 14)
+        if (end_date - start_date).days >= max_days:
+            flash(f"Please choose a range of at most {max_days} days.", category='error')
+            return redirect(url_for('views.movies'))
+        # Get the optional theater and movie filters
+        theater_id = request.form.get("theater_id", type=int)
+        movie_id = request.form.get("movie_id", type=int)
+
+        if current_app.config['SCHEDULE_STORE']:
+            # Take the screenings of the range from the compact in-memory schedule of this worker, without a query
+            screening_list = schedule_store(current_app._get_current_object()).entries(start_date, end_date, theater_id, movie_id)
+        else:
+            # Get screening times with their theater and movie information for the whole range in one query on the listing,
+            # whose index already has the page order (date, theater name, movie title, time).
+            # With sharding the same query runs on every shard (or only on the filtered theater's shard) and the results are merged.
+            sessions = [shard_session(theater_id)] if theater_id and sharding_enabled() else read_sessions()
+            screening_list = []
+            for session in sessions:
+                query = session.query(ScreeningListing).filter(ScreeningListing.date.between(start_date, end_date))
+                if theater_id:
+                    query = query.filter(ScreeningListing.theater_id == theater_id)
+                if movie_id:
+                    query = query.filter(ScreeningListing.movie_id == movie_id)
+                screening_list.extend(query.order_by(ScreeningListing.date, ScreeningListing.theater_name,
+                                                     ScreeningListing.movie_title, ScreeningListing.time).all())
+            if len(sessions) > 1:
+                screening_list.sort(key=lambda row: (row.date, row.theater_name, row.movie_title, row.time))
+
+        # Render the movies.html template and pass the grouped screenings to the template, showing users the page with list of movies in the desired range
         return render_template("movies.html", user=current_user, screening_date=screening_date, theater_list=theater_list,
-                                screening_list=screening_list, movie_list=movie_list, date=date)
+                               movie_options=movie_options, listing=group_screenings(screening_list),
+                               start_date=start_date, end_date=end_date, theater_id=theater_id, movie_id=movie_id)
     else:
         # Render the movies.html template with the available data, showing users the page to choose dates
-        return render_template("movies.html", user=current_user, theater_list=theater_list, screening_date=screening_date)
+        return render_template("movies.html", user=current_user, theater_list=theater_list, movie_options=movie_options,
+                               screening_date=screening_date)
+
+
+@views.route('/seatStream')
+@login_required
+def seat_updates():
+    """
+    Route for the live seat counts of the currentMovies page, sent as server-sent events.
+
+    The query string holds the 'start_date' and optional 'end_date' of the listing. The stream starts with the current
+    seat counts of those dates and then sends the new counts whenever a booking changes them.
+
+    Returns:
+        Response: The event stream, 400 for an invalid range, or 503 if too many streams are open.
+    """
+    start_date = parse_date(request.args.get("start_date"))
+    end_date = parse_date(request.args.get("end_date")) or start_date
+    if start_date is None or end_date < start_date or (end_date - start_date).days >= current_app.config.get('MAX_LISTING_DAYS', 14):
+        return Response("Invalid date range", status=400)
+    broadcaster = seat_broadcaster(current_app._get_current_object())
+    # Subscribe before reading the snapshot, so a booking in between is not missed
+    subscription = broadcaster.subscribe([start_date + timedelta(days=day) for day in range((end_date - start_date).days + 1)])
+    if subscription is None:
+        return Response("Too many open seat streams", status=503, headers={'Retry-After': '30'})
+    snapshot = seat_snapshot(start_date, end_date)
+    response = Response(seat_stream(subscription, snapshot, current_app.config['SEAT_STREAM_HEARTBEAT']),
+                        mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Unsubscribe when the connection ends, even if the stream never started
+    response.call_on_close(lambda: broadcaster.unsubscribe(subscription))
+    return response
+
+
+def parse_date(value):
+    """
+    Convert a date string from a form into a date object.
+
+    Args:
+        value (str or None): A date string in the YYYY-MM-DD format.
+
+    Returns:
+        date or None: The date, or None if the value is missing or invalid.
+    """
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        return None
+
+
+def group_screenings(screening_list):
+    """
+    Group screenings by date, theater and movie for the currentMovies page.
+
+    Args:
+        screening_list (list): ScreeningListing rows, ordered by date, theater name, movie title and time.
+
+    Returns:
+        list: A list of (date, theaters) pairs, where theaters is a list of (theater name, movies) pairs
+            and movies is a list of (movie title, screenings) pairs.
+    """
+    listing = []
+    # The list is already ordered, so each group is a run of consecutive rows
+    for date, date_rows in groupby(screening_list, key=lambda row: row.date):
+        theaters = []
+        for theater, theater_rows in groupby(date_rows, key=lambda row: row.theater_name):
+            movies = [(movie, list(movie_rows)) for movie, movie_rows in groupby(theater_rows, key=lambda row: row.movie_title)]
+            theaters.append((theater, movies))
+        listing.append((date, theaters))
+    return listing
             
 
 # Defining route and view for the getTIcket page ('/getTicket' route) with the ticket function. 
 @views.route('/getTicket', methods=['GET', 'POST'])
 # '@login_required' ensures only authenticated (logged in) users can access the page.
 @login_required
+# '@admission_control' lets only a few requests per screening in at a time and queues the others when ADMISSION_CONTROL is on.
+@admission_control
 def ticket():
     """
     Route for the getTicket page, rendering the ticket page and handling ticket booking.
@@ -117,14 +231,15 @@ def ticket():
     If a POST request is received:
         - If the form contains the selected screening ID:
             - Retrieve the selected screening details.
-            - Render the ticket.html template with the screening details.
+            - Render the ticket.html template with the screening details and a new idempotency key.
         - If the form contains the number of tickets:
             - Retrieve the number of tickets and the selected screening ID.
+            - If the idempotency key of the form was already used, answer with the result of the first submission without booking again.
             - Retrieve the details of the selected screening.
             - If there are not enough tickets available:
                 - Display an error message and redirect to the movies page.
             - If there are enough tickets available:
-                - Book the tickets and update the screening and booking data.
+                - Book the tickets and update the screening and booking data (in a micro-batch with other bookings if GROUP_COMMIT is on).
                 - Write the booking data to the booking.csv file.
                 - Update the available seats of the booked screening in the screening.csv file.
                 - Display a success message and redirect to the booking page.
@@ -139,178 +254,221 @@ def ticket():
         if request.form.get("screening_id"):
             # Retrieve the selected screening details
             screening = request.form.get("screening_id")
-            # Get screening times and associated theater and movie information for the selected date
-            screening_desired = (db.session.query(Screening, Theater, Movie)
-                            .join(Theater)
-                            .join(Movie)
-                            .filter(Screening.id == screening)
-                            ).first()
-
-            return render_template("ticket.html", user=current_user, screening=screening_desired)
+            # Use the shard that stores the screening's theater (the normal session when sharding is disabled)
+            session = screening_session(screening, request.form.get("theater_id"))
+            # Get the screening time with its theater and movie information from the listing
+            screening_desired = session.get(ScreeningListing, screening)
+
+            # Every rendered ticket form gets its own idempotency key, so resubmitting the same form books only once
+            return render_template("ticket.html", user=current_user, screening=screening_desired,
+                                   idempotency_key=new_idempotency_key())
         
         # When get the number of ticket user want
         elif request.form.get('number_of_ticket'):
             # Retrieve the number of tickets and the selected screening ID
             number = request.form.get('number_of_ticket')
             screening_id = request.form.get('booked_screening')
-            # Get the details of the selected screening
-            screening_desired = (db.session.query(Screening, Theater, Movie)
-                            .join(Theater)
-                            .join(Movie)
-                            .filter(Screening.id == screening_id)
-                            ).first()
-            
+
+            # Claim the idempotency key of the form before doing any booking work,
+            # in the database file (shard) that stores the screening, so the booking writes to that file only
+            booking_request = None
+            idempotency_key = request.form.get('idempotency_key')
+            key_session = screening_session(screening_id, request.form.get("booked_theater"))
+            if idempotency_key and len(idempotency_key) <= 64:
+                booking_request = claim_idempotency_key(idempotency_key, current_user.id, key_session)
+                # A repeated submission of the same form gets the original result back instead of a second booking
+                if booking_request is None:
+                    return repeated_submission(idempotency_key, "You've successfully booked the ticket!", key_session)
+
+            # Describe the booking, the theater tells the router which shard stores the screening
+            reservation = Reservation(screening_id, number, current_user.id,
+                                      current_user.first_name + " " + current_user.last_name,
+                                      theater_id=request.form.get("booked_theater"),
+                                      idempotency_key=idempotency_key if booking_request is not None else None)
+            # Book the tickets and update the screening and booking data, in the database and the csv files.
+            # With group commit the batcher books it together with the other bookings arriving at the same time.
+            try:
+                if current_app.config['GROUP_COMMIT']:
+                    # End this request's transaction first, so waiting requests do not hold the database connections the batcher needs
+                    db.session.commit()
+                    booking_batcher(current_app._get_current_object()).submit(reservation).result()
+                else:
+                    reserve_batch([reservation], get_csv_paths())
+            except Exception:
+                # The booking failed, so release the key and let a retry book again
+                if booking_request is not None:
+                    release_idempotency_key(booking_request, key_session)
+                raise
+
             # If not enough ticket available
-            if int(number) > screening_desired[0].available_seats:
+            if not reservation.booked:
                 # Validate ticket availability
-                left = screening_desired[0].available_seats
+                left = reservation.seats_left
+                # Nothing was booked, so release the key and let a retry be evaluated again
+                if booking_request is not None:
+                    release_idempotency_key(booking_request, key_session)
                 flash(f"There are only {left} tickets left for this screening. Please try to book again.", category='error')
                 return redirect(url_for('views.movies'))
             # if there are enough tickets
             else:
-                # Book the tickets and update the screening and booking data
-                new_number_of_seats = screening_desired[0].available_seats - int(number)
-                print(new_number_of_seats)
-                # write new booking to booking database default already has timestamp
-                booking = Booking(number_of_tickets=number, user_id=current_user.id)
-                # add new booking data to booking database
-                db.session.add(booking)
-                db.session.commit()
-                # update screening's available seats
-                screening_desired[0].available_seats = new_number_of_seats
-
-                # link new booking to screening query the screening we want to append booking to in screening_booking
-                screening_booking = Screening.query.filter(Screening.id == screening_id).first()
-                screening_booking.bookings.append(booking)
-                db.session.commit()
-
-                working_directory = Path(__file__).absolute().parent
-                path_booking = os.path.join(working_directory, "static", "booking.csv")
-                path_screening = os.path.join(working_directory, "static", "screening.csv")
-
-                # Write data into booking.csv
-                booking_list = Booking.query.all()
-                booking_list_count = Booking.query.count()
-                
-                fieldnames_booking = [
-                    'transaction_id', 
-                    'user_id', 
-                    'customer_name', 
-                    'number_of_tickets', 
-                    'date', 
-                    'time', 
-                    'movie_id', 
-                    'screening_id',
-                    'timestamp'
-                ]
-
-                # if creating booking for the first time
-                if booking_list_count == 1:
-                    # Write booking data to the booking.csv file
-                    with open(path_booking, 'w') as file_booking:
-                        writer = csv.DictWriter(file_booking, fieldnames=fieldnames_booking)
-                        writer.writeheader()
-                        for booking in booking_list:
-                            row = {
-                                'transaction_id': booking.id, 
-                                'user_id': booking.user_id,
-                                'customer_name': (current_user.first_name + " " + current_user.last_name),
-                                'number_of_tickets': booking.number_of_tickets,
-                                'date': booking.screenings[0].date, 
-                                'time': booking.screenings[0].time, 
-                                'movie_id': booking.screenings[0].movie_id,
-                                'screening_id': booking.screenings[0].id,
-                                'timestamp': booking.timestamp
-                            }
-                            writer.writerow(row)
-
-                # if there are old booking already exists
-                else:
-                    # Append new booking entry to the booking.csv file
-                    with open(path_booking, 'a', newline='') as file_booking:
-                        writer = csv.DictWriter(file_booking, fieldnames=fieldnames_booking)
-                        row = {
-                            'transaction_id': booking.id, 
-                            'user_id': booking.user_id,
-                            'customer_name': (current_user.first_name + " " + current_user.last_name),
-                            'number_of_tickets': booking.number_of_tickets,
-                            'date': booking.screenings[0].date, 
-                            'time': booking.screenings[0].time, 
-                            'movie_id': booking.screenings[0].movie_id,
-                            'screening_id': booking.screenings[0].id,
-                            'timestamp': booking.timestamp
-                        }
-                        writer.writerow(row)
-
-                # update available seats of the booked screening in screening csv file
-                screening_list = Screening.query.all()
-
-                # Create a temporary file in write mode ("w") to hold new values
-                tempfile = NamedTemporaryFile(mode="w", delete=False)
-                # Fieldnames are the columns for the csv file we wish to update
-                fieldnames = [
-                    'id',
-                    'date',
-                    'time',
-                    'available_seats',
-                    'theater_id',
-                    'movie_id'
-                ]
-
-                
-                # Open the csv file in read more ("r")
-                # Then write into the temporary file first
-                with open(path_screening, 'r') as file_screening, tempfile:
-                    # Create reader and writer objects using csv library.
-                    reader = csv.DictReader(file_screening, fieldnames=fieldnames)
-                    writer = csv.DictWriter(tempfile, fieldnames=fieldnames)
-
-                    # Loop every row in the screening file
-                    for row_s in reader:
-                        #  Change the value of available seats if id is the booked screening id.
-                        if row_s["id"] == screening_id:
-                            row_s["available_seats"] = new_number_of_seats
-
-                        # write row into the temporary file
-                        row = {
-                            'id': row_s["id"],
-                            'date': row_s["date"],
-                            'time': row_s["time"],
-                            'available_seats': row_s["available_seats"],
-                            'theater_id': row_s["theater_id"],
-                            'movie_id': row_s["movie_id"],
-                        }
-                        writer.writerow(row)
-
-                # Move the temporary file to original csv.file, replacing the original screening.csv
-                # shutil.move(source, destination) 
-                shutil.move(tempfile.name, path_screening)
-
+                # Read this user's pages from the database until the read replica has the new booking
+                pin_reads_to_primary()
                 flash("You've successfully booked the ticket!", category='success')
                 return redirect(url_for('views.booking'))
 
 
 
+def repeated_submission(idempotency_key, success_message, session):
+    """
+    Answer a repeated submission of a ticket form with the result of the first submission, without booking again.
+
+    Args:
+        idempotency_key (str): The idempotency key of the form, already claimed by the first submission.
+        success_message (str): The message of a successful booking.
+        session (Session): The session of the database file that stores the booked screening and the key.
+
+    Returns:
+        Response: A redirect to the booking page, or to the movies page if the first submission booked nothing.
+    """
+    booking_request = find_idempotency_key(idempotency_key, current_user.id, session)
+    # The first submission failed and released the key in the meantime (or the key is another user's)
+    if booking_request is None:
+        flash("The booking was not completed. Please try to book again.", category='error')
+        return redirect(url_for('views.movies'))
+    # The first submission is still booking, its booking ID is stored when it commits
+    if booking_request.booking_id is None:
+        flash("Your booking is still being processed. Please check your bookings again in a moment.", category='success')
+        return redirect(url_for('views.booking'))
+    flash(success_message, category='success')
+    return redirect(url_for('views.booking'))
+
+
+def parse_group_selection(values):
+    """
+    Parse the screenings chosen for a group booking.
+
+    Args:
+        values (list): Form values of the form '<theater ID>:<screening ID>'.
+
+    Returns:
+        list: (screening ID, theater ID) pairs without duplicates, in the order they were chosen. Invalid values are skipped.
+    """
+    selection = {}
+    for value in values:
+        theater_id, _, screening_id = value.partition(':')
+        if theater_id.isdigit() and screening_id.isdigit():
+            selection.setdefault(int(screening_id), int(theater_id))
+    return list(selection.items())
+
+
+# Defining route and view for the groupTicket page ('/groupTicket' route) with the group_ticket function.
+@views.route('/groupTicket', methods=['POST'])
+# '@login_required' ensures only authenticated (logged in) users can access the page.
+@login_required
+def group_ticket():
+    """
+    Route for the groupTicket page, booking several screenings at once, all or nothing.
+
+    If the form contains the screenings chosen on the currentMovies page:
+        - Retrieve the chosen screenings and render the group_ticket.html template with a new idempotency key.
+    If the form contains the screenings to book:
+        - If the idempotency key of the form was already used, answer with the result of the first submission without booking again.
+        - Book the number of tickets chosen for every screening in one transaction.
+        - If one screening does not have enough tickets left, nothing is booked: display an error message and redirect to the movies page.
+        - Otherwise display a success message and redirect to the booking page.
+
+    Returns:
+        Response: The rendered template or a redirect response.
+    """
+    limit = current_app.config['GROUP_BOOKING_MAX_SCREENINGS']
+    # The screenings chosen on the currentMovies page, or the screenings of the submitted group form
+    booking_form = bool(request.form.getlist('booked_screenings'))
+    selection = parse_group_selection(request.form.getlist('booked_screenings' if booking_form else 'screening_ids'))
+    if not selection:
+        flash("Choose the screenings to book together.", category='error')
+        return redirect(url_for('views.movies'))
+    if len(selection) > limit:
+        flash(f"A group booking can have at most {limit} screenings.", category='error')
+        return redirect(url_for('views.movies'))
+
+    customer_name = current_user.first_name + " " + current_user.last_name
+    reservations = [Reservation(screening_id, request.form.get(f"tickets_{screening_id}", type=int) or 1,
+                                current_user.id, customer_name, theater_id=theater_id)
+                    for screening_id, theater_id in selection]
+    # Only screenings stored in the same database file can be booked in one transaction
+    session = group_session(reservations)
+    if session is None:
+        flash("These screenings cannot be booked together. Please book them one by one.", category='error')
+        return redirect(url_for('views.movies'))
+
+    if not booking_form:
+        # Get the chosen screenings with their theater and movie information from the listing
+        screenings = (session.query(ScreeningListing)
+                      .filter(ScreeningListing.screening_id.in_([screening_id for screening_id, _ in selection]))
+                      .order_by(ScreeningListing.date, ScreeningListing.time)
+                      .all())
+        return render_template("group_ticket.html", user=current_user, screenings=screenings,
+                               idempotency_key=new_idempotency_key())
+
+    # Claim the idempotency key of the form before doing any booking work
+    booking_request = None
+    idempotency_key = request.form.get('idempotency_key')
+    if idempotency_key and len(idempotency_key) <= 64:
+        booking_request = claim_idempotency_key(idempotency_key, current_user.id, session)
+        # A repeated submission of the same form gets the original result back instead of a second booking
+        if booking_request is None:
+            return repeated_submission(idempotency_key, "You've successfully booked the tickets!", session)
+        # The key remembers the first booking of the group
+        reservations[0].idempotency_key = idempotency_key
+
+    # Book every screening in one transaction, with one write per csv file
+    try:
+        reserve_group(reservations, get_csv_paths())
+    except Exception:
+        # The booking failed, so release the key and let a retry book again
+        if booking_request is not None:
+            release_idempotency_key(booking_request, session)
+        raise
+    if not reservations[0].booked:
+        # Nothing was booked, so release the key and let a retry be evaluated again
+        if booking_request is not None:
+            release_idempotency_key(booking_request, session)
+        flash("Nothing was booked, one of the screenings does not have enough tickets left. Please try to book again.", category='error')
+        return redirect(url_for('views.movies'))
+    # Read this user's pages from the database until the read replica has the new bookings
+    pin_reads_to_primary()
+    flash(f"You've successfully booked the tickets for {len(reservations)} screenings!", category='success')
+    return redirect(url_for('views.booking'))
+
+
 @views.route('/myBooking', methods=['GET', 'POST'])
 @login_required
 def booking():
     """
     Route for the myBooking page.
 
-    Renders the booking page to display the user's booking history.
+    Renders the booking page to display the user's booking history, including archived bookings of past screenings.
 
     Returns:
         Response: The rendered template with user's booking history.
     """
-    # Retrieve the user's bookings
-    book = Booking.query.filter(Booking.user_id == current_user.id)
-    # Retrieve the booking history including related screening, theater, and movie details
-    booking_history = (db.session.query(Booking, Screening, Theater, Movie)
-                       # Booking is the table on the left
-                        .join(Screening, Booking.screenings)
-                        .join(Theater)
-                        .join(Movie)
-                        .filter(Booking.user_id == current_user.id)
+    # Retrieve the booking history including the screening, theater, and movie details from the listing.
+    # With sharding the same query runs on every shard and the results are merged.
+    sessions = read_sessions()
+    booking_history = []
+    for session in sessions:
+        booking_history.extend(session.query(Booking, ScreeningListing)
+                               # Booking is the table on the left
+                               .join(screening_booking, screening_booking.c.booking_id == Booking.id)
+                               .join(ScreeningListing, ScreeningListing.screening_id == screening_booking.c.screening_id)
+                               .filter(Booking.user_id == current_user.id)
+                               .all())
+    if len(sessions) > 1:
+        booking_history.sort(key=lambda history: history[0].id)
+    # Retrieve the bookings of past screenings that were moved into the archive
+    archived_history = (read_session().query(ArchivedBooking)
+                        .filter(ArchivedBooking.user_id == current_user.id)
+                        .order_by(ArchivedBooking.date.desc(), ArchivedBooking.time.desc())
                         ).all()
     # Render the booking.html template and pass user data to the template, showing users the page of his booking history
-    return render_template("booking.html", user=current_user, booking_history=booking_history)
\ No newline at end of file
+    return render_template("booking.html", user=current_user, booking_history=booking_history, archived_history=archived_history)
\ No newline at end of file